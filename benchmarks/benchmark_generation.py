@@ -0,0 +1,174 @@
+#benchmarks scenario generation throughput for every generator over a sweep of num_scens and num_sams
+#reports scenarios/sec, bytes written, peak memory and time per stage, and writes it all to json so later runs can be compared for regressions
+#run from the repository root: python benchmarks/benchmark_generation.py --output bench.json [--compare old_bench.json]
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scenario_generator import DefaultGen, LineGen, GapLineGen, CircleGen
+
+STAGES = ("gen_sam", "gen_jet", "gen_target", "gen_lua_script", "gen_csv_file")
+
+# the zones from main_file
+ZONES = {
+    'zone_1': [10, 25, -10, 30],
+    'zone_2': [-20, 10, 20, 30],
+    'zone_3': [30, 60, 60, 110],
+    'zone_4': [25, 40, 70, 110],
+    'zone_5': [45, 50, 0, 40],
+    'zone_6': [30, 60, -110, -100],
+    'zone_7': [35, 40, -110, -80],
+    'zone_8': [50, 60, -120, -100],
+    'zone_9': [-10, 0, -70, -60],
+    'zone_10': [-20, -10, -60, -50],
+    'zone_11': [-30, -20, 130, 140],
+}
+SAM_DBID, JET_DBID, TARGET_DBID = 543, 4892, 1426
+RADIUS = 6
+
+
+def make_generator(name, num_scens, num_sams):
+    """
+    Builds one of the four generators with the ids and zones from main_file
+    """
+    if name == "DefaultGen":
+        return DefaultGen(SAM_DBID, JET_DBID, TARGET_DBID, num_scens, ZONES)
+    if name == "LineGen":
+        return LineGen(num_sams, SAM_DBID, JET_DBID, TARGET_DBID, num_scens, ZONES)
+    if name == "GapLineGen":
+        return GapLineGen(num_sams, SAM_DBID, JET_DBID, TARGET_DBID, num_scens, ZONES)
+    if name == "CircleGen":
+        return CircleGen(num_sams, RADIUS, SAM_DBID, JET_DBID, TARGET_DBID, num_scens, ZONES)
+    raise ValueError(f"unknown generator '{name}'")
+
+
+def time_stages(generator):
+    """
+    Wraps the stage methods of a generator instance so the time spent in each is added up, returns the dict of totals
+    """
+    timings = {stage: 0.0 for stage in STAGES}
+
+    def timed(stage, method):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                timings[stage] += time.perf_counter() - start
+        return wrapper
+
+    for stage in STAGES:
+        setattr(generator, stage, timed(stage, getattr(generator, stage)))
+    return timings
+
+
+def bytes_under(directory):
+    """
+    Total size of every file under directory
+    """
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, files in os.walk(directory) for name in files)
+
+
+def run_case(name, num_scens, num_sams, output_mode, measure_memory=True, writer_threads=0):
+    """
+    Generates one case in a fresh temporary directory and returns its measurements
+    Peak memory is measured on a second run under tracemalloc, so the tracing does not slow down the timed run
+    """
+    cwd = os.getcwd()
+    result = {"generator": name, "num_scens": num_scens, "num_sams": num_sams, "output_mode": output_mode, "writer_threads": writer_threads}
+    try:
+        with tempfile.TemporaryDirectory() as run_dir:
+            os.chdir(run_dir)
+            generator = make_generator(name, num_scens, num_sams)
+            timings = time_stages(generator)
+
+            start = time.perf_counter()
+            generator.generate_scenario(output_mode=output_mode, resume=False, writer_threads=writer_threads)
+            seconds = time.perf_counter() - start
+
+            result.update(seconds=seconds, scenarios_per_sec=num_scens / seconds, bytes_written=bytes_under("scenario_data"),
+                          stages=timings)
+
+        if measure_memory:
+            with tempfile.TemporaryDirectory() as run_dir:
+                os.chdir(run_dir)
+                tracemalloc.start()
+                make_generator(name, num_scens, num_sams).generate_scenario(output_mode=output_mode, resume=False, writer_threads=writer_threads)
+                result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+    finally:
+        os.chdir(cwd)
+    return result
+
+
+def compare(results, baseline_file, threshold):
+    """
+    Prints the throughput of every case against the same case in a previous results file, returns the cases that got slower than threshold
+    """
+    with open(baseline_file) as f:
+        baseline = {(r["generator"], r["num_scens"], r["num_sams"], r["output_mode"], r.get("writer_threads", 0)): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        key = (result["generator"], result["num_scens"], result["num_sams"], result["output_mode"], result["writer_threads"])
+        if key not in baseline:
+            continue
+        ratio = result["scenarios_per_sec"] / baseline[key]["scenarios_per_sec"]
+        print(f"{key}: {ratio:.2f}x of baseline")
+        if ratio < 1 - threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scenario generation throughput per generator and per stage")
+    parser.add_argument("--generators", nargs="*", default=["DefaultGen", "LineGen", "GapLineGen", "CircleGen"])
+    parser.add_argument("--num-scens", nargs="*", type=int, default=[1000, 10000])
+    parser.add_argument("--num-sams", nargs="*", type=int, default=[4, 10])
+    parser.add_argument("--output-modes", nargs="*", default=["files"], choices=["files", "archive"])
+    parser.add_argument("--writer-threads", nargs="*", type=int, default=[0], help="0 runs unpipelined, more runs the write pipeline with that many threads")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run that measures peak memory")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", default=None, help="earlier results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.1, help="fraction of throughput lost that counts as a regression")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.generators:
+        # the default generator always has exactly one sam, so there is nothing to sweep
+        sweep = [1] if name == "DefaultGen" else args.num_sams
+        for num_scens in args.num_scens:
+            for num_sams in sweep:
+                for output_mode in args.output_modes:
+                    for writer_threads in args.writer_threads:
+                        result = run_case(name, num_scens, num_sams, output_mode, not args.no_memory, writer_threads)
+                        stages = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in result["stages"].items())
+                        print(f"{name} num_scens={num_scens} num_sams={num_sams} {output_mode} writer_threads={writer_threads}: "
+                              f"{result['scenarios_per_sec']:.0f} scenarios/sec, {result['bytes_written']} bytes ({stages})")
+                        results.append(result)
+
+    with open(args.output, "w") as f:
+        json.dump({"meta": {"timestamp": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                            "numpy": np.__version__, "platform": platform.platform(), "cpus": os.cpu_count()},
+                   "results": results}, f, indent=1)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} cases regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
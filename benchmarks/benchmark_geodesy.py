@@ -0,0 +1,75 @@
+#micro-benchmark of the great-circle kernel in geodesy.py, reports points/sec for each function over a sweep of batch sizes
+#run from the repository root: python benchmarks/benchmark_geodesy.py [--batch-sizes 1000 100000] [--output geodesy_bench.json]
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from geodesy import destination_point, offset_point, great_circle_distance, initial_bearing
+
+
+def make_points(batch_size, seed=0):
+    """
+    Random start points, bearings, distances and end points for a batch
+    """
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(-80, 80, batch_size)
+    longs = rng.uniform(-180, 180, batch_size)
+    bearings = rng.uniform(0, 360, batch_size)
+    distances = rng.uniform(0, 1000, batch_size)
+    end_lats, end_longs = destination_point(lats, longs, bearings, distances)
+    return lats, longs, bearings, distances, end_lats, end_longs
+
+
+def time_call(function, args, min_seconds):
+    """
+    Calls function(*args) until min_seconds have passed, returns the best time of one call
+    """
+    best = float("inf")
+    total = 0.0
+    while total < min_seconds:
+        start = time.perf_counter()
+        function(*args)
+        seconds = time.perf_counter() - start
+        best = min(best, seconds)
+        total += seconds
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the batch throughput of the great-circle kernel")
+    parser.add_argument("--batch-sizes", nargs="*", type=int, default=[100, 10000, 1000000])
+    parser.add_argument("--min-seconds", type=float, default=0.5, help="time spent on each function and batch size")
+    parser.add_argument("--output", default=None, help="also write the results to this json file")
+    args = parser.parse_args()
+
+    results = []
+    for batch_size in args.batch_sizes:
+        lats, longs, bearings, distances, end_lats, end_longs = make_points(batch_size)
+        cases = {"destination_point": (destination_point, (lats, longs, bearings, distances)),
+                 "offset_point": (offset_point, (lats, longs, distances, distances)),
+                 "great_circle_distance": (great_circle_distance, (lats, longs, end_lats, end_longs)),
+                 "initial_bearing": (initial_bearing, (lats, longs, end_lats, end_longs))}
+
+        for name, (function, function_args) in cases.items():
+            seconds = time_call(function, function_args, args.min_seconds)
+            results.append({"function": name, "batch_size": batch_size, "seconds": seconds, "points_per_sec": batch_size / seconds})
+            print(f"{name} batch_size={batch_size}: {batch_size / seconds / 1e6:.1f} M points/sec")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": {"timestamp": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                                "numpy": np.__version__, "platform": platform.platform()},
+                       "results": results}, f, indent=1)
+        print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,111 @@
+#plots where the sams, jets and targets of the generated scenarios spawn on the globe, to check that each generator is spawning correctly
+#the metadata is loaded with the vectorized csv parser and drawn as density layers, so millions of scenarios plot in seconds
+
+import argparse
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
-import ast
-
-
-#open the file to read
-parent_dir = Path.cwd()  
-meta_data_dir = parent_dir.parent / "scenario_data" / "metadata"
-meta_data_file = f"{meta_data_dir}/Scenario_1.csv"
-df=pd.read_csv(meta_data_file)
-
-#create the list of lats and longs for the sams in order to plot them
-df['sam_locations']=df['sam_locations'].apply(ast.literal_eval)
-sam_lats=[]
-for coord in df['sam_locations']:
-    sam_lats.append(coord[0][0])
-sam_lons=[]
-for coord in df['sam_locations']:
-    sam_lons.append(coord[1][1])
-
-#create the map projection
-fig, ax=plt.subplots(figsize=(10, 5), subplot_kw={'projection':ccrs.PlateCarree()})
-ax.add_feature(cfeature.COASTLINE)
-ax.add_feature(cfeature.BORDERS)
-ax.set_global()
-
-#plot the sam sites
-ax.scatter(sam_lons, sam_lats, color='red', marker='o', s=10, transform=ccrs.PlateCarree())
-
-plt.title("Visualization of Scenarios")
-plt.show()
+
+from metadata_reader import load_all_metadata, sam_arrays, SCENARIO_TYPES
+
+ROLES = ("sam", "jet", "target")
+ROLE_COLORMAPS = {"sam": "Reds", "jet": "Blues", "target": "Greens"}
+
+
+def load_scenarios(metadata_dir, types=None, sample=None, seed=0):
+    """
+    Loads the metadata of the given scenario types (all of them by default) into one DataFrame
+    With sample set, at most that many scenarios are kept, picked at random
+    """
+    frames = list(load_all_metadata(metadata_dir, types).values())
+    if not frames:
+        raise FileNotFoundError(f"no scenario metadata found in {metadata_dir}")
+
+    # the types have different numbers of sams, the missing sam columns are filled with NaN
+    df = pd.concat(frames, ignore_index=True)
+    if sample is not None and len(df) > sample:
+        df = df.sample(n=sample, random_state=seed)
+    return df
+
+
+def role_points(df, role):
+    """
+    Returns the latitudes and longitudes of every unit of a role ("sam", "jet" or "target") in the DataFrame as flat arrays
+    """
+    if role == "sam":
+        lats, lons = sam_arrays(df)
+        lats, lons = lats.ravel(), lons.ravel()
+        keep = ~np.isnan(lats)
+        return lats[keep], lons[keep]
+    return df[f"{role}_lat"].to_numpy(), df[f"{role}_lon"].to_numpy()
+
+
+def draw_density(ax, lats, lons, role, kind="hexbin", gridsize=180):
+    """
+    Draws one density layer on a map axis, either a log-scaled hexbin or a 2D histogram
+    """
+    if kind == "hexbin":
+        return ax.hexbin(lons, lats, gridsize=gridsize, bins="log", mincnt=1, cmap=ROLE_COLORMAPS[role], transform=ccrs.PlateCarree())
+
+    counts, lon_edges, lat_edges = np.histogram2d(lons, lats, bins=[2*gridsize, gridsize], range=[[-180, 180], [-90, 90]])
+    counts = np.ma.masked_equal(counts.T, 0)
+    return ax.pcolormesh(lon_edges, lat_edges, counts, cmap=ROLE_COLORMAPS[role], transform=ccrs.PlateCarree())
+
+
+def plot_density(df, roles=ROLES, facet=None, kind="hexbin", gridsize=180):
+    """
+    Plots one map per role, with facet="split" or facet="zone" there is a row of maps for every split or zone
+    """
+    facets = [(None, df)] if facet is None else [(value, group) for value, group in df.groupby(facet, sort=True)]
+
+    fig, axes = plt.subplots(len(facets), len(roles), figsize=(6*len(roles), 3.2*len(facets)),
+                             subplot_kw={'projection': ccrs.PlateCarree()}, squeeze=False)
+
+    for row, (value, group) in enumerate(facets):
+        for col, role in enumerate(roles):
+            ax = axes[row][col]
+            ax.add_feature(cfeature.COASTLINE, linewidth=0.4)
+            ax.add_feature(cfeature.BORDERS, linewidth=0.2)
+            ax.set_global()
+
+            lats, lons = role_points(group, role)
+            if len(lats):
+                layer = draw_density(ax, lats, lons, role, kind, gridsize)
+                fig.colorbar(layer, ax=ax, shrink=0.7, label="scenarios")
+
+            title = f"{role} ({len(lats)})" if value is None else f"{facet} {value}: {role} ({len(lats)})"
+            ax.set_title(title, fontsize=9)
+
+    fig.suptitle("Visualization of Scenarios")
+    return fig
+
+
+def main():
+    # by default look next to the folder we are run from, where the generators write their scenario_data
+    default_dir = Path.cwd().parent / "scenario_data" / "metadata"
+
+    parser = argparse.ArgumentParser(description="Plot the spawn density of sams, jets and targets of the generated scenarios")
+    parser.add_argument("--metadata-dir", default=str(default_dir))
+    parser.add_argument("--types", nargs="*", default=None, choices=SCENARIO_TYPES, help="scenario types to load, all of them by default")
+    parser.add_argument("--roles", nargs="*", default=list(ROLES), choices=ROLES)
+    parser.add_argument("--sample", type=int, default=None, help="plot at most this many scenarios, picked at random")
+    parser.add_argument("--facet", choices=["split", "zone"], default=None, help="one row of maps per split or per zone")
+    parser.add_argument("--kind", choices=["hexbin", "hist2d"], default="hexbin")
+    parser.add_argument("--gridsize", type=int, default=180, help="number of hexagons or histogram cells across the latitude range")
+    parser.add_argument("--output", default=None, help="save the figure here instead of showing it")
+    args = parser.parse_args()
+
+    df = load_scenarios(args.metadata_dir, args.types, args.sample)
+    fig = plot_density(df, args.roles, args.facet, args.kind, args.gridsize)
+
+    if args.output:
+        fig.savefig(args.output, dpi=150, bbox_inches="tight")
+    else:
+        plt.show()
+
+
+if __name__ == "__main__":
+    main()
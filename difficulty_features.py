@@ -0,0 +1,247 @@
+#difficulty features of every scenario, computed in batch by the generators and kept in the store next to the scenario rows (<type>.features)
+#CurriculumIndex sorts the rows of a store by one feature inside every type, split and zone, so picking scenarios within a band of
+#difficulty is a binary search per group instead of a scan, and the sorted order is cached next to the store for the next run
+#run from the repository root: python difficulty_features.py Scenario_1 -n 20000 --low 0.2 --high 0.6 [--split train] [--feature difficulty]
+
+import argparse
+import os
+import numpy as np
+
+from geodesy import KM_PER_DEGREE, great_circle_distance, segment_distance
+from metadata_reader import find_metadata_dir, load_store
+from scenario_store import FEATURE_DTYPE
+
+# a path that comes this close to a SAM (the spacing of a line of SAMs) counts as fully exposed to it
+THREAT_RANGE_KM = 2 * KM_PER_DEGREE
+
+# scenarios with this many SAMs or more count as fully crowded
+DIFFICULTY_MAX_SAMS = 8
+
+CURRICULUM_INDEX_FILE = "{}_{}.curriculum.npz"
+
+
+def closest_approach(batch):
+    """
+    Returns how close in km the straight (great circle) path from the jet to the target passes to any SAM, NaN padding is ignored
+    """
+    distances = segment_distance(batch.jet_lat[:, None], batch.jet_long[:, None], batch.target_lat[:, None], batch.target_long[:, None],
+                                 batch.sam_lats, batch.sam_longs)
+    return np.fmin.reduce(distances, axis=1)
+
+
+def nearest_sam(lat, long, batch):
+    """
+    Returns the distance in km from every (lat, long) of a batch to its nearest SAM, NaN padding is ignored
+    """
+    return np.fmin.reduce(great_circle_distance(lat[:, None], long[:, None], batch.sam_lats, batch.sam_longs), axis=1)
+
+
+def sam_spacing(batch):
+    """
+    Returns the distance in km between the two closest SAMs of every scenario of a batch, NaN with a single SAM
+    """
+    first, second = np.triu_indices(batch.sam_lats.shape[1], k=1)
+    if len(first) == 0:
+        return np.full(len(batch), np.nan)
+    distances = great_circle_distance(batch.sam_lats[:, first], batch.sam_longs[:, first], batch.sam_lats[:, second], batch.sam_longs[:, second])
+    return np.fmin.reduce(distances, axis=1)
+
+
+def opening_width(batch):
+    """
+    Returns the width in km of the opening left by batch.removed_sam, the distance between the SAMs that were on either side of it
+    Works for a gap in a line (never at its ends) and an opening in a ring (where the first and last SAM are neighbours)
+    """
+    rows = np.arange(len(batch))
+    num_sams = batch.sam_lats.shape[1]
+    before, after = (batch.removed_sam - 1) % num_sams, batch.removed_sam % num_sams
+    return great_circle_distance(batch.sam_lats[rows, before], batch.sam_longs[rows, before], batch.sam_lats[rows, after], batch.sam_longs[rows, after])
+
+
+def difficulty_score(closest_approach_km, num_sams):
+    """
+    Scores how hard a scenario is from 0 to 1, the mean of how close the straight path to the target comes to a SAM (within THREAT_RANGE_KM)
+    and how many SAMs there are (up to DIFFICULTY_MAX_SAMS). Only a starting point, CurriculumIndex can sort by any feature
+    """
+    proximity = np.clip(1 - closest_approach_km / THREAT_RANGE_KM, 0, 1)
+    crowding = np.clip(num_sams / DIFFICULTY_MAX_SAMS, 0, 1)
+    return (proximity + crowding) / 2
+
+
+def scenario_features(batch, gap_km=None, line_bearing=None):
+    """
+    Returns the FEATURE_DTYPE rows of a placed batch, gap_km and line_bearing are given by the generators that have them and NaN otherwise
+    """
+    features = np.empty(len(batch), dtype=FEATURE_DTYPE)
+    features["jet_target_km"] = great_circle_distance(batch.jet_lat, batch.jet_long, batch.target_lat, batch.target_long)
+    features["closest_approach_km"] = closest_approach(batch)
+    features["jet_nearest_sam_km"] = nearest_sam(batch.jet_lat, batch.jet_long, batch)
+    features["target_nearest_sam_km"] = nearest_sam(batch.target_lat, batch.target_long, batch)
+    features["sam_spacing_km"] = sam_spacing(batch)
+    features["gap_km"] = np.nan if gap_km is None else gap_km
+    features["line_bearing"] = np.nan if line_bearing is None else line_bearing
+    features["difficulty"] = difficulty_score(features["closest_approach_km"], batch.sam_lats.shape[1])
+    return features
+
+
+def _equal_shares(available, n, rng):
+    """
+    Splits n picks as evenly as possible over groups holding available rows each, groups that run out pass their share on to the others
+    """
+    shares = np.zeros(len(available), dtype=np.int64)
+    remaining = n
+    while remaining > 0:
+        open_groups = rng.permutation(np.flatnonzero(shares < available))
+        if len(open_groups) == 0:
+            break
+        give = np.full(len(open_groups), remaining // len(open_groups))
+        give[:remaining % len(open_groups)] += 1
+        give = np.minimum(give, available[open_groups] - shares[open_groups])
+        shares[open_groups] += give
+        remaining -= int(give.sum())
+    return shares
+
+
+class CurriculumIndex():
+    """
+    Rows of a scenario store sorted by one feature inside every (type, split, zone) group, for picking scenarios by difficulty.
+    query returns store rows, store.scenarios["seed"][rows] are their seeds and store[row] their ScenarioRecords.
+    Attributes:
+        store (ScenarioStore): Store the rows index into.
+        feature (String): Feature the rows are sorted by, a field of FEATURE_DTYPE or num_sams.
+        order (ndarray): Store rows sorted by group and then by feature, NaN last in its group.
+        values (ndarray): Feature value of every row in order.
+        group_starts (ndarray): Rows of group g are order[group_starts[g]:group_starts[g + 1]].
+    """
+
+    def __init__(self, metadata_dir, type_of_scenario, feature="difficulty", rebuild=False):
+        """
+        Opens the store of a scenario type and its sorted order, which is built and cached next to the store unless a cache for every row exists
+        """
+        metadata_dir = find_metadata_dir(metadata_dir, type_of_scenario)
+        self.store = load_store(metadata_dir, type_of_scenario)
+        if self.store.features is None:
+            raise ValueError(f"the store of {type_of_scenario} in {metadata_dir} was written without features, generate it again to query it")
+        if feature not in FEATURE_DTYPE.names and feature != "num_sams":
+            raise ValueError(f"feature must be one of {list(FEATURE_DTYPE.names) + ['num_sams']}, got '{feature}'")
+        self.feature = feature
+
+        scenarios = self.store.scenarios
+        num_splits, num_zones = len(self.store.splits), len(self.store.zones)
+        num_groups = len(self.store.types) * num_splits * num_zones
+        column = np.asarray(scenarios[feature] if feature == "num_sams" else self.store.features[feature], dtype=np.float64)
+
+        cache_file = os.path.join(metadata_dir, CURRICULUM_INDEX_FILE.format(type_of_scenario, feature))
+        cached = None
+        if not rebuild and os.path.exists(cache_file):
+            with np.load(cache_file) as cache:
+                if int(cache["rows"]) == len(self.store):
+                    cached = cache["order"], cache["group_starts"]
+
+        if cached is None:
+            keys = (scenarios["type"].astype(np.int64) * num_splits + scenarios["split"]) * num_zones + scenarios["zone"]
+            self.order = np.lexsort((column, keys))
+            self.group_starts = np.searchsorted(keys[self.order], np.arange(num_groups + 1))
+            # the cache is replaced rather than rewritten, an extended version may share the old one through a hard link
+            try:
+                np.savez(cache_file + ".tmp.npz", rows=len(self.store), order=self.order, group_starts=self.group_starts)
+                os.replace(cache_file + ".tmp.npz", cache_file)
+            except OSError:
+                pass
+        else:
+            self.order, self.group_starts = cached
+        self.values = column[self.order]
+
+
+    def _group(self, type_index, split_index, zone_index):
+        return (type_index * len(self.store.splits) + split_index) * len(self.store.zones) + zone_index
+
+
+    def _ranges(self, low, high, split, zones, type_of_scenario):
+        """
+        Returns the zone index, start and stop into order of the rows of every matching group with low <= feature <= high
+        """
+        types = range(len(self.store.types)) if type_of_scenario is None else [self.store.types.index(type_of_scenario)]
+        splits = range(len(self.store.splits)) if split is None else [self.store.splits.index(split)]
+        zone_indices = range(len(self.store.zones)) if zones is None else [self.store.zones.index(zone) for zone in zones]
+
+        ranges = []
+        for type_index in types:
+            for split_index in splits:
+                for zone_index in zone_indices:
+                    group = self._group(type_index, split_index, zone_index)
+                    start, stop = self.group_starts[group], self.group_starts[group + 1]
+                    values = self.values[start:stop]
+                    ranges.append((zone_index, start + np.searchsorted(values, low, side="left"), start + np.searchsorted(values, high, side="right")))
+        return ranges
+
+
+    def count(self, low=-np.inf, high=np.inf, split=None, zones=None, type_of_scenario=None):
+        """
+        Returns {zone: number of scenarios with low <= feature <= high}
+        """
+        counts = dict.fromkeys(self.store.zones if zones is None else zones, 0)
+        for zone_index, start, stop in self._ranges(low, high, split, zones, type_of_scenario):
+            counts[self.store.zones[zone_index]] += int(stop - start)
+        return counts
+
+
+    def query(self, n, low=-np.inf, high=np.inf, split="train", zones=None, type_of_scenario=None, stratify=True, seed=0):
+        """
+        Returns the sorted store rows of n scenarios with low <= feature <= high, picked at random without replacement
+        With stratify the picks are spread evenly over the zones (zones short of scenarios give the rest to the others),
+        otherwise every matching scenario is equally likely. split, zones and type_of_scenario narrow the scenarios down, None means any
+        Raises ValueError if fewer than n scenarios match
+        """
+        rng = np.random.default_rng(seed)
+        ranges = self._ranges(low, high, split, zones, type_of_scenario)
+        sizes = np.array([stop - start for zone_index, start, stop in ranges], dtype=np.int64)
+        if sizes.sum() < n:
+            raise ValueError(f"only {sizes.sum()} scenarios have {low} <= {self.feature} <= {high}, {n} were asked for")
+
+        if stratify:
+            range_zones = np.array([zone_index for zone_index, start, stop in ranges], dtype=np.int64)
+            zone_list = np.unique(range_zones)
+            zone_shares = _equal_shares(np.array([sizes[range_zones == zone].sum() for zone in zone_list]), n, rng)
+            picks = np.zeros(len(ranges), dtype=np.int64)
+            for zone, share in zip(zone_list, zone_shares):
+                in_zone = np.flatnonzero(range_zones == zone)
+                picks[in_zone] = rng.multivariate_hypergeometric(sizes[in_zone], share)
+        else:
+            picks = rng.multivariate_hypergeometric(sizes, n)
+
+        rows = [self.order[start + rng.choice(stop - start, pick, replace=False)] for (zone_index, start, stop), pick in zip(ranges, picks) if pick]
+        return np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+
+
+    def seeds(self, rows):
+        """
+        Returns the seeds of store rows
+        """
+        return np.asarray(self.store.scenarios["seed"][rows])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick scenarios of a generated dataset within a band of difficulty, stratified by zone")
+    parser.add_argument("type", help="scenario type (or mix name) to pick from")
+    parser.add_argument("-n", type=int, required=True, help="scenarios to pick")
+    parser.add_argument("--low", type=float, default=-np.inf)
+    parser.add_argument("--high", type=float, default=np.inf)
+    parser.add_argument("--feature", default="difficulty", help=f"one of {list(FEATURE_DTYPE.names) + ['num_sams']}")
+    parser.add_argument("--split", default="train")
+    parser.add_argument("--no-stratify", action="store_true", help="pick uniformly instead of evenly per zone")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--metadata-dir", default=os.path.join("scenario_data", "metadata"))
+    parser.add_argument("--output", default=None, help="file to write the picked seeds to, one per line")
+    args = parser.parse_args()
+
+    index = CurriculumIndex(args.metadata_dir, args.type, args.feature)
+    print(f"{args.type} {args.split} scenarios with {args.low} <= {args.feature} <= {args.high}: {index.count(args.low, args.high, args.split)}")
+    seeds = index.seeds(index.query(args.n, args.low, args.high, args.split, stratify=not args.no_stratify, seed=args.seed))
+    if args.output is not None:
+        np.savetxt(args.output, seeds, fmt="%d")
+        print(f"Wrote {len(seeds)} seeds to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#vectorized great-circle kernel shared by the scenario generators
+#every function works element-wise on NumPy arrays (or scalars) with broadcasting, so a whole batch of units is placed in one call
+#distances are in km on a sphere of EARTH_RADIUS_KM, bearings in degrees clockwise from north
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+# length of one degree of arc along a great circle, the generators still take their spacings in these degrees
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+
+
+def wrap_longitude(long):
+    """
+    Wraps longitudes into [-180, 180)
+    """
+    return (np.asarray(long) + 180) % 360 - 180
+
+
+def unwrap_longitude(long, reference):
+    """
+    Moves longitudes by whole turns to within 180 degrees of reference, so points on both sides of the antimeridian sort in order
+    Longitudes already within 180 degrees are returned unchanged, not recomputed
+    """
+    long = np.asarray(long)
+    return long + 360 * np.round((reference - long) / 360)
+
+
+def destination_point(lat, long, bearing, distance_km):
+    """
+    Returns the (lat, long) reached by travelling distance_km from (lat, long) along the great circle that starts out on bearing
+    """
+    phi1, lam1, theta = np.radians(lat), np.radians(long), np.radians(bearing)
+    delta = np.asarray(distance_km) / EARTH_RADIUS_KM
+
+    sin_phi1, cos_phi1 = np.sin(phi1), np.cos(phi1)
+    sin_delta, cos_delta = np.sin(delta), np.cos(delta)
+
+    sin_phi2 = np.clip(sin_phi1 * cos_delta + cos_phi1 * sin_delta * np.cos(theta), -1, 1)
+    lam2 = lam1 + np.arctan2(np.sin(theta) * sin_delta * cos_phi1, cos_delta - sin_phi1 * sin_phi2)
+    return np.degrees(np.arcsin(sin_phi2)), wrap_longitude(np.degrees(lam2))
+
+
+def offset_point(lat, long, north_km, east_km):
+    """
+    Moves (lat, long) by an offset given as km north and km east, the offset is turned into a bearing and a distance
+    so it keeps its length at any latitude instead of stretching like an offset in degrees of longitude does
+    """
+    return destination_point(lat, long, np.degrees(np.arctan2(east_km, north_km)), np.hypot(north_km, east_km))
+
+
+def great_circle_distance(lat1, long1, lat2, long2):
+    """
+    Haversine distance in km between two points
+    """
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    half_dphi = (phi2 - phi1) / 2
+    half_dlam = np.radians(np.subtract(long2, long1)) / 2
+    a = np.sin(half_dphi)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(half_dlam)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def initial_bearing(lat1, long1, lat2, long2):
+    """
+    Bearing in [0, 360) to set off on from the first point to reach the second along a great circle
+    """
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dlam = np.radians(np.subtract(long2, long1))
+    y = np.sin(dlam) * np.cos(phi2)
+    x = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(dlam)
+    return np.degrees(np.arctan2(y, x)) % 360
+
+
+def segment_distance(lat1, long1, lat2, long2, lat, long):
+    """
+    Distance in km from (lat, long) to the closest point of the great circle segment from the first point to the second
+    That is the cross-track distance when the point is abeam the segment, and the distance to the nearer end otherwise
+    """
+    start_distance = great_circle_distance(lat1, long1, lat, long) / EARTH_RADIUS_KM
+    length = great_circle_distance(lat1, long1, lat2, long2) / EARTH_RADIUS_KM
+    angle = np.radians(initial_bearing(lat1, long1, lat, long) - initial_bearing(lat1, long1, lat2, long2))
+
+    cross = np.arcsin(np.clip(np.sin(start_distance) * np.sin(angle), -1, 1))
+    along = np.arctan2(np.sin(start_distance) * np.cos(angle), np.cos(start_distance))
+    end_distance = great_circle_distance(lat2, long2, lat, long) / EARTH_RADIUS_KM
+    abeam = (along >= 0) & (along <= length)
+    return EARTH_RADIUS_KM * np.where(abeam, np.abs(cross), np.minimum(start_distance, end_distance))
@@ -0,0 +1,171 @@
+#optional telemetry for generate_scenario, per-stage wall time histograms, files and bytes written per split, and file open counts
+#when no Telemetry is passed to generate_scenario none of this runs, the generator only checks for None
+
+import cProfile
+import json
+import math
+import os
+import time
+
+# wall time histograms use log spaced bins, 10 per decade from 1 microsecond to 1000 seconds
+HISTOGRAM_MIN_EXPONENT = -6
+HISTOGRAM_BINS_PER_DECADE = 10
+HISTOGRAM_BINS = 9 * HISTOGRAM_BINS_PER_DECADE
+
+
+class Telemetry():
+    """
+    Collects timings and file counts during a generation run and writes a json summary at the end.
+    Every seed range records into its own Telemetry (so worker processes can send theirs back) which is merged into the run's one.
+    Attributes:
+        profile: None, True for cProfile, or any profiler with enable(), disable() and dump_stats(path) run around the hot loop.
+        stages (dict): {stage: [count, total seconds, max seconds, histogram counts]}.
+        splits (dict): {split: [files, bytes]}.
+        counters (dict): {name: count}, such as the opens of the files the run writes.
+    """
+
+    def __init__(self, profile=None):
+        self.profile = profile
+        self.stages = {}
+        self.splits = {}
+        self.counters = {"opens": 0}
+        self.scenarios = 0
+        self.wall_seconds = 0.0
+        self._profiler = None
+        self._started = None
+
+
+    def empty_copy(self):
+        """
+        Returns a Telemetry with nothing recorded, for a single seed range
+        """
+        return Telemetry()
+
+
+    def record_stage(self, stage, seconds):
+        """
+        Adds one timing of a stage to its histogram
+        """
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = [0, 0.0, 0.0, [0]*HISTOGRAM_BINS]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+        position = int((math.log10(max(seconds, 1e-9)) - HISTOGRAM_MIN_EXPONENT) * HISTOGRAM_BINS_PER_DECADE)
+        stats[3][min(max(position, 0), HISTOGRAM_BINS - 1)] += 1
+
+
+    def record_file(self, split, num_bytes):
+        """
+        Counts one file (or archive entry) of num_bytes written for a split
+        """
+        stats = self.splits.setdefault(split, [0, 0])
+        stats[0] += 1
+        stats[1] += num_bytes
+
+
+    def count(self, name, amount=1):
+        """
+        Adds to a counter such as "opens"
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+
+    def merge(self, other):
+        """
+        Adds everything recorded by another Telemetry to this one
+        """
+        for stage, (count, total, longest, histogram) in other.stages.items():
+            stats = self.stages.setdefault(stage, [0, 0.0, 0.0, [0]*HISTOGRAM_BINS])
+            stats[0] += count
+            stats[1] += total
+            stats[2] = max(stats[2], longest)
+            stats[3] = [a + b for a, b in zip(stats[3], histogram)]
+        for split, (files, num_bytes) in other.splits.items():
+            stats = self.splits.setdefault(split, [0, 0])
+            stats[0] += files
+            stats[1] += num_bytes
+        for name, amount in other.counters.items():
+            self.count(name, amount)
+        self.scenarios += other.scenarios
+
+
+    def start(self):
+        """
+        Starts the wall clock and the profiler, if there is one
+        """
+        self._started = time.perf_counter()
+        if self.profile is not None:
+            self._profiler = cProfile.Profile() if self.profile is True else self.profile
+            self._profiler.enable()
+
+
+    def stop(self):
+        """
+        Stops the wall clock and the profiler
+        """
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._started is not None:
+            self.wall_seconds += time.perf_counter() - self._started
+            self._started = None
+
+
+    def summary(self):
+        """
+        Returns everything recorded as a dict ready for json, with approximate percentiles read off the histograms
+        """
+        edges = [10 ** (HISTOGRAM_MIN_EXPONENT + i / HISTOGRAM_BINS_PER_DECADE) for i in range(HISTOGRAM_BINS + 1)]
+        stages = {}
+        for stage, (count, total, longest, histogram) in self.stages.items():
+            stages[stage] = {"count": count, "total_seconds": total, "mean_seconds": total / count if count else 0.0,
+                             "max_seconds": longest, "histogram_counts": histogram}
+            for percentile in (50, 90, 99):
+                stages[stage][f"p{percentile}_seconds"] = _histogram_percentile(histogram, edges, percentile)
+
+        return {"scenarios": self.scenarios, "wall_seconds": self.wall_seconds,
+                "scenarios_per_sec": self.scenarios / self.wall_seconds if self.wall_seconds else None,
+                "stages": stages, "histogram_edges_seconds": edges,
+                "splits": {split: {"files": files, "bytes": num_bytes} for split, (files, num_bytes) in self.splits.items()},
+                "counters": dict(self.counters)}
+
+
+    def write(self, summary_file):
+        """
+        Writes the summary json, and the profiler stats next to it as <name>.pstats
+        """
+        summary = self.summary()
+        if self._profiler is not None:
+            profile_file = os.path.splitext(str(summary_file))[0] + ".pstats"
+            self._profiler.dump_stats(profile_file)
+            summary["profile_file"] = profile_file
+
+        os.makedirs(os.path.dirname(str(summary_file)), exist_ok=True)
+        with open(summary_file, "w") as f:
+            json.dump(summary, f, indent=1)
+
+
+    def __getstate__(self):
+        """
+        The profiler stays in the process that started it
+        """
+        state = self.__dict__.copy()
+        state["_profiler"] = None
+        state["profile"] = None
+        return state
+
+
+def _histogram_percentile(histogram, edges, percentile):
+    """
+    Upper edge of the histogram bin the percentile falls in
+    """
+    total = sum(histogram)
+    if total == 0:
+        return None
+    running = 0
+    for i, count in enumerate(histogram):
+        running += count
+        if running * 100 >= percentile * total:
+            return edges[i + 1]
+    return edges[-1]
@@ -0,0 +1,263 @@
+#checks generated scenarios against the layout rules of the generator that made them, over whole metadata tables at once
+#every rule is a vectorized NumPy test on the (N,) unit and (N, SAMs) arrays of one scenario type, so millions of rows take seconds
+#usable as a test right after generation: assert_layout(load_metadata(metadata_dir, type)) raises if any scenario breaks a rule
+#python layout_checker.py --self-check generates every type in memory, in a zone straddling the antimeridian too, and checks it against the rules
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+from geodesy import KM_PER_DEGREE, great_circle_distance, initial_bearing, wrap_longitude, unwrap_longitude
+from metadata_reader import load_metadata, sam_arrays, find_metadata_dir, SCENARIO_TYPES
+from scenario_generator import SCENARIO_DATA_DIR, DefaultGen, LineGen, GapLineGen, CircleGen
+
+# slack in degrees of arc for the distance and latitude rules, the offsets are walked along great circles which bend a little off
+# a line of latitude, about a quarter of a degree for the longest offsets at 60 degrees north
+LAYOUT_TOLERANCE = 0.5
+
+# slack in degrees of bearing for the spacing of the SAMs around a circle
+BEARING_TOLERANCE = 1.0
+
+# DefaultGen offsets the jet 2.5 to 5 degrees south and the target 2.5 to 5 degrees north of the SAM, both up to 5 degrees east or west
+DEFAULT_MIN_OFFSET = 2.5
+DEFAULT_MAX_OFFSET = np.hypot(5, 5)
+
+# LineGen and GapLineGen spawn the jet from 2.5 degrees north of the northmost SAM to 2.5 degrees south of the southmost, and the
+# target from the latitudes of the SAMs moved 2.5 degrees south
+LINE_LAT_MARGIN = 2.5
+
+# SAMs after the second step this far from the one before them
+LINE_STEP = 2.0
+
+# CircleGen puts the jet 3 to 4 degrees outside the ring of SAMs
+CIRCLE_JET_MIN = 3.0
+CIRCLE_JET_MAX = 4.0
+
+# zones of the self check, the second one straddles the antimeridian so lines and rings across 180 degrees are checked too
+SELF_CHECK_ZONES = {"zone_1": [10, 25, -10, 30], "antimeridian": [-10, 10, 170, 179.9]}
+
+
+def _distance_degrees(lat1, long1, lat2, long2):
+    """
+    Great circle distance in degrees of arc, the unit the generators take their spacings in
+    """
+    return great_circle_distance(lat1, long1, lat2, long2) / KM_PER_DEGREE
+
+
+def default_rules(units, tolerance=LAYOUT_TOLERANCE):
+    """
+    Rules of DefaultGen (Scenario_0): the jet is south of the SAM, the target north of it, each 2.5 to 7.1 degrees away
+    Returns {rule: (N,) bool array}, True where a scenario breaks the rule
+    """
+    sam_lat, sam_long = units["sam_lats"][:, 0], units["sam_longs"][:, 0]
+    jet_distance = _distance_degrees(sam_lat, sam_long, units["jet_lat"], units["jet_long"])
+    target_distance = _distance_degrees(sam_lat, sam_long, units["target_lat"], units["target_long"])
+    return {"jet_south_of_sam": ~(units["jet_lat"] < sam_lat),
+            "target_north_of_sam": ~(units["target_lat"] > sam_lat),
+            "jet_distance": ~((jet_distance >= DEFAULT_MIN_OFFSET - tolerance) & (jet_distance <= DEFAULT_MAX_OFFSET + tolerance)),
+            "target_distance": ~((target_distance >= DEFAULT_MIN_OFFSET - tolerance) & (target_distance <= DEFAULT_MAX_OFFSET + tolerance))}
+
+
+def _line_side_rules(units, tolerance):
+    """
+    Rules LineGen and GapLineGen share, left and right of the line are west and east on a north up map like the generators use them
+    The jet is west of every SAM and within the latitudes of the line widened by 2.5 degrees, the target is east of every SAM but the
+    eastmost and within the latitudes of the line moved 2.5 degrees south
+    """
+    sam_lats, sam_longs, num_sams = units["sam_lats"], units["sam_longs"], units["num_sams"]
+    rows = np.arange(len(num_sams))
+    south, north = np.nanmin(sam_lats, axis=1), np.nanmax(sam_lats, axis=1)
+
+    # the longitudes are unwrapped around the first SAM so a line across the antimeridian sorts west to east,
+    # NaN padding sorts to the end, so the second eastmost of a row is at num_sams - 2
+    sorted_longs = np.sort(unwrap_longitude(sam_longs, sam_longs[:, :1]), axis=1)
+    westmost = sorted_longs[:, 0]
+    second_eastmost = sorted_longs[rows, np.maximum(num_sams - 2, 0)]
+
+    jet_lat, target_lat = units["jet_lat"], units["target_lat"]
+    return {"jet_west_of_sams": ~(wrap_longitude(westmost - units["jet_long"]) > 0),
+            "jet_latitude": ~((jet_lat >= south - LINE_LAT_MARGIN - tolerance) & (jet_lat <= north + LINE_LAT_MARGIN + tolerance)),
+            "target_east_of_sams": ~(wrap_longitude(units["target_long"] - second_eastmost) > 0),
+            "target_latitude": ~((target_lat >= south - LINE_LAT_MARGIN - tolerance) & (target_lat <= north - LINE_LAT_MARGIN + tolerance))}
+
+
+def _sam_steps(units):
+    """
+    Returns the (N, SAMs - 1) distances in degrees between consecutive SAMs of a line, NaN past the last SAM of a row
+    """
+    sam_lats, sam_longs = units["sam_lats"], units["sam_longs"]
+    return _distance_degrees(sam_lats[:, :-1], sam_longs[:, :-1], sam_lats[:, 1:], sam_longs[:, 1:])
+
+
+def line_rules(units, tolerance=LAYOUT_TOLERANCE):
+    """
+    Rules of LineGen (Scenario_1): the side rules plus a solid line, the first step is sam1_spacing and every later one 2 degrees
+    Returns {rule: (N,) bool array}, True where a scenario breaks the rule
+    """
+    rules = _line_side_rules(units, tolerance)
+    steps = _sam_steps(units)
+    expected = np.full(steps.shape[1], LINE_STEP)
+    expected[:1] = LineGen.sam1_spacing
+    # the comparison is False on NaN padding, which is what a missing step should count as
+    rules["sam_spacing"] = np.any(np.abs(steps - expected) > tolerance, axis=1)
+    return rules
+
+
+def gap_line_rules(units, tolerance=LAYOUT_TOLERANCE):
+    """
+    Rules of GapLineGen (Scenario_2): the side rules plus a line with exactly one gap, one step longer than any step of the line
+    before its SAM was taken out and every other step 2 degrees, or sam1_spacing for the first one
+    Returns {rule: (N,) bool array}, True where a scenario breaks the rule
+    """
+    rules = _line_side_rules(units, tolerance)
+    steps = _sam_steps(units)
+    valid = ~np.isnan(steps)
+    longest = max(LINE_STEP, GapLineGen.sam1_spacing)
+
+    gaps = valid & (steps > longest + tolerance)
+    # the first step is only sam1_spacing when the gap is not where the second SAM was
+    regular = valid & ~gaps & (np.abs(steps - LINE_STEP) > tolerance)
+    regular[:, 0] &= np.abs(steps[:, 0] - GapLineGen.sam1_spacing) > tolerance
+    rules["one_gap"] = gaps.sum(axis=1) != 1
+    rules["sam_spacing"] = regular.any(axis=1)
+    return rules
+
+
+def circle_rules(units, tolerance=LAYOUT_TOLERANCE, bearing_tolerance=BEARING_TOLERANCE):
+    """
+    Rules of CircleGen (Scenario_3): the SAMs sit on a ring around the target, evenly spaced with exactly one SAM missing,
+    and the jet is 3 to 4 degrees outside the ring. The radius is not in the metadata, it is taken as the median SAM distance
+    Returns {rule: (N,) bool array}, True where a scenario breaks the rule
+    """
+    sam_lats, sam_longs, num_sams = units["sam_lats"], units["sam_longs"], units["num_sams"]
+    target_lat, target_long = units["target_lat"][:, None], units["target_long"][:, None]
+
+    distances = _distance_degrees(target_lat, target_long, sam_lats, sam_longs)
+    radius = np.nanmedian(distances, axis=1)
+    on_ring = np.abs(distances - radius[:, None]) <= tolerance
+
+    # num_sams + 1 SAMs were spaced evenly before one was removed, so going round the ring every step is one spacing but one is two
+    bearings = np.sort(np.where(np.isnan(sam_lats), np.inf, initial_bearing(target_lat, target_long, sam_lats, sam_longs)), axis=1)
+    first = bearings[:, :1]
+    steps = np.diff(np.concatenate([bearings, first + 360], axis=1), axis=1)
+    # the wrap around step of a row with padding goes from its last real SAM, so rebuild it at num_sams - 1
+    rows = np.arange(len(num_sams))
+    steps[rows, num_sams - 1] = first[:, 0] + 360 - bearings[rows, num_sams - 1]
+    spacing = (360 / (num_sams + 1))[:, None]
+    real = np.arange(steps.shape[1])[None, :] < num_sams[:, None]
+    single = real & (np.abs(steps - spacing) <= bearing_tolerance)
+    double = real & (np.abs(steps - 2*spacing) <= bearing_tolerance)
+
+    jet_outside = _distance_degrees(units["target_lat"], units["target_long"], units["jet_lat"], units["jet_long"]) - radius
+    return {"sams_on_ring": np.any(real & ~on_ring, axis=1),
+            "one_opening": ~((double.sum(axis=1) == 1) & ((single | double) == real).all(axis=1)),
+            "jet_outside_ring": ~((jet_outside >= CIRCLE_JET_MIN - tolerance) & (jet_outside <= CIRCLE_JET_MAX + tolerance))}
+
+
+# the rules of each scenario type, mixes are checked row by row with the rules of the type of each row
+LAYOUT_RULES = {"Scenario_0": default_rules, "Scenario_1": line_rules, "Scenario_2": gap_line_rules, "Scenario_3": circle_rules}
+
+
+def layout_units(df):
+    """
+    Returns the unit arrays of a metadata DataFrame the rules work on, the SAM arrays are padded with NaN past num_sams
+    """
+    sam_lats, sam_longs = sam_arrays(df)
+    num_sams = df["num_sams"].to_numpy(dtype=np.int64) if "num_sams" in df else np.full(len(df), sam_lats.shape[1])
+    return {"sam_lats": sam_lats, "sam_longs": sam_longs, "num_sams": num_sams,
+            "jet_lat": df["jet_lat"].to_numpy(dtype=np.float64), "jet_long": df["jet_lon"].to_numpy(dtype=np.float64),
+            "target_lat": df["target_lat"].to_numpy(dtype=np.float64), "target_long": df["target_lon"].to_numpy(dtype=np.float64)}
+
+
+def batch_units(batch):
+    """
+    Returns the unit arrays of a ScenarioBatch the rules work on, so generated scenarios can be checked before anything is written
+    """
+    num_sams = getattr(batch, "num_sams", None)
+    return {"sam_lats": batch.sam_lats, "sam_longs": batch.sam_longs,
+            "num_sams": np.full(len(batch), batch.sam_lats.shape[1]) if num_sams is None else num_sams,
+            "jet_lat": batch.jet_lat, "jet_long": batch.jet_long, "target_lat": batch.target_lat, "target_long": batch.target_long}
+
+
+def self_check(num_scens=5000, tolerance=LAYOUT_TOLERANCE):
+    """
+    Generates num_scens scenarios of every type in SELF_CHECK_ZONES in memory and checks them against the rules of their type
+    Raises AssertionError listing how many scenarios break each rule, a regression test for the generators and the rules alike
+    """
+    generators = [DefaultGen(543, 4892, 1426, num_scens, SELF_CHECK_ZONES), LineGen(4, 543, 4892, 1426, num_scens, SELF_CHECK_ZONES),
+                  GapLineGen(4, 543, 4892, 1426, num_scens, SELF_CHECK_ZONES), CircleGen(4, 6, 543, 4892, 1426, num_scens, SELF_CHECK_ZONES)]
+    broken = {}
+    for generator in generators:
+        batch = generator.gen_batch(np.arange(num_scens, dtype=np.uint64))
+        for rule, rows in LAYOUT_RULES[generator.type_of_scenario](batch_units(batch), tolerance).items():
+            if rows.any():
+                broken[f"{generator.type_of_scenario} {rule}"] = int(rows.sum())
+        print(f"{generator.type_of_scenario}: checked {num_scens} scenarios")
+    if broken:
+        raise AssertionError("generated scenarios break a layout rule:\n" + "\n".join(f"  {rule}: {count}" for rule, count in broken.items()))
+
+
+def check_layout(df, tolerance=LAYOUT_TOLERANCE):
+    """
+    Checks every scenario of a metadata DataFrame (see load_metadata) against the layout rules of its scen_type
+    Returns a DataFrame with one row per broken rule: seed, scen_type, split, zone and rule. Types without rules are skipped
+    """
+    violations = []
+    for type_of_scenario, rows in df.groupby("scen_type", sort=False).indices.items():
+        if type_of_scenario not in LAYOUT_RULES:
+            continue
+        part = df.iloc[rows]
+        # rows of a mix have the SAM columns of its widest type, cut them back to this type's widest row
+        units = layout_units(part)
+        width = int(units["num_sams"].max())
+        units["sam_lats"], units["sam_longs"] = units["sam_lats"][:, :width], units["sam_longs"][:, :width]
+
+        for rule, broken in LAYOUT_RULES[type_of_scenario](units, tolerance).items():
+            broken_rows = np.flatnonzero(broken)
+            if len(broken_rows):
+                violations.append(part.iloc[broken_rows][["seed", "scen_type", "split", "zone"]].assign(rule=rule))
+
+    if not violations:
+        return pd.DataFrame(columns=["seed", "scen_type", "split", "zone", "rule"])
+    return pd.concat(violations, ignore_index=True)
+
+
+def assert_layout(df, tolerance=LAYOUT_TOLERANCE):
+    """
+    Raises AssertionError listing how many scenarios break each rule, for use as a test right after generation
+    """
+    violations = check_layout(df, tolerance)
+    if len(violations):
+        counts = violations.groupby(["scen_type", "rule"]).size()
+        raise AssertionError(f"{violations['seed'].nunique()} of {len(df)} scenarios break a layout rule:\n{counts.to_string()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check generated scenarios against the layout rules of their generator")
+    parser.add_argument("--metadata-dir", default=str(SCENARIO_DATA_DIR / "metadata"))
+    parser.add_argument("--types", nargs="*", default=None, help="scenario types (or mixes) to check, all four types by default")
+    parser.add_argument("--tolerance", type=float, default=LAYOUT_TOLERANCE, help="slack in degrees for the distance and latitude rules")
+    parser.add_argument("--self-check", action="store_true", help="check freshly generated scenarios of every type instead of a metadata folder")
+    args = parser.parse_args()
+
+    if args.self_check:
+        self_check(tolerance=args.tolerance)
+        print("Every generated scenario follows the layout rules")
+        return
+
+    for type_of_scenario in args.types or SCENARIO_TYPES:
+        metadata_dir = find_metadata_dir(args.metadata_dir, type_of_scenario)
+        try:
+            df = load_metadata(metadata_dir, type_of_scenario)
+        except FileNotFoundError:
+            continue
+        violations = check_layout(df, args.tolerance)
+        print(f"{type_of_scenario}: {violations['seed'].nunique()} of {len(df)} scenarios break a layout rule")
+        for (scen_type, rule), count in violations.groupby(["scen_type", "rule"]).size().items():
+            print(f"  {scen_type} {rule}: {count}")
+        violations.to_csv(os.path.join(metadata_dir, f"{type_of_scenario}_layout_violations.csv"), index=False)
+
+
+if __name__ == "__main__":
+    main()
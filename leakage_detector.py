@@ -0,0 +1,192 @@
+#finds scenarios that are the same or nearly the same but ended up in different splits (train/test/validate)
+#every scenario becomes a geometry feature vector, the vectors are bucketed on a grid so only neighbouring buckets are compared, which keeps it around O(N log N)
+#python leakage_detector.py --self-check runs find_leaks on a few made up scenarios with known leaks, padded mix rows and the antimeridian among them
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+from metadata_reader import load_all_metadata, load_metadata, sam_arrays, find_metadata_dir
+from metadata_writer import BASE_HEADERS, SAM_HEADERS
+from scenario_generator import SCENARIO_DATA_DIR
+from scenario_store import ScenarioStore, store_exists
+
+# when a train scenario leaks into test or validate the evaluation copy is the one that is dropped, test beats validate
+SPLIT_PRIORITY = {"train": 0, "test": 1, "validate": 2}
+
+
+def geometry_features(df):
+    """
+    Returns the (N, features) geometry of every scenario: target, jet and every SAM position in degrees, as (lat, long) column pairs
+    """
+    sam_lats, sam_lons = sam_arrays(df)
+    units = [df[["target_lat", "target_lon", "jet_lat", "jet_lon"]].to_numpy(dtype=np.float64)]
+    units.append(np.stack([sam_lats, sam_lons], axis=2).reshape(len(df), -1))
+    return np.concatenate(units, axis=1)
+
+
+def _neighbour_pairs(order, sorted_keys, chunk, target_keys):
+    """
+    Returns (i, j) index pairs between the scenarios in chunk and every scenario in the grid cell given for each of them by target_keys
+    """
+    lo = np.searchsorted(sorted_keys, target_keys, side="left")
+    hi = np.searchsorted(sorted_keys, target_keys, side="right")
+    counts = hi - lo
+
+    i = np.repeat(chunk, counts)
+    # position of each pair inside its run of matching cells, added to where that run starts
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = order[np.repeat(lo, counts) + within]
+    return i, j
+
+
+def find_leaks(features, splits, tolerance, chunk_size=200000):
+    """
+    Returns the (i, j, distance) of every pair of scenarios in different splits whose features are all within tolerance of each other
+    Features are (lat, long) column pairs like geometry_features makes them, longitude differences are taken across the antimeridian.
+    The SAM columns of a mix are padded with NaN, only rows padded the same way (with as many SAMs) are compared, over their real columns.
+    Distance is the largest feature difference (max-norm). The grid is built on the first two features (the target position)
+    with cells at least the size of the tolerance, so any pair within tolerance is in the same or a neighbouring cell.
+    The longitude cells go round the whole globe, so the last one neighbours the first.
+    """
+    splits = np.asarray(splits)
+    rows = np.floor(features[:, 0] / tolerance).astype(np.int64)
+    # with fewer than three cells round the globe a cell would neighbour the same cell on both sides, one cell holds everything then
+    columns = int(360 // tolerance)
+    columns = columns if columns >= 3 else 1
+    cols = np.floor((features[:, 1] + 180) / (360 / columns)).astype(np.int64) % columns
+    cell_keys = rows * columns + cols
+
+    order = np.argsort(cell_keys, kind="stable")
+    sorted_keys = cell_keys[order]
+
+    # half of the 3x3 neighbourhood as (row, column) steps, the other half is found from the other side of each pair
+    offsets = [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)] if columns > 1 else [(0, 0), (1, 0)]
+
+    found_i, found_j, found_distance = [], [], []
+    for start in range(0, len(features), chunk_size):
+        chunk = np.arange(start, min(start + chunk_size, len(features)))
+        for row_step, column_step in offsets:
+            target_keys = (rows[chunk] + row_step) * columns + (cols[chunk] + column_step) % columns
+            i, j = _neighbour_pairs(order, sorted_keys, chunk, target_keys)
+            keep = splits[i] != splits[j]
+            if (row_step, column_step) == (0, 0):
+                keep &= i < j
+            i, j = i[keep], j[keep]
+            padding = np.isnan(features[i])
+            same_units = (padding == np.isnan(features[j])).all(axis=1)
+            i, j, padding = i[same_units], j[same_units], padding[same_units]
+
+            difference = np.abs(features[i] - features[j])
+            difference[:, 1::2] = np.abs((difference[:, 1::2] + 180) % 360 - 180)
+            # fmax skips the NaN of the padding, the target columns are never padded so every row has a real maximum
+            distance = np.fmax.reduce(difference, axis=1)
+            close = distance <= tolerance
+            found_i.append(i[close])
+            found_j.append(j[close])
+            found_distance.append(distance[close])
+
+    return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_distance)
+
+
+def self_check():
+    """
+    Runs find_leaks on made up scenarios whose leaks are known and raises AssertionError if any is missed or made up
+    Rows 0 and 1 are the same 2 SAM scenario padded to 3 SAMs like a mix pads it, rows 2 and 3 straddle the antimeridian,
+    row 4 is a 3 SAM copy of row 0 with its padding filled in and row 5 is row 0 again but in the same split
+    """
+    nan = np.nan
+    features = np.array([[10, 20, 8, 18, 12, 22, 12, 24, nan, nan],
+                         [10, 20, 8, 18, 12, 22, 12, 24, nan, nan],
+                         [0, 179.98, 1, 179.9, 2, -179.99, 3, 179.5, 4, 179.6],
+                         [0, -179.99, 1, 179.92, 2, 179.99, 3, 179.5, 4, 179.6],
+                         [10, 20, 8, 18, 12, 22, 12, 24, 13, 25],
+                         [10, 20, 8, 18, 12, 22, 12, 24, nan, nan]])
+    splits = np.array(["train", "test", "train", "validate", "test", "train"])
+    i, j, distance = find_leaks(features, splits, 0.1)
+    found = sorted(zip(np.minimum(i, j).tolist(), np.maximum(i, j).tolist()))
+    expected = [(0, 1), (1, 5), (2, 3)]
+    if found != expected:
+        raise AssertionError(f"find_leaks found the pairs {found}, expected {expected}")
+
+
+def detect_leakage(metadata_dir, tolerance, types=None):
+    """
+    Runs find_leaks on the metadata of every scenario type, returns {type: DataFrame of leaking pairs}
+    Scenarios are only compared with scenarios of the same type, since different types never share a layout
+    """
+    leaks = {}
+    for type_of_scenario, df in load_all_metadata(metadata_dir, types).items():
+        i, j, distance = find_leaks(geometry_features(df), df["split"].to_numpy(), tolerance)
+        leaks[type_of_scenario] = pd.DataFrame({"seed_a": df["seed"].to_numpy()[i], "split_a": df["split"].to_numpy()[i],
+                                                "seed_b": df["seed"].to_numpy()[j], "split_b": df["split"].to_numpy()[j],
+                                                "distance": distance})
+    return leaks
+
+
+def seeds_to_prune(pairs):
+    """
+    Picks one scenario of every leaking pair to drop, the one in the lower priority split (validate, then test)
+    """
+    a_priority = pairs["split_a"].map(SPLIT_PRIORITY).to_numpy()
+    b_priority = pairs["split_b"].map(SPLIT_PRIORITY).to_numpy()
+    return np.unique(np.where(a_priority > b_priority, pairs["seed_a"].to_numpy(), pairs["seed_b"].to_numpy()))
+
+
+def write_pruned(metadata_dir, type_of_scenario, dropped):
+    """
+    Writes the metadata of a scenario type without the dropped seeds as the type <type>_pruned, in the layout the run wrote it:
+    the csv with the SAMs flat or in <type>_pruned_sams.csv, and the binary store, so load_metadata reads it back like the original
+    The original metadata is left alone so the run manifest stays valid
+    """
+    metadata_dir = find_metadata_dir(metadata_dir, type_of_scenario)
+    pruned_type = f"{type_of_scenario}_pruned"
+
+    if os.path.exists(os.path.join(metadata_dir, f"{type_of_scenario}.csv")):
+        df = load_metadata(metadata_dir, type_of_scenario)
+        df = df[~df["seed"].isin(dropped)]
+        if os.path.exists(os.path.join(metadata_dir, f"{type_of_scenario}_sams.csv")):
+            sam_lats, sam_lons = sam_arrays(df)
+            # padding of a mix with fewer SAMs is NaN, it was never written to the long table
+            keep = ~np.isnan(sam_lats)
+            sams = pd.DataFrame({SAM_HEADERS[0]: np.repeat(df["seed"].to_numpy(), sam_lats.shape[1]).reshape(sam_lats.shape)[keep],
+                                 SAM_HEADERS[1]: np.broadcast_to(np.arange(sam_lats.shape[1]), sam_lats.shape)[keep],
+                                 SAM_HEADERS[2]: sam_lats[keep], SAM_HEADERS[3]: sam_lons[keep]})
+            sams.to_csv(os.path.join(metadata_dir, f"{pruned_type}_sams.csv"), index=False)
+            df = df[BASE_HEADERS]
+        df.to_csv(os.path.join(metadata_dir, f"{pruned_type}.csv"), index=False)
+
+    if store_exists(metadata_dir, type_of_scenario):
+        store = ScenarioStore(metadata_dir, type_of_scenario)
+        store.write_rows(metadata_dir, pruned_type, np.flatnonzero(~np.isin(store.scenarios["seed"], dropped)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near duplicate scenarios that leak between train, test and validate")
+    parser.add_argument("--metadata-dir", default=str(SCENARIO_DATA_DIR / "metadata"))
+    parser.add_argument("--tolerance", type=float, default=0.1, help="largest difference in degrees between any two unit coordinates")
+    parser.add_argument("--types", nargs="*", default=None, help="scenario types to check, all of them by default")
+    parser.add_argument("--prune", action="store_true", help="write the metadata without the leaking evaluation scenarios as the type <type>_pruned")
+    parser.add_argument("--self-check", action="store_true", help="check find_leaks on made up scenarios with known leaks instead of a metadata folder")
+    args = parser.parse_args()
+
+    if args.self_check:
+        self_check()
+        print("find_leaks found every known leak")
+        return
+
+    for type_of_scenario, pairs in detect_leakage(args.metadata_dir, args.tolerance, args.types).items():
+        print(f"{type_of_scenario}: {len(pairs)} leaking pairs within {args.tolerance} degrees")
+        # the reports go next to the metadata they were made from, which for versioned output is the current version
+        metadata_dir = find_metadata_dir(args.metadata_dir, type_of_scenario)
+        pairs.to_csv(os.path.join(metadata_dir, f"{type_of_scenario}_leaks.csv"), index=False)
+
+        if args.prune:
+            dropped = seeds_to_prune(pairs)
+            write_pruned(metadata_dir, type_of_scenario, dropped)
+            print(f"{type_of_scenario}: pruned {len(dropped)} scenarios")
+
+
+if __name__ == "__main__":
+    main()
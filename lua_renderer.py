@@ -0,0 +1,247 @@
+#renders the lua scripts that CMO runs to build each scenario
+#the static parts of the script are built once per generator and each scenario is assembled in memory and written with a single write
+#with the "runtime" layout the static parts go into one shared scenario_runtime.lua and each scenario script is a single build_scenario call
+
+import os
+
+# everything before the units, the same for every scenario
+LUA_HEADER = """
+Tool_BuildBlankScenario()
+ScenEdit_SetTime({Date= "1.1.2030", Time= "00.00.00", StartDate = "1.1.2030", StartTime = "00.00.00", Duration = "0:02:00"})
+local endTime = os.date('%d/%m/%Y %H:%M:%S', ScenEdit_CurrentTime() + ((2*60)-1)*60)
+print(endTime)
+local file_path = "C:/Users/Brayden/Desktop/pycmo_recent/afrl_pycmo/pycmo/configs/scen_has_ended.txt"
+-- function here is meant to write false when the scenario starts, but for some reason it never hits this, so we worked
+-- with the semaphore idea instead, and write False to scen_has_ended through reset() in cmo_env.py
+-- no current trigger exists to use this function
+function mark_scenario_started()  
+    local file = io.open(file_path, "w")
+    if file then
+        file:write("False")
+        file:close()
+    else
+        error("Failed to open file: " .. file_path)
+    end
+end
+mark_scenario_started()
+
+ScenEdit_AddSide({side = "attacker_side"})
+ScenEdit_AddSide({side = "target_side"})
+ScenEdit_SetSideOptions({side = "attacker_side", awareness = 3})
+ScenEdit_SetSidePosture("attacker_side", "target_side", "H")
+ScenEdit_SetSidePosture("target_side", "attacker_side", "H")"""
+
+# one line per unit, the dbid and the coordinates get filled in with %s
+LUA_JET = """
+ScenEdit_AddUnit({type ='Aircraft', unitname ="shooter", dbid =%s, side = "attacker_side", Latitude =%s, Longitude =%s, Altitude = "4000 ft", LoadoutID = 33070})"""
+LUA_TARGET = """
+ScenEdit_AddUnit({type ='Facility', unitname ="target_ammo", dbid =%s, side = "target_side", Latitude =%s, Longitude =%s })"""
+LUA_SAM = """
+ScenEdit_AddUnit({type ='Facility', unitname ='sam', dbid =%s, side = 'target_side', Latitude = %s, Longitude = %s })"""
+
+# triggers, events and actions that end the scenario, the same for every scenario
+LUA_TRAILER = """
+ScenEdit_SetTrigger({
+    name = 'Trigger_Target_Ammo_Destroyed_Points',
+    mode = 'add',
+    type = 'UnitDestroyed',
+    targetfilter = {
+        SpecificUnitID = 'target_ammo',
+        TargetSide = 'target_side'
+    }
+})
+ScenEdit_SetTrigger({
+    name = 'Trigger_Target_Ammo_Destroyed_End',
+    mode = 'add',
+    type = 'UnitDestroyed',
+    targetfilter = {
+        SpecificUnitID = 'target_ammo',
+        TargetSide = 'target_side'
+    }
+})
+
+ScenEdit_SetTrigger({
+    name = "End_Scenario_Timelimit",
+    mode = 'add',
+    type = 'Time',
+    Time = endTime
+})
+
+ScenEdit_SetEvent('Scenario_Reached_Timelimit', {mode = 'add'})
+ScenEdit_SetEvent('Target_Ammo_Destroyed_GivePoints', {mode = 'add'})
+ScenEdit_SetEvent('Target_Ammo_Destroyed_EndScenario', {mode = 'add'})
+
+ScenEdit_SetEventTrigger('Scenario_Reached_Timelimit', {
+    mode = 'add',
+    description = 'End_Scenario_Timelimit'
+})
+
+ScenEdit_SetEventTrigger('Target_Ammo_Destroyed_GivePoints', {
+    mode = 'add',
+    description = 'Trigger_Target_Ammo_Destroyed_Points'
+})
+ScenEdit_SetEventTrigger('Target_Ammo_Destroyed_EndScenario', {
+    mode = 'add',
+    description = 'Trigger_Target_Ammo_Destroyed_End'
+})
+
+ScenEdit_SetAction({
+    mode = 'add',
+    description = 'give_points',
+    type = 'Points',
+    SideID = 'attacker_side',
+    PointChange = 1
+})
+
+ScenEdit_SetAction({
+    mode = 'add',
+    description = 'end_with_script',
+    type = 'LuaScript',
+    ScriptText = 'ScenEdit_EndScenario()'
+})
+
+ScenEdit_SetEventAction('Scenario_Reached_Timelimit', {
+    mode = 'add',
+    description = 'end_with_script'
+})
+-- Give points and end the scenario (if we destroy the target)
+ScenEdit_SetEventAction('Target_Ammo_Destroyed_GivePoints', {
+    mode = 'add',
+    description = 'give_points'
+})
+
+ScenEdit_SetEventAction('Target_Ammo_Destroyed_EndScenario', {
+    mode = 'add',
+    description = 'end_with_script'
+})
+
+Command_SaveScen("C:/Users/Brayden/Desktop/pycmo_recent/afrl_pycmo/scen/example_0.save")
+-- this function works and runs everytime because of the trigger on line 55
+function mark_scenario_ended()
+    local file = io.open(file_path, "w")
+    if file then
+        file:write("True")
+        file:close()
+    else
+        error("Failed to open file: " .. file_path)
+    end
+end
+
+ScenEdit_SetTrigger({name = 'Game_Ended_trigger', mode = 'add', type="ScenEnded"})
+ScenEdit_SetEvent('Game_ended_event',{mode = 'add'})
+ScenEdit_SetEventTrigger('Game_ended_event',{mode = 'add', description = 'Game_Ended_trigger'})
+ScenEdit_SetAction({mode='add', name="end_game_act", type="LuaScript", ScriptText = "mark_scenario_ended()"})
+ScenEdit_SetEventAction('Game_ended_event', {mode = 'add', description = 'end_game_act'})"""
+
+
+# "inline" puts the whole script in every scenario file, "runtime" puts the header and trailer in LUA_RUNTIME_FILE once
+SCRIPT_LAYOUTS = ("inline", "runtime")
+
+# the shared runtime is written next to the splits, CMO loads it from its Lua folder so it has to be copied there with the scenarios
+LUA_RUNTIME_FILE = "scenario_runtime.lua"
+
+# every runtime scenario script starts by loading the runtime, %s is its path
+LUA_RUNTIME_LOADER = """ScenEdit_RunScript("%s")"""
+
+# the units of the scenario come in through the table passed to build_scenario
+LUA_RUNTIME_UNITS = """
+ScenEdit_AddUnit({type ='Aircraft', unitname ="shooter", dbid =units.jet_dbid, side = "attacker_side", Latitude =units.jet[1], Longitude =units.jet[2], Altitude = "4000 ft", LoadoutID = 33070})
+ScenEdit_AddUnit({type ='Facility', unitname ="target_ammo", dbid =units.target_dbid, side = "target_side", Latitude =units.target[1], Longitude =units.target[2] })
+for _, sam in ipairs(units.sams) do
+    ScenEdit_AddUnit({type ='Facility', unitname ='sam', dbid =units.sam_dbid, side = 'target_side', Latitude = sam[1], Longitude = sam[2] })
+end"""
+
+# the same steps as an inline script, wrapped in a function so it runs once per scenario
+LUA_RUNTIME = ("-- shared by every generated scenario, each scenario script loads this and calls build_scenario with its units\n"
+               "function build_scenario(units)" + LUA_HEADER + LUA_RUNTIME_UNITS + LUA_TRAILER + "\nend\n")
+
+# the whole scenario script in the runtime layout, the loader and then the call with the units
+LUA_CALL = """
+build_scenario({jet_dbid = %s, target_dbid = %s, sam_dbid = %s, jet = {%s, %s}, target = {%s, %s}, sams = {%s}})
+"""
+
+
+class LuaRenderer():
+    """
+    Renders the lua script of a scenario in memory, the header, trailer and dbids are baked in once when the renderer is made.
+    Attributes:
+        sam_dbid (int): Database ID of the SAM sites.
+        jet_dbid (int): Database ID of the jet.
+        target_dbid (int): Database ID of the target.
+        layout (String): "inline" for self contained scripts or "runtime" for build_scenario calls, see SCRIPT_LAYOUTS.
+        runtime_path (String): Path of the shared runtime as CMO should load it, only used by the runtime layout.
+        made_dirs (set): Directories already created by write, cleared when the scenario folders are cleaned.
+    """
+
+    def __init__(self, sam_dbid, jet_dbid, target_dbid, layout="inline", runtime_path=LUA_RUNTIME_FILE):
+        """
+        Initializes the unit templates with the dbids filled in
+        """
+        if layout not in SCRIPT_LAYOUTS:
+            raise ValueError(f"layout must be one of {SCRIPT_LAYOUTS}, got '{layout}'")
+        self.sam_dbid = sam_dbid
+        self.jet_dbid = jet_dbid
+        self.target_dbid = target_dbid
+        self.layout = layout
+        self.runtime_path = runtime_path
+
+        # only the coordinates are left as %s after this
+        self._jet = LUA_JET % (jet_dbid, "%s", "%s")
+        self._target = LUA_TARGET % (target_dbid, "%s", "%s")
+        self._sam = LUA_SAM % (sam_dbid, "%s", "%s")
+        self._call = LUA_RUNTIME_LOADER % runtime_path + LUA_CALL % (jet_dbid, target_dbid, sam_dbid, "%s", "%s", "%s", "%s", "%s")
+
+        # keeps track of the directories we already made so we dont have to check the disk for every scenario
+        self.made_dirs = set()
+
+
+    def render(self, jet_lat, jet_long, target_lat, target_long, sam_lats, sam_longs):
+        """
+        Returns the lua script for one scenario as a string, sam_lats and sam_longs are lists of floats
+        """
+        if self.layout == "runtime":
+            sams = ", ".join("{%s, %s}" % sam for sam in zip(sam_lats, sam_longs))
+            return self._call % (jet_lat, jet_long, target_lat, target_long, sams)
+
+        parts = [LUA_HEADER, self._jet % (jet_lat, jet_long), self._target % (target_lat, target_long)]
+        parts.extend([self._sam % sam for sam in zip(sam_lats, sam_longs)])
+        parts.append(LUA_TRAILER)
+        return "".join(parts)
+
+
+    def render_bytes(self, batch, row):
+        """
+        Returns the lua script for one row of a ScenarioBatch as utf-8 bytes
+        Batches mixing generators pad their sam arrays, their num_sams says how many sams a row really has
+        """
+        num_sams = getattr(batch, "num_sams", None)
+        num_sams = batch.sam_lats.shape[1] if num_sams is None else num_sams[row]
+        return self.render(float(batch.jet_lat[row]), float(batch.jet_long[row]),
+                           float(batch.target_lat[row]), float(batch.target_long[row]),
+                           batch.sam_lats[row, :num_sams].tolist(), batch.sam_longs[row, :num_sams].tolist()).encode("utf-8")
+
+
+    def write_runtime(self, directory):
+        """
+        Writes the shared runtime into directory, returns its path
+        It is swapped in through a temporary file, a runtime hard linked from an earlier version is replaced rather than written through
+        """
+        os.makedirs(directory, exist_ok=True)
+        file_name = os.path.join(directory, LUA_RUNTIME_FILE)
+        with open(file_name + ".tmp", "w") as runtime_file:
+            runtime_file.write(LUA_RUNTIME)
+        os.replace(file_name + ".tmp", file_name)
+        return file_name
+
+
+    def write(self, file_name, script):
+        """
+        Writes the rendered script bytes to file_name with a single write, making the directory the first time it is seen
+        """
+        directory = os.path.dirname(file_name)
+        if directory not in self.made_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self.made_dirs.add(directory)
+
+        with open(file_name, "wb") as lua_file:
+            lua_file.write(script)
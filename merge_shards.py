@@ -0,0 +1,249 @@
+#combines the shards of a sharded generation run (generate_scenario(shard="k/n")) into one versioned dataset
+#each root stands in for a machine, its scenario_data/<type>/shard-<k>-of-<n>/current is one shard; on a single box all shards can share one root
+#the shards are checked for missing and duplicate seeds before anything is published, then their outputs are concatenated in seed order
+#run from the repository root: python merge_shards.py Scenario_1 node_0/scenario_data node_1/scenario_data [--output scenario_data] [--allow-missing]
+
+import argparse
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from output_versions import OutputVersions
+from run_manifest import RunManifest
+from scenario_archive import ArchiveReader, ArchiveWriter, archive_paths
+from scenario_generator import SCENARIO_DATA_DIR, SPLITS
+from scenario_store import ScenarioStore, store_paths, OFFSET_DTYPE
+
+_SHARD_DIR = re.compile(r"^shard-(\d+)-of-(\d+)$")
+
+
+class Shard():
+    """
+    The finished output of one shard.
+    Attributes:
+        k (int): Index of the shard.
+        n (int): Number of shards the seeds were split into.
+        version_dir (Path): Current version of the shard.
+        manifest (RunManifest): Manifest of the shard, with its config and finished seed ranges.
+    """
+
+    def __init__(self, k, n, version_dir, type_of_scenario):
+        self.k = k
+        self.n = n
+        self.version_dir = Path(version_dir)
+        self.manifest = RunManifest(self.version_dir / "metadata" / f"{type_of_scenario}_manifest.json")
+
+
+    def __repr__(self):
+        return f"Shard({self.k}/{self.n}, {self.version_dir})"
+
+
+def find_shards(roots, type_of_scenario):
+    """
+    Returns the Shard of every finished shard of a scenario type under the given scenario_data roots, sorted by shard index
+    """
+    shards = []
+    for root in roots:
+        type_dir = Path(root) / type_of_scenario
+        if not os.path.isdir(type_dir):
+            continue
+        for name in sorted(os.listdir(type_dir)):
+            match = _SHARD_DIR.match(name)
+            current = OutputVersions(type_dir / name).current() if match else None
+            if current is not None:
+                shards.append(Shard(int(match.group(1)), int(match.group(2)), current, type_of_scenario))
+    return sorted(shards, key=lambda shard: shard.k)
+
+
+def check_shards(shards, type_of_scenario):
+    """
+    Checks that the shards belong to one run and cover its seeds exactly once
+    Returns (config, num_scens, missing, duplicates): the config of the merged dataset, the number of seeds of the run,
+    the (start, stop) ranges of seeds no shard generated and the seeds more than one shard wrote. Raises ValueError if the shards do not belong together
+    """
+    if not shards:
+        raise ValueError(f"no finished shards of {type_of_scenario} found")
+
+    configs = []
+    for shard in shards:
+        config = dict(shard.manifest.data["config"])
+        if config.pop("shard") != [shard.k, shard.n]:
+            raise ValueError(f"{shard} holds the output of another shard, its manifest says {shard.manifest.data['config']['shard']}")
+        configs.append(config)
+    for shard, config in zip(shards[1:], configs[1:]):
+        if config != configs[0]:
+            raise ValueError(f"{shard} was generated with different settings than {shards[0]}")
+
+    config = configs[0]
+    num_scens = config.pop("num_scens")
+
+    # every seed should be in exactly one finished range, gaps are missing seeds (a whole missing shard or a run cut short)
+    ranges = sorted((r["start"], r["stop"]) for shard in shards for r in shard.manifest.data["ranges"])
+    missing = []
+    covered = 0
+    for start, stop in ranges:
+        if start > covered:
+            missing.append((covered, start))
+        covered = max(covered, stop)
+    if covered < num_scens:
+        missing.append((covered, num_scens))
+
+    # the same shard run on two machines, or overlapping ranges, writes some seeds twice
+    seeds = np.concatenate([ScenarioStore(shard.version_dir / "metadata", type_of_scenario).scenarios["seed"] for shard in shards])
+    unique, counts = np.unique(seeds, return_counts=True)
+    duplicates = unique[counts > 1]
+    return config, num_scens, missing, duplicates
+
+
+def merge_shards(type_of_scenario, roots=(SCENARIO_DATA_DIR,), output_root=SCENARIO_DATA_DIR, allow_missing=False):
+    """
+    Merges the shards of a scenario type found under roots into a new version of output_root/<type> and publishes it
+    Duplicate seeds always stop the merge, missing seeds only do without allow_missing. The merged manifest only records the ranges that
+    were generated, so a later generate_scenario with the same settings and no shard fills the missing seeds in
+    Returns the folder of the merged version
+    """
+    shards = find_shards(roots, type_of_scenario)
+    config, num_scens, missing, duplicates = check_shards(shards, type_of_scenario)
+    print(f"Found {len(shards)} of {shards[0].n} shards of {type_of_scenario} with {num_scens} seeds")
+
+    if len(duplicates):
+        raise ValueError(f"{len(duplicates)} seeds were written by more than one shard, the first ones are {duplicates[:10].tolist()}")
+    if missing:
+        print(f"{sum(stop - start for start, stop in missing)} seeds are missing: {missing[:10]}")
+        if not allow_missing:
+            raise ValueError("shards are missing seeds, generate them first or merge with allow_missing=True")
+
+    versions = OutputVersions(Path(output_root) / type_of_scenario)
+    version_dir = versions.create()
+    metadata_dir = version_dir / "metadata"
+    os.makedirs(metadata_dir)
+
+    file_sizes = {}
+    file_sizes.update(_merge_csv(shards, metadata_dir, f"{type_of_scenario}.csv"))
+    file_sizes.update(_merge_csv(shards, metadata_dir, f"{type_of_scenario}_sams.csv"))
+    file_sizes.update(_merge_store(shards, metadata_dir, type_of_scenario))
+    if config["output_mode"] == "archive":
+        for split in SPLITS:
+            file_sizes.update(_merge_archive(shards, version_dir / split, type_of_scenario))
+    else:
+        _link_lua_files(shards, version_dir)
+
+    manifest = RunManifest(metadata_dir / f"{type_of_scenario}_manifest.json")
+    manifest.start(config)
+    manifest.begin_run(0, num_scens)
+    manifest.record_ranges(sorted((r for shard in shards for r in shard.manifest.data["ranges"]), key=lambda r: r["start"]), file_sizes)
+    manifest.finish_run()
+
+    versions.publish(version_dir)
+    versions.collect_garbage()
+    print(f"Merged {len(shards)} shards into {version_dir}")
+    return version_dir
+
+
+def _merge_csv(shards, metadata_dir, name):
+    """
+    Concatenates a metadata csv of every shard that has it, keeping the header of the first, returns {file: size}
+    """
+    sources = [shard.version_dir / "metadata" / name for shard in shards if os.path.exists(shard.version_dir / "metadata" / name)]
+    if not sources:
+        return {}
+
+    target = metadata_dir / name
+    header = None
+    with open(target, "wb") as out:
+        for source in sources:
+            with open(source, "rb") as f:
+                first = f.readline()
+                if header is None:
+                    header = first
+                    out.write(first)
+                elif first != header:
+                    raise ValueError(f"{source} has different columns than {sources[0]}")
+                shutil.copyfileobj(f, out)
+    return {target: os.path.getsize(target)}
+
+
+def _merge_store(shards, metadata_dir, type_of_scenario):
+    """
+    Concatenates the binary stores of the shards, shifting the SAM offsets of each shard past the SAMs of the ones before it, returns {file: size}
+    """
+    header_file, scenario_file, sam_file, offset_file, feature_file = store_paths(metadata_dir, type_of_scenario)
+    headers = []
+    for shard in shards:
+        with open(store_paths(shard.version_dir / "metadata", type_of_scenario)[0]) as f:
+            headers.append(json.load(f))
+    tables = [{name: value for name, value in header.items() if name != "seed_ordered"} for header in headers]
+    if any(table != tables[0] for table in tables[1:]):
+        raise ValueError("the stores of the shards do not share their dtypes and type, zone and split tables")
+    # the shards are blocks of seeds in shard order, so the merged store is in seed order if every shard is
+    with open(header_file, "w") as f:
+        json.dump(dict(tables[0], seed_ordered=all(header.get("seed_ordered", False) for header in headers)), f, indent=1)
+
+    num_sam_coords = 0
+    with open(scenario_file, "wb") as scenarios, open(sam_file, "wb") as sams, open(offset_file, "wb") as offsets, open(feature_file, "wb") as features:
+        offsets.write(np.zeros(1, dtype=OFFSET_DTYPE).tobytes())
+        for shard in shards:
+            store = ScenarioStore(shard.version_dir / "metadata", type_of_scenario)
+            scenarios.write(np.ascontiguousarray(store.scenarios).tobytes())
+            features.write(np.ascontiguousarray(store.features).tobytes())
+            sams.write(np.ascontiguousarray(store.sam_coords[:store.offsets[-1]]).tobytes())
+            offsets.write((np.asarray(store.offsets[1:]) + num_sam_coords).astype(OFFSET_DTYPE).tobytes())
+            num_sam_coords += int(store.offsets[-1])
+    return {path: os.path.getsize(path) for path in (scenario_file, sam_file, offset_file, feature_file)}
+
+
+def _merge_archive(shards, split_dir, type_of_scenario):
+    """
+    Appends the archived scripts of a split of every shard to one archive, returns {file: size}
+    """
+    sources = [shard.version_dir / split_dir.name for shard in shards if os.path.exists(archive_paths(shard.version_dir / split_dir.name, type_of_scenario)[1])]
+    if not sources:
+        return {}
+    with ArchiveWriter(split_dir, type_of_scenario) as writer:
+        for source in sources:
+            with ArchiveReader(source, type_of_scenario) as reader:
+                for i, seed in enumerate(reader.index["seed"].tolist()):
+                    writer.append(seed, reader[i])
+        writer.flush()
+        return writer.file_sizes()
+
+
+def _link_lua_files(shards, version_dir):
+    """
+    Hard links the lua scripts of every shard into the merged version (copying where links are not possible), scripts are never changed once written
+    The shared runtime script of the runtime layout is the same in every shard, the first one is kept
+    """
+    for shard in shards:
+        for root, dirs, files in os.walk(shard.version_dir):
+            relative = os.path.relpath(root, shard.version_dir)
+            if relative.split(os.sep)[0] == "metadata":
+                continue
+            target_root = version_dir / relative
+            os.makedirs(target_root, exist_ok=True)
+            for name in files:
+                source, target = os.path.join(root, name), target_root / name
+                if not name.endswith(".lua") or os.path.exists(target):
+                    continue
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copy2(source, target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the shards of a sharded generation run into one dataset")
+    parser.add_argument("type", help="scenario type (or mix name) to merge")
+    parser.add_argument("roots", nargs="*", default=[str(SCENARIO_DATA_DIR)], help="scenario_data folders holding the shards, one per machine")
+    parser.add_argument("--output", default=str(SCENARIO_DATA_DIR), help="scenario_data folder the merged dataset is written to")
+    parser.add_argument("--allow-missing", action="store_true", help="merge even if some seeds were never generated")
+    args = parser.parse_args()
+
+    merge_shards(args.type, args.roots, args.output, args.allow_missing)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#loads the metadata csv files written by MetadataWriter with the vectorized pandas csv parser
+#both sam layouts come back the same way, with one sam_<i>_lat and sam_<i>_lon column per SAM
+#runs written in store mode have no csv, their metadata is rendered from the binary store instead (see scenario_store.py)
+
+import os
+import re
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from output_versions import OutputVersions
+from scenario_store import ScenarioStore, store_exists
+
+SCENARIO_TYPES = ["Scenario_0", "Scenario_1", "Scenario_2", "Scenario_3"]
+
+_SAM_COLUMN = re.compile(r"^sam_(\d+)_(lat|lon)$")
+
+
+def find_metadata_dir(metadata_dir, type_of_scenario):
+    """
+    Returns metadata_dir if it holds the csv or store of the type, otherwise the metadata folder of the current version of the type,
+    so scenario_data/metadata finds the output of versioned runs in scenario_data/<type>/current/metadata
+    """
+    if has_metadata(metadata_dir, type_of_scenario):
+        return metadata_dir
+    current = OutputVersions(Path(metadata_dir).parent / type_of_scenario).current()
+    return metadata_dir if current is None else str(current / "metadata")
+
+
+def has_metadata(metadata_dir, type_of_scenario):
+    """
+    Checks if metadata_dir holds the csv or the store of a scenario type
+    """
+    return os.path.exists(os.path.join(metadata_dir, f"{type_of_scenario}.csv")) or store_exists(metadata_dir, type_of_scenario)
+
+
+def load_store(metadata_dir, type_of_scenario):
+    """
+    Memory-maps the binary store of a scenario type, metadata_dir may also be the unversioned scenario_data/metadata
+    """
+    return ScenarioStore(find_metadata_dir(metadata_dir, type_of_scenario), type_of_scenario)
+
+
+def load_metadata(metadata_dir, type_of_scenario):
+    """
+    Loads metadata_dir/<type>.csv, SAMs written in long format to <type>_sams.csv are pivoted back into flat columns
+    metadata_dir may also be the unversioned scenario_data/metadata, see find_metadata_dir
+    """
+    metadata_dir = find_metadata_dir(metadata_dir, type_of_scenario)
+    csv_file = os.path.join(metadata_dir, f"{type_of_scenario}.csv")
+    if not os.path.exists(csv_file) and store_exists(metadata_dir, type_of_scenario):
+        return ScenarioStore(metadata_dir, type_of_scenario).to_dataframe()
+    df = pd.read_csv(csv_file)
+
+    sam_file = os.path.join(metadata_dir, f"{type_of_scenario}_sams.csv")
+    if not any(_SAM_COLUMN.match(column) for column in df.columns) and os.path.exists(sam_file):
+        sams = pd.read_csv(sam_file).drop_duplicates(["seed", "sam_index"], keep="last")
+        wide = sams.pivot(index="seed", columns="sam_index", values=["sam_lat", "sam_lon"])
+        wide.columns = [f"sam_{i}_{'lat' if value == 'sam_lat' else 'lon'}" for value, i in wide.columns]
+        order = sorted(wide.columns, key=lambda column: (int(_SAM_COLUMN.match(column).group(1)), column.endswith("lon")))
+        df = df.join(wide[order], on="seed")
+
+    return df
+
+
+def load_all_metadata(metadata_dir, types=None):
+    """
+    Loads the metadata of every scenario type in types (all four by default) that has a csv file or store, returns {type: DataFrame}
+    """
+    types = SCENARIO_TYPES if types is None else types
+    return {type_of_scenario: load_metadata(metadata_dir, type_of_scenario) for type_of_scenario in types
+            if has_metadata(find_metadata_dir(metadata_dir, type_of_scenario), type_of_scenario)}
+
+
+def sam_arrays(df):
+    """
+    Returns the SAM latitudes and longitudes of a metadata DataFrame as two (N, number of SAMs) arrays
+    """
+    lat_columns = sorted((c for c in df.columns if _SAM_COLUMN.match(c) and c.endswith("_lat")), key=lambda c: int(_SAM_COLUMN.match(c).group(1)))
+    lon_columns = [c[:-4] + "_lon" for c in lat_columns]
+    return df[lat_columns].to_numpy(dtype=np.float64), df[lon_columns].to_numpy(dtype=np.float64)
@@ -0,0 +1,149 @@
+#writes the metadata csv files of a generation run
+#the file stays open for the whole run and rows are written in batches, every coordinate gets its own numeric column so readers never have to eval strings
+
+import csv
+import os
+
+# columns every scenario row has, the sam columns are added after these
+BASE_HEADERS = ["scen_type", "seed", "split", "zone", "target_lat", "target_lon", "target_dbid", "jet_lat", "jet_lon", "jet_dbid", "sam_dbid", "num_sams"]
+
+# columns of the <type>_sams.csv table when the sams are written in long format
+SAM_HEADERS = ["seed", "sam_index", "sam_lat", "sam_lon"]
+
+SAM_LAYOUTS = ("flat", "long")
+
+
+class MetadataWriter():
+    """
+    Buffered, typed metadata writer for one scenario type.
+    With the flat layout every SAM gets sam_<i>_lat and sam_<i>_lon columns on the scenario row.
+    With the long layout the SAMs go one per row into <type>_sams.csv, keyed on seed.
+    Attributes:
+        csv_file (String): Scenario table, metadata_dir/<type>.csv.
+        sam_file (String): SAM table for the long layout, metadata_dir/<type>_sams.csv.
+        sam_layout (String): "flat" or "long".
+        flush_every (int): Number of buffered scenario rows that triggers a write to disk.
+        append (Boolean): Append to existing files instead of overwriting them.
+        opens (int): Files the writer has opened, for the run telemetry.
+    """
+
+    def __init__(self, metadata_dir, type_of_scenario, sam_layout="flat", flush_every=10000, append=False):
+        """
+        Opens the metadata files for the run
+        """
+        if sam_layout not in SAM_LAYOUTS:
+            raise ValueError(f"sam_layout must be one of {SAM_LAYOUTS}, got '{sam_layout}'")
+
+        self.type_of_scenario = type_of_scenario
+        self.sam_layout = sam_layout
+        self.flush_every = flush_every
+        self.append = append
+        self.csv_file = os.path.join(metadata_dir, f"{type_of_scenario}.csv")
+        self.sam_file = os.path.join(metadata_dir, f"{type_of_scenario}_sams.csv")
+
+        os.makedirs(metadata_dir, exist_ok=True)
+
+        mode = "a" if append else "w"
+        # the header depends on how many sams the generator makes, so it is written with the first batch
+        self._needs_header = not append or not os.path.exists(self.csv_file) or os.path.getsize(self.csv_file) == 0
+        self._file = open(self.csv_file, mode, newline="")
+        self.opens = 1
+        self._writer = csv.writer(self._file)
+        self._rows = []
+        self._sam_rows = []
+
+        if sam_layout == "long":
+            sam_needs_header = not append or not os.path.exists(self.sam_file) or os.path.getsize(self.sam_file) == 0
+            self._sam_file = open(self.sam_file, mode, newline="")
+            self.opens += 1
+            self._sam_writer = csv.writer(self._sam_file)
+            if sam_needs_header:
+                self._sam_writer.writerow(SAM_HEADERS)
+
+
+    def write_batch(self, batch, generator):
+        """
+        Buffers the rows of a ScenarioBatch made by generator and writes them out once flush_every rows are waiting
+        Batches mixing generators carry scen_type and num_sams per row, their padding sams are left out of the long layout
+        """
+        num_sams = batch.sam_lats.shape[1]
+        row_num_sams = getattr(batch, "num_sams", None)
+        scen_types = getattr(batch, "scen_type", None)
+
+        if self._needs_header:
+            headers = list(BASE_HEADERS)
+            if self.sam_layout == "flat":
+                for i in range(num_sams):
+                    headers += [f"sam_{i}_lat", f"sam_{i}_lon"]
+            self._writer.writerow(headers)
+            self._needs_header = False
+
+        n = len(batch)
+        seeds = batch.seeds.tolist()
+        scen_types = [self.type_of_scenario]*n if scen_types is None else scen_types.tolist()
+        columns = [scen_types, seeds, [generator.splits[s] for s in batch.split_idx],
+                   [generator.zone_names[z] for z in batch.zone_idx],
+                   batch.target_lat.tolist(), batch.target_long.tolist(), [generator.target_dbid]*n,
+                   batch.jet_lat.tolist(), batch.jet_long.tolist(), [generator.jet_dbid]*n,
+                   [generator.sam_dbid]*n, [num_sams]*n if row_num_sams is None else row_num_sams.tolist()]
+
+        if self.sam_layout == "flat":
+            for i in range(num_sams):
+                columns += [batch.sam_lats[:, i].tolist(), batch.sam_longs[:, i].tolist()]
+        else:
+            sam_index = list(range(num_sams))*n
+            sam_seeds = [seed for seed in seeds for i in range(num_sams)]
+            sam_rows = zip(sam_seeds, sam_index, batch.sam_lats.ravel().tolist(), batch.sam_longs.ravel().tolist())
+            if row_num_sams is not None:
+                keep = [i < k for k in row_num_sams.tolist() for i in range(num_sams)]
+                sam_rows = [sam_row for sam_row, kept in zip(sam_rows, keep) if kept]
+            self._sam_rows.extend(sam_rows)
+
+        self._rows.extend(zip(*columns))
+
+        if len(self._rows) >= self.flush_every:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Writes every buffered row to disk
+        """
+        self._writer.writerows(self._rows)
+        self._rows = []
+        self._file.flush()
+
+        if self.sam_layout == "long":
+            self._sam_writer.writerows(self._sam_rows)
+            self._sam_rows = []
+            self._sam_file.flush()
+
+
+    def file_sizes(self):
+        """
+        Returns the size in bytes of every file the writer has written to disk, call flush first to include the buffered rows
+        """
+        sizes = {self.csv_file: self._file.tell()}
+        if self.sam_layout == "long":
+            sizes[self.sam_file] = self._sam_file.tell()
+        return sizes
+
+
+    def close(self):
+        """
+        Flushes what is left and closes the files
+        """
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+        if self.sam_layout == "long":
+            self._sam_file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
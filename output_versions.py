@@ -0,0 +1,182 @@
+#versioned output directories, every generation run writes into a fresh scenario_data/<type>/versions/<run> folder
+#scenario_data/<type>/current is swapped to point at a run only once it has finished, so readers never see a half written dataset
+#old versions are moved into a trash folder (a rename, so it is instant) and deleted by a background thread
+
+import os
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+
+VERSIONS_DIR = "versions"
+CURRENT_LINK = "current"
+TRASH_DIR = "trash"
+
+# written into a version once its run has finished
+COMPLETE_MARKER = ".complete"
+
+# files generation appends to, a version extending another one needs its own copy of these
+APPENDED_SUFFIXES = (".csv", ".json", ".pack", ".idx", ".scen", ".sams", ".offsets", ".features")
+
+
+class OutputVersions():
+    """
+    The versions of one scenario type's output, each version holds the usual train/test/validate and metadata folders.
+    Attributes:
+        type_dir (Path): Folder of the scenario type, scenario_data/<type>.
+        versions_dir (Path): Folder holding one folder per version.
+        current_link (Path): Symlink to the version readers should use.
+        trash_dir (Path): Versions waiting to be deleted.
+    """
+
+    def __init__(self, type_dir):
+        self.type_dir = Path(type_dir)
+        self.versions_dir = self.type_dir / VERSIONS_DIR
+        self.current_link = self.type_dir / CURRENT_LINK
+        self.trash_dir = self.type_dir / TRASH_DIR
+
+
+    def current(self):
+        """
+        Returns the folder of the current version, None if no run has finished yet
+        """
+        if os.path.islink(self.current_link):
+            target = os.readlink(self.current_link)
+        elif os.path.isfile(self.current_link):
+            # where symlinks are not allowed (Windows without developer mode) current is a file holding the version name
+            with open(self.current_link) as f:
+                target = os.path.join(VERSIONS_DIR, f.read().strip())
+        else:
+            return None
+        return self.type_dir / target
+
+
+    def versions(self):
+        """
+        Returns the folder of every version, oldest first
+        """
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return [self.versions_dir / name for name in sorted(os.listdir(self.versions_dir))]
+
+
+    def is_complete(self, version):
+        """
+        Checks if the run writing a version finished
+        """
+        return os.path.exists(Path(version) / COMPLETE_MARKER)
+
+
+    def unfinished(self):
+        """
+        Returns the versions whose run never finished, oldest first, these can be resumed
+        """
+        return [version for version in self.versions() if not self.is_complete(version)]
+
+
+    def create(self, extend=None):
+        """
+        Makes a new, empty version and returns its folder, named after the time so versions sort oldest first
+        With extend set to another version, the new one starts out as a copy of it so the run only has to add the missing scenarios.
+        Lua scripts are never changed once written so they are hard linked, the files that get appended to are copied
+        """
+        version = self.versions_dir / datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        os.makedirs(version)
+
+        if extend is not None:
+            for root, dirs, files in os.walk(extend):
+                target_root = version / os.path.relpath(root, extend)
+                os.makedirs(target_root, exist_ok=True)
+                for name in files:
+                    if name == COMPLETE_MARKER:
+                        continue
+                    source, target = os.path.join(root, name), target_root / name
+                    if name.endswith(APPENDED_SUFFIXES):
+                        shutil.copy2(source, target)
+                        continue
+                    try:
+                        os.link(source, target)
+                    except OSError:
+                        shutil.copy2(source, target)
+        return version
+
+
+    def publish(self, version):
+        """
+        Marks a version as complete and points current at it
+        The new link is made under a temporary name and renamed over the old one, which readers see as a single atomic switch
+        """
+        Path(version, COMPLETE_MARKER).touch()
+        target = os.path.join(VERSIONS_DIR, Path(version).name)
+        temp_link = self.type_dir / f"{CURRENT_LINK}.tmp-{os.getpid()}"
+        if os.path.lexists(temp_link):
+            os.remove(temp_link)
+        try:
+            os.symlink(target, temp_link, target_is_directory=True)
+        except OSError:
+            with open(temp_link, "w") as f:
+                f.write(Path(version).name)
+        os.replace(temp_link, self.current_link)
+
+
+    def discard(self, path, background=True):
+        """
+        Moves a file or folder into the trash and deletes everything in the trash, in a background thread unless background=False
+        Returns the thread (None when nothing was deleted in the background)
+        """
+        if os.path.lexists(path):
+            os.makedirs(self.trash_dir, exist_ok=True)
+            os.replace(path, self.trash_dir / f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{Path(path).name}")
+        return self.empty_trash(background)
+
+
+    def collect_garbage(self, keep=(), background=True):
+        """
+        Moves every version except the current one and those in keep into the trash, then deletes the trash
+        Only renames happen here, so it returns straight away, the deleting is done by the returned thread
+        """
+        keep = {Path(version).resolve() for version in keep}
+        current = self.current()
+        if current is not None:
+            keep.add(current.resolve())
+
+        for version in self.versions():
+            if version.resolve() not in keep:
+                os.makedirs(self.trash_dir, exist_ok=True)
+                os.replace(version, self.trash_dir / version.name)
+        return self.empty_trash(background)
+
+
+    def empty_trash(self, background=True):
+        """
+        Deletes everything in the trash, anything left behind by a run that was stopped half way through deleting goes too
+        """
+        if not os.path.isdir(self.trash_dir):
+            return None
+        doomed = [self.trash_dir / name for name in os.listdir(self.trash_dir)]
+        if not doomed:
+            return None
+        if not background:
+            _remove_trees(doomed)
+            return None
+
+        # not a daemon thread, so the interpreter waits for the delete to finish before it exits
+        thread = threading.Thread(target=_remove_trees, args=(doomed,), name=f"gc-{self.type_dir.name}")
+        thread.start()
+        return thread
+
+
+def _remove_trees(paths):
+    """
+    Deletes files and folders, printing what could not be deleted instead of raising from a background thread
+    """
+    for path in paths:
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error removing '{path}': {e}")
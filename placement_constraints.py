@@ -0,0 +1,178 @@
+#pluggable placement constraints for the scenario generators
+#each constraint checks a whole ScenarioBatch at once and returns which scenarios pass, the generator redraws the ones that fail (rejection sampling)
+
+import os
+import numpy as np
+
+from geodesy import KM_PER_DEGREE, great_circle_distance
+
+
+def unit_positions(batch):
+    """
+    Returns the latitudes and longitudes of every unit in a batch as two (N, units) arrays, target first, then the jet, then the SAMs
+    """
+    lats = np.column_stack([batch.target_lat, batch.jet_lat, batch.sam_lats])
+    longs = np.column_stack([batch.target_long, batch.jet_long, batch.sam_longs])
+    return lats, longs
+
+
+def ground_positions(batch):
+    """
+    Returns the latitudes and longitudes of the units that sit on the ground (the target and the SAMs) as two (N, units) arrays
+    """
+    lats = np.column_stack([batch.target_lat, batch.sam_lats])
+    longs = np.column_stack([batch.target_long, batch.sam_longs])
+    return lats, longs
+
+
+class LatitudeRange():
+    """
+    Keeps every unit between min_lat and max_lat, by default the valid -90 to 90 latitude range.
+    """
+
+    def __init__(self, min_lat=-90, max_lat=90):
+        self.min_lat = min_lat
+        self.max_lat = max_lat
+
+
+    def check(self, batch, generator):
+        lats, longs = unit_positions(batch)
+        return ((lats >= self.min_lat) & (lats <= self.max_lat)).all(axis=1)
+
+
+    def describe(self):
+        return {"constraint": "LatitudeRange", "min_lat": self.min_lat, "max_lat": self.max_lat}
+
+
+class InsideZone():
+    """
+    Keeps every unit inside the box or polygon of the zone the scenario was placed in.
+    """
+
+    def check(self, batch, generator):
+        lats, longs = unit_positions(batch)
+        return generator.zone_index.contains(batch.zone_idx, lats, longs).all(axis=1)
+
+
+    def describe(self):
+        return {"constraint": "InsideZone"}
+
+
+class MinSpacing():
+    """
+    Keeps every pair of units in a scenario at least min_degrees of arc apart, measured along great circles.
+    """
+
+    def __init__(self, min_degrees):
+        self.min_degrees = min_degrees
+
+
+    def check(self, batch, generator):
+        lats, longs = unit_positions(batch)
+        distance = great_circle_distance(lats[:, :, None], longs[:, :, None], lats[:, None, :], longs[:, None, :]) / KM_PER_DEGREE
+        # a unit is always 0 away from itself, so leave the diagonal out
+        distance[:, np.arange(lats.shape[1]), np.arange(lats.shape[1])] = np.inf
+        return distance.min(axis=(1, 2)) >= self.min_degrees
+
+
+    def describe(self):
+        return {"constraint": "MinSpacing", "min_degrees": self.min_degrees}
+
+
+class LandOnly():
+    """
+    Keeps the ground units (the target and the SAMs) on land, the jet is allowed over water.
+    """
+
+    def __init__(self, land_mask):
+        self.land_mask = land_mask
+
+
+    def check(self, batch, generator):
+        lats, longs = ground_positions(batch)
+        return self.land_mask.is_land(lats, longs).all(axis=1)
+
+
+    def describe(self):
+        return {"constraint": "LandOnly", "resolution": self.land_mask.resolution}
+
+
+class LandMask():
+    """
+    Global land/sea raster, row 0 is the cell just below 90N and column 0 the cell just east of 180W.
+    Attributes:
+        land (ndarray): Boolean raster, shape (180/resolution, 360/resolution).
+        resolution (float): Size of a cell in degrees.
+    """
+
+    def __init__(self, land, resolution):
+        self.land = land
+        self.resolution = resolution
+
+
+    @classmethod
+    def load(cls, cache_dir="scenario_data", resolution=0.1):
+        """
+        Loads the mask cached in cache_dir, building it from the Natural Earth land polygons the first time
+        """
+        cache_file = os.path.join(cache_dir, f"land_mask_{resolution}.npy")
+        if os.path.exists(cache_file):
+            return cls(np.load(cache_file), resolution)
+
+        land = build_land_mask(resolution)
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(cache_file, land)
+        return cls(land, resolution)
+
+
+    def is_land(self, lats, longs):
+        """
+        Looks up every lat/lon pair in the raster, anything past the poles counts as water
+        """
+        rows = np.floor((90 - np.asarray(lats)) / self.resolution).astype(np.int64)
+        cols = np.floor((np.asarray(longs) + 180) / self.resolution).astype(np.int64) % self.land.shape[1]
+        inside = (rows >= 0) & (rows < self.land.shape[0])
+        return inside & self.land[np.clip(rows, 0, self.land.shape[0] - 1), cols]
+
+
+def build_land_mask(resolution=0.1):
+    """
+    Rasterizes the Natural Earth 110m land polygons onto a grid of resolution degree cells, a cell is land if its centre is
+    Needs cartopy (already used by data_plotting.py) and matplotlib, cartopy downloads the polygons the first time
+    """
+    try:
+        import cartopy.io.shapereader as shapereader
+        from matplotlib.path import Path as PolygonPath
+    except ImportError as e:
+        raise ImportError("building the land mask needs cartopy and matplotlib, or pass a cached mask to LandMask") from e
+
+    rows, cols = int(round(180 / resolution)), int(round(360 / resolution))
+    land = np.zeros((rows, cols), dtype=bool)
+    centre_lats = 90 - (np.arange(rows) + 0.5) * resolution
+    centre_longs = -180 + (np.arange(cols) + 0.5) * resolution
+
+    reader = shapereader.Reader(shapereader.natural_earth(resolution="110m", category="physical", name="land"))
+    for geometry in reader.geometries():
+        for polygon in getattr(geometry, "geoms", [geometry]):
+            # only fill the cells inside the bounding box of the polygon
+            min_long, min_lat, max_long, max_lat = polygon.bounds
+            row_idx = np.flatnonzero((centre_lats >= min_lat) & (centre_lats <= max_lat))
+            col_idx = np.flatnonzero((centre_longs >= min_long) & (centre_longs <= max_long))
+            if len(row_idx) == 0 or len(col_idx) == 0:
+                continue
+            grid_lats, grid_longs = np.meshgrid(centre_lats[row_idx], centre_longs[col_idx], indexing="ij")
+            points = np.column_stack([grid_longs.ravel(), grid_lats.ravel()])
+
+            inside = PolygonPath(np.asarray(polygon.exterior.coords)).contains_points(points)
+            for hole in polygon.interiors:
+                inside &= ~PolygonPath(np.asarray(hole.coords)).contains_points(points)
+            land[np.ix_(row_idx, col_idx)] |= inside.reshape(len(row_idx), len(col_idx))
+
+    return land
+
+
+def acceptance_rates(stats):
+    """
+    Turns the {zone: [scenarios, attempts, rejected]} counts kept by a generator into {zone: accepted scenarios per attempt}
+    """
+    return {zone: (scenarios - rejected) / attempts if attempts else 0.0 for zone, (scenarios, attempts, rejected) in stats.items()}
@@ -0,0 +1,115 @@
+#keeps track of what a generator has already written, so a run can be extended, resumed after a crash or skipped when there is nothing new to do
+#the manifest is a json file next to the metadata, one per scenario type
+
+import json
+import os
+from datetime import datetime
+
+
+class RunManifest():
+    """
+    Records the generator config, the seed ranges that finished with a hash of their output, and the size of every output file at the last finished range.
+    Attributes:
+        manifest_file (String): Path of the json file.
+        root (String): Output directory the recorded file paths are relative to, by default the folder above the manifest's metadata folder.
+        data (dict): Contents of the manifest, None until the manifest is loaded or started.
+    """
+
+    def __init__(self, manifest_file, root=None):
+        """
+        Loads the manifest if there is one on disk
+        """
+        self.manifest_file = str(manifest_file)
+        # file paths are stored relative to root, so a copy of the whole output directory still points at its own files
+        self.root = os.path.dirname(os.path.dirname(os.path.abspath(self.manifest_file))) if root is None else str(root)
+        self.data = None
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as f:
+                self.data = json.load(f)
+
+
+    def matches(self, config):
+        """
+        Checks that the manifest was written by a generator with the same config, so its output can be reused
+        """
+        # go through json so tuples and lists compare the same way they are stored
+        return self.data is not None and self.data["config"] == json.loads(json.dumps(config))
+
+
+    def start(self, config):
+        """
+        Throws away anything recorded before and starts a manifest for config
+        """
+        self.data = {"config": json.loads(json.dumps(config)), "ranges": [], "file_sizes": {}, "runs": []}
+        self.save()
+
+
+    def missing_ranges(self, start, stop):
+        """
+        Returns the (start, stop) ranges of seeds in [start, stop) that have not been generated yet
+        """
+        missing = []
+        for done_start, done_stop in sorted((r["start"], r["stop"]) for r in self.data["ranges"]):
+            if done_start > start:
+                missing.append((start, min(done_start, stop)))
+            start = max(start, done_stop)
+            if start >= stop:
+                break
+        if start < stop:
+            missing.append((start, stop))
+        return [(a, b) for a, b in missing if a < b]
+
+
+    def restore_file_sizes(self):
+        """
+        Cuts every output file back to the size it had when the last range finished, which drops anything a crashed run wrote after that
+        """
+        for path, size in self.data["file_sizes"].items():
+            path = os.path.join(self.root, path)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+
+    def begin_run(self, start, stop):
+        """
+        Records that a run asked for seeds [start, stop)
+        """
+        self.data["runs"].append({"started": datetime.now().isoformat(timespec="seconds"), "start": start, "stop": stop, "finished": None})
+        self.save()
+
+
+    def record_range(self, start, stop, digest, file_sizes):
+        """
+        Records that seeds [start, stop) are on disk, after the outputs they were written to have been flushed
+        """
+        self.data["ranges"].append({"start": start, "stop": stop, "hash": digest})
+        self.data["file_sizes"].update({os.path.relpath(path, self.root): size for path, size in file_sizes.items()})
+        self.save()
+
+
+    def record_ranges(self, ranges, file_sizes):
+        """
+        Records many finished ranges at once, each a dict with start, stop and hash, saving the manifest only once
+        """
+        self.data["ranges"].extend({"start": r["start"], "stop": r["stop"], "hash": r["hash"]} for r in ranges)
+        self.data["file_sizes"].update({os.path.relpath(path, self.root): size for path, size in file_sizes.items()})
+        self.save()
+
+
+    def finish_run(self):
+        """
+        Marks the last run as finished
+        """
+        self.data["runs"][-1]["finished"] = datetime.now().isoformat(timespec="seconds")
+        self.save()
+
+
+    def save(self):
+        """
+        Writes the manifest to a temporary file and swaps it in, so a crash never leaves a half written manifest
+        """
+        os.makedirs(os.path.dirname(self.manifest_file), exist_ok=True)
+        temp_file = self.manifest_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(temp_file, self.manifest_file)
@@ -0,0 +1,255 @@
+#running aggregates of a generation run, kept in constant memory and written as a small snapshot while the run goes so a long run can be watched live
+#per zone and split counts, the realised split ratios against the split weights, histograms of the distances between units and a lat/long
+#occupancy grid per role. The distances are the features the workers already worked out (see difficulty_features.py), so keeping the
+#statistics only costs a few bincounts per batch on the thread writing the output. The snapshot is <type>_statistics.json (counts, ratios, quantiles) and <type>_statistics.npz (histograms and grids)
+#watch a run from the repository root: python run_statistics.py scenario_data/Scenario_1 [--watch 10]
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+from output_versions import OutputVersions
+
+# separations are counted in 10 km bins up to 5000 km, anything further goes into the last bin
+SEPARATION_BIN_KM = 10
+SEPARATION_BINS = 500
+
+# {separation: feature it is read from}
+SEPARATIONS = {"jet_target": "jet_target_km", "jet_nearest_sam": "jet_nearest_sam_km", "target_nearest_sam": "target_nearest_sam_km",
+               "sam_spacing": "sam_spacing_km", "closest_approach": "closest_approach_km"}
+
+QUANTILES = (1, 5, 25, 50, 75, 95, 99)
+
+ROLES = ("sam", "jet", "target")
+GRID_DEGREES = 1
+
+# seconds between snapshots of a running generate_scenario
+STATISTICS_EVERY = 30.0
+
+
+def statistics_paths(directory, type_of_scenario):
+    """
+    Returns the json and npz file names of the statistics snapshot of a scenario type in directory
+    """
+    return tuple(os.path.join(directory, f"{type_of_scenario}_statistics{suffix}") for suffix in (".json", ".npz"))
+
+
+class RunStatistics():
+    """
+    Aggregates of every scenario a run has written, updated batch by batch. Nothing grows with the number of scenarios,
+    the whole state is the arrays below (a few MB with the default grid), so it is the same for a thousand scenarios or a billion.
+    Attributes:
+        zone_names, splits (list): Names the zone and split indices of the scenarios refer to.
+        split_weights (list): Share of the scenarios each split is meant to get.
+        counts (ndarray): Scenarios per (zone, split).
+        histograms (dict): {separation: counts per SEPARATION_BIN_KM bin}, separations with no value (one SAM has no spacing) are not counted.
+        totals (dict): {separation: [values, sum, min, max]}.
+        grids (dict): {role: (180 / GRID_DEGREES, 360 / GRID_DEGREES) counts of units per lat/long cell}, row 0 is the south pole.
+        generated (int): Scenarios added batch by batch since the statistics were made, not counting the ones read back from a store.
+    """
+
+    def __init__(self, zone_names, splits, split_weights):
+        self.zone_names = list(zone_names)
+        self.splits = list(splits)
+        self.split_weights = list(split_weights)
+        self.counts = np.zeros((len(self.zone_names), len(self.splits)), dtype=np.int64)
+        self.histograms = {name: np.zeros(SEPARATION_BINS, dtype=np.int64) for name in SEPARATIONS}
+        self.totals = {name: [0, 0.0, np.inf, -np.inf] for name in SEPARATIONS}
+        self.grids = {role: np.zeros((180 // GRID_DEGREES, 360 // GRID_DEGREES), dtype=np.int64) for role in ROLES}
+        self.generated = 0
+        self.started = time.time()
+        self.last_snapshot = self.started
+
+
+    def update(self, zone_idx, split_idx, target_lat, target_long, jet_lat, jet_long, sam_lats, sam_longs, features):
+        """
+        Adds scenarios given as arrays, one row per scenario, the (N, SAMs) arrays may be padded with NaN and features has FEATURE_DTYPE
+        """
+        self.counts += np.bincount(np.asarray(zone_idx, dtype=np.int64) * len(self.splits) + split_idx,
+                                   minlength=self.counts.size).reshape(self.counts.shape)
+
+        for name, feature in SEPARATIONS.items():
+            values = features[feature]
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                continue
+            bins = np.minimum(values // SEPARATION_BIN_KM, SEPARATION_BINS - 1).astype(np.int64)
+            self.histograms[name] += np.bincount(bins, minlength=SEPARATION_BINS)
+            total = self.totals[name]
+            total[0] += len(values)
+            total[1] += float(values.sum())
+            total[2] = min(total[2], float(values.min()))
+            total[3] = max(total[3], float(values.max()))
+
+        for role, lats, longs in (("sam", sam_lats, sam_longs), ("jet", jet_lat, jet_long), ("target", target_lat, target_long)):
+            lats, longs = np.ravel(lats), np.ravel(longs)
+            keep = ~np.isnan(lats)
+            self._add_to_grid(self.grids[role], lats[keep], longs[keep])
+
+
+    @staticmethod
+    def _add_to_grid(grid, lats, longs):
+        rows = np.clip(((lats + 90) // GRID_DEGREES).astype(np.int64), 0, grid.shape[0] - 1)
+        # the modulo wraps longitudes outside [-180, 180) back onto the grid
+        cols = ((longs + 180) // GRID_DEGREES).astype(np.int64) % grid.shape[1]
+        grid += np.bincount(rows * grid.shape[1] + cols, minlength=grid.size).reshape(grid.shape)
+
+
+    def update_batch(self, batch):
+        """
+        Adds the scenarios of a ScenarioBatch
+        """
+        self.generated += len(batch)
+        self.update(batch.zone_idx, batch.split_idx, batch.target_lat, batch.target_long, batch.jet_lat, batch.jet_long, batch.sam_lats, batch.sam_longs,
+                    batch.features)
+
+
+    def update_store(self, store, chunk_size=1000000):
+        """
+        Adds every scenario of a ScenarioStore a chunk at a time, so a resumed or extended run starts from the scenarios already written
+        """
+        for start in range(0, len(store), chunk_size):
+            rows = slice(start, min(start + chunk_size, len(store)))
+            scenarios = store.scenarios[rows]
+            sam_lats, sam_longs = store.sam_arrays(rows)
+            self.update(scenarios["zone"], scenarios["split"], scenarios["target_lat"], scenarios["target_long"],
+                        scenarios["jet_lat"], scenarios["jet_long"], sam_lats, sam_longs, store.features[rows])
+
+
+    def scenarios(self):
+        """
+        Returns how many scenarios have been added
+        """
+        return int(self.counts.sum())
+
+
+    def split_ratios(self):
+        """
+        Returns {split: count, realised ratio, target ratio and how many standard deviations the count is off its target}
+        """
+        total = self.scenarios()
+        weights = np.asarray(self.split_weights, dtype=np.float64)
+        weights = weights / weights.sum()
+        ratios = {}
+        for split, count, target in zip(self.splits, self.counts.sum(axis=0).tolist(), weights.tolist()):
+            spread = np.sqrt(total * target * (1 - target))
+            ratios[split] = {"count": count, "ratio": count / total if total else None, "target": target,
+                             "z_score": (count - total * target) / spread if spread else None}
+        return ratios
+
+
+    def quantiles(self, name):
+        """
+        Returns {"p<q>": km} for QUANTILES of a separation, interpolated inside the histogram bins, None if nothing was counted
+        """
+        histogram = self.histograms[name]
+        total = histogram.sum()
+        if total == 0:
+            return {f"p{q}": None for q in QUANTILES}
+        cumulative = np.cumsum(histogram)
+        quantiles = {}
+        for q in QUANTILES:
+            rank = q / 100 * total
+            i = int(np.searchsorted(cumulative, rank))
+            below = cumulative[i - 1] if i else 0
+            quantiles[f"p{q}"] = (i + (rank - below) / histogram[i]) * SEPARATION_BIN_KM
+        return quantiles
+
+
+    def summary(self):
+        """
+        Returns the aggregates as a dict ready for json, everything but the histograms and grids
+        The rate only counts the scenarios generated since started, a resumed or extended run also holds the ones already in its store
+        """
+        elapsed = time.time() - self.started
+        separations = {}
+        for name in SEPARATIONS:
+            values, total, smallest, largest = self.totals[name]
+            separations[name] = {"values": values, "mean_km": total / values if values else None,
+                                 "min_km": smallest if values else None, "max_km": largest if values else None}
+            separations[name].update({f"{q}_km": value for q, value in self.quantiles(name).items()})
+
+        return {"scenarios": self.scenarios(), "generated": self.generated, "elapsed_seconds": elapsed,
+                "scenarios_per_sec": self.generated / elapsed if elapsed else None,
+                "updated": time.strftime("%Y-%m-%d %H:%M:%S"), "splits": self.split_ratios(),
+                "zones": {zone: dict(zip(self.splits, row)) for zone, row in zip(self.zone_names, self.counts.tolist())},
+                "separations": separations}
+
+
+    def snapshot_due(self, every=STATISTICS_EVERY):
+        """
+        Checks if the last snapshot is at least every seconds old
+        """
+        return time.time() - self.last_snapshot >= every
+
+
+    def write(self, directory, type_of_scenario):
+        """
+        Writes the snapshot into directory, each file through a temporary one so a reader never sees half of it
+        """
+        json_file, npz_file = statistics_paths(directory, type_of_scenario)
+        with open(json_file + ".tmp", "w") as f:
+            json.dump(self.summary(), f, indent=1)
+        os.replace(json_file + ".tmp", json_file)
+
+        arrays = {"counts": self.counts, "separation_edges_km": np.arange(SEPARATION_BINS + 1) * SEPARATION_BIN_KM}
+        arrays.update({f"{name}_histogram": histogram for name, histogram in self.histograms.items()})
+        arrays.update({f"{role}_grid": grid for role, grid in self.grids.items()})
+        # np.savez adds .npz to names that do not end with it
+        np.savez_compressed(npz_file + ".tmp.npz", **arrays)
+        os.replace(npz_file + ".tmp.npz", npz_file)
+        self.last_snapshot = time.time()
+
+
+def find_snapshot(path, type_of_scenario=None):
+    """
+    Returns the json snapshot at path, which is the snapshot itself or a scenario_data/<type> folder, where the newest version is the running one
+    """
+    if os.path.isfile(path):
+        return path
+    versions = OutputVersions(path).versions()
+    if not versions:
+        raise FileNotFoundError(f"no versions in {path}")
+    type_of_scenario = type_of_scenario or os.path.basename(os.path.normpath(path))
+    return statistics_paths(versions[-1] / "metadata", type_of_scenario)[0]
+
+
+def print_snapshot(summary):
+    """
+    Prints the counts, split ratios and median separations of a json snapshot
+    """
+    generated = summary.get("generated", summary["scenarios"])
+    print(f"{summary['scenarios']} scenarios at {summary['updated']} ({generated} generated by this run at {summary['scenarios_per_sec'] or 0:.0f} per second)")
+    for split, ratio in summary["splits"].items():
+        if ratio["ratio"] is not None:
+            print(f"  {split}: {ratio['count']} ({ratio['ratio']:.2%}, target {ratio['target']:.0%}, z {ratio['z_score']:+.1f})")
+    for zone, counts in summary["zones"].items():
+        print(f"  {zone}: {sum(counts.values())}")
+    for name, separation in summary["separations"].items():
+        if separation["values"]:
+            print(f"  {name}: median {separation['p50_km']:.0f} km, p1 {separation['p1_km']:.0f} km, p99 {separation['p99_km']:.0f} km")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the statistics snapshot of a generation run, the running one by default")
+    parser.add_argument("path", help="scenario_data/<type> folder or a <type>_statistics.json file")
+    parser.add_argument("--type", default=None, help="scenario type, if the folder is not named after it")
+    parser.add_argument("--watch", type=float, default=None, help="show the snapshot again every this many seconds")
+    args = parser.parse_args()
+
+    while True:
+        snapshot = find_snapshot(args.path, args.type)
+        if os.path.exists(snapshot):
+            with open(snapshot) as f:
+                print_snapshot(json.load(f))
+        else:
+            print(f"No snapshot yet at {snapshot}")
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()
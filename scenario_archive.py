@@ -0,0 +1,184 @@
+#packed archive output for the lua scripts, one archive per split and scenario type instead of one small file per scenario
+#the archive is a single blob of concatenated scripts plus an index of (seed, offset, length) so any scenario can be read without unpacking
+#both files are only ever appended to, a flush adds the index records of the new scripts instead of rewriting the whole index
+
+import mmap
+import os
+import numpy as np
+
+INDEX_DTYPE = np.dtype([("seed", "<i8"), ("offset", "<i8"), ("length", "<i8")])
+
+
+def archive_paths(directory, type_of_scenario):
+    """
+    Returns the blob and index file names of the archive for a scenario type in directory
+    """
+    return os.path.join(directory, f"{type_of_scenario}.pack"), os.path.join(directory, f"{type_of_scenario}.idx")
+
+
+def _read_index(index_file):
+    """
+    Maps the raw index read only, a record cut short by a crash at the end of the file is left out
+    Archives written before the index was appended to have it as <type>.idx.npy instead, those are loaded
+    """
+    if not os.path.exists(index_file) and os.path.exists(index_file + ".npy"):
+        return np.load(index_file + ".npy")
+    count = os.path.getsize(index_file) // INDEX_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=INDEX_DTYPE)
+    return np.memmap(index_file, dtype=INDEX_DTYPE, mode="r", shape=(count,))
+
+
+class ArchiveWriter():
+    """
+    Appends rendered lua scripts to a packed archive, their index records are appended when the archive is flushed or closed.
+    Attributes:
+        pack_file (String): Blob holding the scripts back to back.
+        index_file (String): Seed, offset and length of every script in the blob, INDEX_DTYPE records back to back.
+        opens (int): Files the writer has opened, for the run telemetry.
+    """
+
+    def __init__(self, directory, type_of_scenario, append=False):
+        """
+        Opens the archive, with append=True new scripts go after the ones already in it
+        """
+        self.pack_file, self.index_file = archive_paths(directory, type_of_scenario)
+        os.makedirs(directory, exist_ok=True)
+
+        self.opens = 0
+        append = append and os.path.exists(self.index_file) and os.path.exists(self.pack_file)
+        if append:
+            # only keep the scripts that are actually in the blob, the blob may have been cut back after a crash
+            # the scripts are in blob order, so the ones to keep are the records before the first one past its end
+            index = _read_index(self.index_file)
+            self.opens += 1
+            in_pack = index["offset"] + index["length"] <= os.path.getsize(self.pack_file)
+            keep = len(index) if in_pack.all() else int(np.argmin(in_pack))
+            del index
+            os.truncate(self.index_file, keep * INDEX_DTYPE.itemsize)
+
+        self._file = open(self.pack_file, "ab" if append else "wb")
+        self._index_file = open(self.index_file, "ab" if append else "wb")
+        self.opens += 2
+        self._offset = self._file.tell()
+        self._seeds = []
+        self._offsets = []
+        self._lengths = []
+
+
+    def append(self, seed, script):
+        """
+        Adds the script bytes of one scenario to the end of the blob
+        """
+        self._file.write(script)
+        self._seeds.append(seed)
+        self._offsets.append(self._offset)
+        self._lengths.append(len(script))
+        self._offset += len(script)
+
+
+    def flush(self):
+        """
+        Flushes the blob, then appends the index records of the scripts added since the last flush
+        The blob goes first, so an index record on disk always points at a script that is on disk
+        """
+        self._file.flush()
+
+        index = np.empty(len(self._seeds), dtype=INDEX_DTYPE)
+        index["seed"] = self._seeds
+        index["offset"] = self._offsets
+        index["length"] = self._lengths
+        self._index_file.write(index.tobytes())
+        self._index_file.flush()
+        self._seeds = []
+        self._offsets = []
+        self._lengths = []
+
+
+    def file_sizes(self):
+        """
+        Returns the size in bytes of the blob and the index, call flush first so it is all on disk
+        """
+        return {self.pack_file: self._offset, self.index_file: self._index_file.tell()}
+
+
+    def close(self):
+        """
+        Writes the rest of the index and closes both files
+        """
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+        self._index_file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ArchiveReader():
+    """
+    Memory-maps a packed archive and returns the script of any scenario in it without unpacking.
+    archive[i] is the i-th script in the archive and get_seed(seed) looks a script up by its seed.
+    Attributes:
+        index (ndarray): Seed, offset and length of every script, in the order they were written.
+    """
+
+    def __init__(self, directory, type_of_scenario):
+        """
+        Maps the index and the blob of the archive for a scenario type in directory
+        """
+        pack_file, index_file = archive_paths(directory, type_of_scenario)
+        self.index = _read_index(index_file)
+
+        self._file = open(pack_file, "rb")
+        # mmap cant map an empty file, an empty archive just has nothing to read
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(pack_file) else b""
+
+        # the scripts are written in seed order within a run, so a sorted copy of the seeds lets get_seed use a binary search
+        self._seed_order = np.argsort(self.index["seed"], kind="stable")
+        self._sorted_seeds = self.index["seed"][self._seed_order]
+
+
+    def __len__(self):
+        return len(self.index)
+
+
+    def __getitem__(self, i):
+        """
+        Returns the script bytes of the i-th scenario in the archive
+        """
+        seed, offset, length = self.index[i]
+        return self._data[offset:offset + length]
+
+
+    def get_seed(self, seed):
+        """
+        Returns the script bytes of the scenario with the given seed
+        """
+        position = np.searchsorted(self._sorted_seeds, seed)
+        if position == len(self._sorted_seeds) or self._sorted_seeds[position] != seed:
+            raise KeyError(f"seed {seed} is not in the archive")
+        return self[self._seed_order[position]]
+
+
+    def close(self):
+        """
+        Unmaps the blob and closes the file
+        """
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -2,33 +2,216 @@
 #each generator can produce randomized scenarios, export them as Lua scripts for CMO, log metadata in CSV files, and organize them into train/test/validate splits
 
 import numpy as np
-import random
-import csv
 from pathlib import Path
 import os
-import shutil
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from scenario_rng import ScenarioStream
+from lua_renderer import LuaRenderer
+from metadata_writer import MetadataWriter
+from scenario_archive import ArchiveWriter
+from scenario_store import StoreWriter, ScenarioStore, STORE_VERSION
+from run_manifest import RunManifest
+from output_versions import OutputVersions
+from zone_index import ZoneIndex
+from geodesy import KM_PER_DEGREE, destination_point, offset_point, unwrap_longitude
+from write_pipeline import WritePipeline
+from placement_constraints import acceptance_rates
+from difficulty_features import scenario_features, opening_width
+from run_statistics import RunStatistics, STATISTICS_EVERY, statistics_paths
+
+# every scenario is allocated to train, test or validate, 60% train, 20% test, 20% validate
+SPLITS = ['train', 'test', 'validate']
+SPLIT_WEIGHTS = [0.6, 0.2, 0.2]
+
+# all generated files live under here, joined with Path so it works on any OS
+# each scenario type gets scenario_data/<type>/versions/<run> per run and scenario_data/<type>/current pointing at the latest finished one
+SCENARIO_DATA_DIR = Path("scenario_data")
+
+# "files" writes one lua script per scenario, "archive" packs every script of a split into one archive (see scenario_archive.py)
+# "store" writes only the binary scenario store (see scenario_store.py), which every mode writes, the csv and lua are then rendered from it on demand
+OUTPUT_MODES = ("files", "archive", "store")
+
+# lua files handed to a writer thread at a time when generate_scenario runs with writer_threads
+WRITE_CHUNK = 256
+
+# a run with shard=(k, n) generates the k-th of n contiguous blocks of the seeds into scenario_data/<type>/shard-<k>-of-<n>
+# so machines can each take a shard with no coordinator, merge_shards.py then puts the shards back together in seed order
+SHARD_DIR = "shard-{}-of-{}"
+
+# units are placed in km along great circles (see geodesy.py), the spacings below and on the generators are in degrees of arc, KM_PER_DEGREE km each
+# so a scenario has the same shape and size in every zone instead of being squashed east to west near the poles
+
+# each random draw of a scenario is keyed on the scenario seed and one of these slots, not on the order of the draws
+# so a scenario is identical whether it was generated alone or in a batch of a million
+SLOT_ZONE = 0
+SLOT_SPLIT = 1
+SLOT_SAM_LAT = 2
+SLOT_SAM_LONG = 3
+SLOT_JET_LAT = 4
+SLOT_JET_LONG = 5
+SLOT_TARGET_LAT = 6
+SLOT_TARGET_LONG = 7
+SLOT_LINE_ANGLE = 8
+SLOT_ADJACENT_ANGLES = 9
+SLOT_REMOVED_SAM = 10
+SLOT_JET_ANGLE = 11
+SLOT_JET_RADIUS = 12
+SLOT_MIX = 13
+
+
+class ScenarioBatch():
+    """
+    Holds the units of a batch of scenarios as NumPy arrays, one row per scenario.
+    Attributes:
+        seeds (ndarray): Seed of each scenario, shape (N,).
+        stream (ScenarioStream): Random draws for the batch, one stream per seed.
+        zone_idx (ndarray): Index into the generator's zone_names, shape (N,).
+        split_idx (ndarray): Index into the generator's splits, shape (N,).
+        target_lat (ndarray): Latitude of the target, shape (N,).
+        target_long (ndarray): Longitude of the target, shape (N,).
+        jet_lat (ndarray): Latitude of the jet, shape (N,).
+        jet_long (ndarray): Longitude of the jet, shape (N,).
+        sam_lats (ndarray): Latitudes of the SAM sites, shape (N, number of SAMs).
+        sam_longs (ndarray): Longitudes of the SAM sites, shape (N, number of SAMs).
+        attempts (ndarray): Number of times each scenario was drawn before it passed the generator's constraints, shape (N,).
+        accepted (ndarray): False for scenarios that still broke a constraint after max_attempts draws, shape (N,).
+        features (ndarray): Difficulty features of each scenario (FEATURE_DTYPE in scenario_store.py), shape (N,).
+        num_sams, scen_type (ndarray): Only on batches of a ScenarioMix, the real number of SAMs and the type of each row, shape (N,).
+    """
+
+    def __init__(self, seeds, attempt=0):
+        """
+        Initializes an empty batch for the given seeds, attempt picks which redraw of the seeds the stream gives
+        """
+        self.stream = ScenarioStream(seeds, attempt)
+        self.seeds = self.stream.seeds
+
+
+    def __len__(self):
+        return len(self.seeds)
+
+
+    def digest(self):
+        """
+        Returns a sha256 hex digest of the seeds, zones, splits and unit positions of the batch
+        """
+        digest = hashlib.sha256()
+        for array in (self.seeds, self.zone_idx, self.split_idx, self.target_lat, self.target_long, self.jet_lat, self.jet_long, self.sam_lats, self.sam_longs):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+
+    def update(self, rows, other):
+        """
+        Copies every per-scenario array of other (a batch of the scenarios in rows) into those rows of this batch
+        """
+        for name, value in vars(other).items():
+            if name != "seeds" and isinstance(value, np.ndarray) and name in vars(self):
+                getattr(self, name)[rows] = value
+
+
+    def select(self, rows):
+        """
+        Returns a new batch holding only the scenarios in rows
+        """
+        selected = ScenarioBatch(self.seeds[rows])
+        for name, value in vars(self).items():
+            if name != "seeds" and isinstance(value, np.ndarray) and len(value) == len(self):
+                setattr(selected, name, value[rows])
+        return selected
+
+
+class ScenarioRecord():
+    """
+    One generated scenario, small enough to hand straight to the training environment without touching the disk.
+    Attributes:
+        type_of_scenario (String): Scenario type.
+        seed (int): Seed of the scenario.
+        zone (String): Name of the zone the scenario was placed in.
+        split (String): Allocation, Train, Test or Validate
+        target_lat, target_long (float): Location of the target.
+        jet_lat, jet_long (float): Location of the jet.
+        sam_lats, sam_longs (tuple): Locations of the SAM sites.
+        target_dbid, jet_dbid, sam_dbid (int): Database IDs of the units.
+    """
+
+    __slots__ = ("type_of_scenario", "seed", "zone", "split", "target_lat", "target_long", "jet_lat", "jet_long",
+                 "sam_lats", "sam_longs", "target_dbid", "jet_dbid", "sam_dbid", "_renderer")
+
+    def __init__(self, type_of_scenario, seed, zone, split, target_lat, target_long, jet_lat, jet_long, sam_lats, sam_longs, renderer):
+        """
+        Initializes the record, the dbids come from the renderer of the generator that made it
+        """
+        self.type_of_scenario = type_of_scenario
+        self.seed = seed
+        self.zone = zone
+        self.split = split
+        self.target_lat = target_lat
+        self.target_long = target_long
+        self.jet_lat = jet_lat
+        self.jet_long = jet_long
+        self.sam_lats = sam_lats
+        self.sam_longs = sam_longs
+        self.target_dbid = renderer.target_dbid
+        self.jet_dbid = renderer.jet_dbid
+        self.sam_dbid = renderer.sam_dbid
+        self._renderer = renderer
+
+
+    def to_lua(self):
+        """
+        Renders the lua script of the scenario as bytes, only done when it is asked for
+        """
+        return self._renderer.render(self.jet_lat, self.jet_long, self.target_lat, self.target_long, self.sam_lats, self.sam_longs).encode("utf-8")
+
+
+    def to_dict(self):
+        """
+        Returns the scenario as a dict of plain python values, ready for json
+        """
+        return {name: list(getattr(self, name)) if name in ("sam_lats", "sam_longs") else getattr(self, name)
+                for name in self.__slots__ if name != "_renderer"}
+
+
+    def __repr__(self):
+        return f"ScenarioRecord({self.type_of_scenario}, seed={self.seed}, zone={self.zone}, split={self.split}, sams={len(self.sam_lats)})"
+
 
 class DefaultGen():
     """
     Generates Scenario 0 type maps for Command Modern Operations: PE. Scenario 0 includes only 1 target, 1 jet and 1 SAM site.
     This class defines a relationship between the SAM sites, the jet and target such that the jet and target spawn based on the location of the SAM site.
     The jet remains to the south of the SAM site, while the target remains to the north.
+    Scenarios are generated in batches, the unit locations are held in a ScenarioBatch rather than on the generator.
     Attributes:
-        target_lat (float): Latitude of the target.
-        target_long (float): Longitude of the target.
         target_dbid (int): Database ID of the target.
-        jet_lat (float): Latitude of the jet.
-        jet_long (float): Longitude of the jet.
         jet_dbid (int): Database ID of the jet.
-        sam_lat (float): Latitude of the SAM site.
-        sam_long (float): Longitude of the SAM site.
         sam_dbid (int): Database ID of the SAM site.
+        zones (dict): {name: [lat_a, lat_b, long_a, long_b]} boxes or {name: [[lat, long], ...]} polygons.
+        zone_index (ZoneIndex): The zones checked and compiled for sampling, see zone_index.py.
+        zone_names (list): Names of the zones, in the order used by ScenarioBatch.zone_idx.
+        zone_bounds (ndarray): Lat/lon bounding box of each zone, low to high, shape (number of zones, 4).
+        splits (list): Names of the splits, in the order used by ScenarioBatch.split_idx.
+        split_weights (list): Probability of a scenario being allocated to each split.
         csv_file_initiailized (Boolean): Flag for tracking metadata file.
         type_of_scenario (String): Scenario type.
-        self.split (String): Allocation, Train, Test or Validate
+        workers (int): Number of processes generate_scenario spreads the seeds over.
+        constraints (list): Placement constraints (see placement_constraints.py) every scenario has to pass, scenarios that fail are redrawn.
+        max_attempts (int): Number of draws a scenario gets to pass the constraints before it is left out.
+        placement_stats (dict): {zone: [scenarios, attempts, rejected]} counted by generate_scenario, see acceptance_rates().
+        telemetry (Telemetry): Sink generate_scenario records timings and file counts into, None when the run is not instrumented.
+        output_dir (Path): Folder the splits and metadata are written under, the version generate_scenario is writing to.
+        start_fresh (Boolean): Set by clear_files_in_directories so the next run does not build on earlier output.
+        placement_order (tuple): Order the gen_* methods are called in, each one can use the units placed before it.
     """
 
-    def __init__(self, sam_dbid, jet_dbid, target_dbid, num_scens, zones: list, csv_file_initialized=False, split=None, seed: int=0):
+    placement_order = ("gen_sam", "gen_jet", "gen_target")
+
+    def __init__(self, sam_dbid, jet_dbid, target_dbid, num_scens, zones: list, csv_file_initialized=False, split=None, seed: int=0, workers: int=1, constraints=None, max_attempts: int=100, zone_weights="uniform"):
         """
         Initializes attributes for Scenario Generator 0
         """
@@ -43,246 +226,314 @@ class DefaultGen():
         self.jet_dbid=jet_dbid
         self.target_dbid=target_dbid
         self.num_scens=num_scens
+        self.workers=workers
+        self.constraints=list(constraints or [])
+        self.max_attempts=max_attempts
+        self.placement_stats={}
+        self.telemetry=None
+        self.output_dir=SCENARIO_DATA_DIR
+        self.start_fresh=False
+
+        # the splits a scenario can be allocated to and how likely each one is
+        self.splits = SPLITS
+        self.split_weights = SPLIT_WEIGHTS
+
+        # the zones are checked and compiled once, zone_weights is "uniform", "area" or {zone: weight}
+        self.zone_index = ZoneIndex(self.zones, zone_weights)
+        self.zone_names = self.zone_index.names
+        self.zone_bounds = self.zone_index.bounds
+
+        # the static parts of the lua script only need to be built once per generator
+        self.lua_renderer = LuaRenderer(self.sam_dbid, self.jet_dbid, self.target_dbid)
+
+
+    def config(self):
+        """
+        Returns the parameters that decide what this generator produces, used to check if earlier output can be reused
+        The store version is part of it, a store written in another format is never appended to
+        """
+        return {"generator": type(self).__name__, "type_of_scenario": self.type_of_scenario, "sam_dbid": self.sam_dbid,
+                "jet_dbid": self.jet_dbid, "target_dbid": self.target_dbid, "zones": self.zones, "split_weights": self.split_weights,
+                "zone_weights": self.zone_index.describe(), "placement": "great_circle",
+                "constraints": [constraint.describe() for constraint in self.constraints], "max_attempts": self.max_attempts,
+                "store_version": STORE_VERSION}
+
+
+    def scenario_types(self):
+        """
+        Returns the scenario types this generator makes
+        """
+        return [self.type_of_scenario]
+
+
+    def gen_batch(self, seeds, telemetry=None):
+        """
+        Generates every scenario in seeds at once and returns them as a ScenarioBatch
+        Scenarios that break a constraint are redrawn with a fresh stream for their seed, keeping their zone and split,
+        until they pass or run out of attempts, so a scenario only ever depends on its own seed
+        With a telemetry sink the zone/split draws, every placement stage and the constraint checks are timed
+        """
+
+        if telemetry is not None:
+            start = time.perf_counter()
+        batch = ScenarioBatch(seeds)
+        batch.zone_idx = self.zone_index.sample_zones(batch.stream, SLOT_ZONE)
+        batch.split_idx = batch.stream.choice(SLOT_SPLIT, self.split_weights)
+        if telemetry is not None:
+            telemetry.record_stage("draw_zone_split", time.perf_counter() - start)
+        self.place_units(batch, telemetry)
+
+        batch.attempts = np.ones(len(batch), dtype=np.int64)
+        batch.accepted = self.check_constraints(batch, telemetry)
+
+        rows = np.flatnonzero(~batch.accepted)
+        for attempt in range(1, self.max_attempts):
+            if len(rows) == 0:
+                break
+            retry = ScenarioBatch(batch.seeds[rows], attempt)
+            retry.zone_idx = batch.zone_idx[rows]
+            retry.split_idx = batch.split_idx[rows]
+            self.place_units(retry, telemetry)
+
+            passed = self.check_constraints(retry, telemetry)
+            batch.update(rows, retry)
+            batch.attempts[rows] += 1
+            batch.accepted[rows] = passed
+            rows = rows[~passed]
+
+        # the features are worked out once every scenario has its final placement
+        if telemetry is not None:
+            start = time.perf_counter()
+        self.gen_features(batch)
+        if telemetry is not None:
+            telemetry.record_stage("gen_features", time.perf_counter() - start)
+        return batch
+
+
+    def place_units(self, batch, telemetry=None):
+        """
+        Runs the gen_* methods of the generator on a batch in placement_order, timing each one if there is a telemetry sink
+        """
+        if telemetry is None:
+            for stage in self.placement_order:
+                getattr(self, stage)(batch)
+            return
+
+        for stage in self.placement_order:
+            start = time.perf_counter()
+            getattr(self, stage)(batch)
+            telemetry.record_stage(stage, time.perf_counter() - start)
+
+
+    def check_constraints(self, batch, telemetry=None):
+        """
+        Returns which scenarios of a batch pass every constraint of the generator
+        """
+        if telemetry is not None:
+            start = time.perf_counter()
+        passed = np.ones(len(batch), dtype=bool)
+        for constraint in self.constraints:
+            passed &= constraint.check(batch, self)
+        if telemetry is not None and self.constraints:
+            telemetry.record_stage("check_constraints", time.perf_counter() - start)
+        return passed
+
+
+    def record_acceptance(self, batch):
+        """
+        Adds the scenarios, draws and rejections of a batch to placement_stats, per zone
+        """
+        scenarios = np.bincount(batch.zone_idx, minlength=len(self.zone_names))
+        attempts = np.bincount(batch.zone_idx, weights=batch.attempts, minlength=len(self.zone_names))
+        rejected = np.bincount(batch.zone_idx, weights=~batch.accepted, minlength=len(self.zone_names))
+        for zone, counts in zip(self.zone_names, zip(scenarios.tolist(), attempts.tolist(), rejected.tolist())):
+            stats = self.placement_stats.setdefault(zone, [0, 0, 0])
+            for i in range(3):
+                stats[i] += int(counts[i])
+
+
+    def acceptance_rates(self):
+        """
+        Returns {zone: accepted scenarios per draw} for everything generate_scenario has made so far, 1.0 means nothing was ever rejected
+        """
+        return acceptance_rates(self.placement_stats)
+
+
+    def iter_batches(self, start=0, stop=None, batch_size=10000):
+        """
+        Lazily yields ScenarioBatches covering seeds [start, stop), stop defaults to num_scens
+        Nothing is written to disk
+        """
+        stop = self.num_scens if stop is None else stop
+        for batch_start in range(start, stop, batch_size):
+            yield self.gen_batch(np.arange(batch_start, min(batch_start + batch_size, stop)))
 
 
-    def gen_sam(self):
+    def iter_scenarios(self, start=0, stop=None, batch_size=10000):
+        """
+        Lazily yields a ScenarioRecord for every seed in [start, stop), stop defaults to num_scens
+        The records are computed batch_size at a time and nothing is written to disk, call to_lua() on a record to render it
+        """
+        for batch in self.iter_batches(start, stop, batch_size):
+            yield from self.batch_records(batch)
+
+
+    def get(self, index):
+        """
+        Regenerates scenario index on its own and returns its ScenarioRecord, exactly the scenario a batch run writes for that seed
+        Every draw of a scenario comes from its own counter based stream, so this costs the same for index 10 as for index 10 million
+        Returns None if the scenario never passed the constraints, a batch run leaves it out too
+        """
+        index = int(index)
+        if index < 0:
+            raise IndexError(f"scenario index must not be negative, got {index}")
+        records = self.batch_records(self.gen_batch(np.array([index], dtype=np.uint64)))
+        return records[0] if records else None
+
+
+    def __getitem__(self, index):
+        """
+        generator[i] is generator.get(i) for i in [0, num_scens), negative indices count back from num_scens
+        A slice regenerates its scenarios as one batch and returns their records, rejected scenarios are left out
+        """
+        if isinstance(index, slice):
+            return self.batch_records(self.gen_batch(np.arange(*index.indices(self.num_scens), dtype=np.uint64)))
+        index = int(index)
+        if index < 0:
+            index += self.num_scens
+        if not 0 <= index < self.num_scens:
+            raise IndexError(f"scenario index out of range for {self.num_scens} scenarios")
+        return self.get(index)
+
+
+    def batch_records(self, batch):
+        """
+        Splits a ScenarioBatch into a list of ScenarioRecords, scenarios that never passed the constraints are left out
+        """
+        if not batch.accepted.all():
+            batch = batch.select(np.flatnonzero(batch.accepted))
+
+        zones = [self.zone_names[z] for z in batch.zone_idx]
+        splits = [self.splits[s] for s in batch.split_idx]
+        sam_lats = [tuple(lats) for lats in batch.sam_lats.tolist()]
+        sam_longs = [tuple(longs) for longs in batch.sam_longs.tolist()]
+
+        # batches mixing generators (see scenario_mix.py) carry the type and number of sams of every row
+        types = batch.scen_type.tolist() if hasattr(batch, "scen_type") else [self.type_of_scenario]*len(batch)
+        if hasattr(batch, "num_sams"):
+            sam_lats = [lats[:k] for lats, k in zip(sam_lats, batch.num_sams.tolist())]
+            sam_longs = [longs[:k] for longs, k in zip(sam_longs, batch.num_sams.tolist())]
+
+        return [ScenarioRecord(*fields, self.lua_renderer) for fields in
+                zip(types, batch.seeds.tolist(), zones, splits, batch.target_lat.tolist(), batch.target_long.tolist(),
+                    batch.jet_lat.tolist(), batch.jet_long.tolist(), sam_lats, sam_longs)]
+
+
+    def gen_sam(self, batch):
         """
         Generates the location of SAM for generator 0
         The SAM is generated within the zone with a uniform probability within defined latitude and longitude coordinates.
         """
 
-        self.zone_name, self.sam_zone=random.choice(list(self.zones.items()))
+        sam_lat, sam_long = self.zone_index.sample_points(batch.stream, batch.zone_idx, SLOT_SAM_LAT, SLOT_SAM_LONG)
 
-        self.sam_lat=np.random.uniform(self.sam_zone[0],self.sam_zone[1])
-        self.sam_long=np.random.uniform(self.sam_zone[2],self.sam_zone[3])
+        batch.sam_lats = sam_lat[:, None]
+        batch.sam_longs = sam_long[:, None]
 
 
-    def gen_jet(self):
+    def gen_jet(self, batch):
         """
         Generates location of fighter jet based on the SAM site for generator 0
         The jet is generated within 5 degrees of the SAM site, the jet remains south of the target
         """
 
-        self.jet_lat=self.sam_lat+np.random.uniform(-5,-2.5) #keep the target south of the sam
-        self.jet_long=self.sam_long+np.random.uniform(-5,5)
+        north = batch.stream.uniform(SLOT_JET_LAT, -5, -2.5)*KM_PER_DEGREE #keep the jet south of the sam
+        east = batch.stream.uniform(SLOT_JET_LONG, -5, 5)*KM_PER_DEGREE
+        batch.jet_lat, batch.jet_long = offset_point(batch.sam_lats[:, 0], batch.sam_longs[:, 0], north, east)
 
 
-    def gen_target(self):
+    def gen_target(self, batch):
         """
         Generates location of target based on the SAM site for generator 0
         The target is generated within 5 degrees of the SAM site, the target remains north of the target
         """
 
-        self.target_lat=self.sam_lat+np.random.uniform(2.5,5) #keep the target north of the sam
-        self.target_long=self.sam_long+np.random.uniform(-5,5)
+        north = batch.stream.uniform(SLOT_TARGET_LAT, 2.5, 5)*KM_PER_DEGREE #keep the target north of the sam
+        east = batch.stream.uniform(SLOT_TARGET_LONG, -5, 5)*KM_PER_DEGREE
+        batch.target_lat, batch.target_long = offset_point(batch.sam_lats[:, 0], batch.sam_longs[:, 0], north, east)
 
 
-    def gen_lua_script(self):
+    def gen_features(self, batch):
+        """
+        Works out the difficulty features of a placed batch for generator 0, a single SAM has no gap and no line
+        """
+        batch.features = scenario_features(batch)
+
+
+    def gen_lua_script(self, batch, row, write=True, telemetry=None):
         """
         Create a lua script that is readable by CMO and can be used for all generator types
+        The script is rendered in memory and returned as bytes, with write=False nothing is written to disk
+        With a telemetry sink the rendering and the write are timed separately and the file is counted for its split
         """
 
         # moved the scenario_data to be in their own folders where the python scripts are
-        # if the directory doesnt exist, make it
         # removing hard-paths is important if we run the code on different computers
-        # Would be interesting here if we did some probability, and based on that probability we assigned the scenario to eeither 1) train, 2) test or 3) validate
         # No clue if this is the right approach, due to the nature of randomness, there could be the same scenario within the test/validation/train sets
-        choices = ['train', 'test', 'validate']
-         # 60% train, 20% test, 20% validate
-         
-        weights = [0.6, 0.2, 0.2]
-        self.split = random.choices(choices, weights=weights, k=1)[0]
-
-        file_name=Path(f"scenario_data\\{self.split}\\{self.type_of_scenario}\\{self.type_of_scenario}_{self.seed}.lua")
-               
-        directory = os.path.dirname(file_name)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
-        if self.type_of_scenario == "Scenario_0":
-            self.sam_lat_list = [self.sam_lat]  
-            self.sam_long_list = [self.sam_long]  
-        else:
-            self.sam_lat_list = self.sam_lats
-            self.sam_long_list = self.sam_longs
-
-        with open(file_name, "w") as lua_file:
-            lua_file.write(f"""
-Tool_BuildBlankScenario()
-ScenEdit_SetTime({{Date= "1.1.2030", Time= "00.00.00", StartDate = "1.1.2030", StartTime = "00.00.00", Duration = "0:02:00"}})
-local endTime = os.date('%d/%m/%Y %H:%M:%S', ScenEdit_CurrentTime() + ((2*60)-1)*60)
-print(endTime)
-local file_path = "C:/Users/Brayden/Desktop/pycmo_recent/afrl_pycmo/pycmo/configs/scen_has_ended.txt"
--- function here is meant to write false when the scenario starts, but for some reason it never hits this, so we worked
--- with the semaphore idea instead, and write False to scen_has_ended through reset() in cmo_env.py
--- no current trigger exists to use this function
-function mark_scenario_started()  
-    local file = io.open(file_path, "w")
-    if file then
-        file:write("False")
-        file:close()
-    else
-        error("Failed to open file: " .. file_path)
-    end
-end
-mark_scenario_started()
-
-ScenEdit_AddSide({{side = "attacker_side"}})
-ScenEdit_AddSide({{side = "target_side"}})
-ScenEdit_SetSideOptions({{side = "attacker_side", awareness = 3}})
-ScenEdit_SetSidePosture("attacker_side", "target_side", "H")
-ScenEdit_SetSidePosture("target_side", "attacker_side", "H")
-ScenEdit_AddUnit({{type ='Aircraft', unitname ="shooter", dbid ={self.jet_dbid}, side = "attacker_side", Latitude ={self.jet_lat}, Longitude ={self.jet_long}, Altitude = "4000 ft", LoadoutID = 33070}})
-ScenEdit_AddUnit({{type ='Facility', unitname ="target_ammo", dbid ={self.target_dbid}, side = "target_side", Latitude ={self.target_lat}, Longitude ={self.target_long} }})""")
-
-        for i in range(len(self.sam_long_list)):
-            with open(file_name,"a") as lua_file:
-                lua_file.write(f"""
-ScenEdit_AddUnit({{type ='Facility', unitname ='sam', dbid ={self.sam_dbid}, side = 'target_side', Latitude = {self.sam_lat_list[i]}, Longitude = {self.sam_long_list[i]} }})""")
-
-        with open(file_name, "a") as lua_file:
-            lua_file.write(f"""
-ScenEdit_SetTrigger({{
-    name = 'Trigger_Target_Ammo_Destroyed_Points',
-    mode = 'add',
-    type = 'UnitDestroyed',
-    targetfilter = {{
-        SpecificUnitID = 'target_ammo',
-        TargetSide = 'target_side'
-    }}
-}})
-ScenEdit_SetTrigger({{
-    name = 'Trigger_Target_Ammo_Destroyed_End',
-    mode = 'add',
-    type = 'UnitDestroyed',
-    targetfilter = {{
-        SpecificUnitID = 'target_ammo',
-        TargetSide = 'target_side'
-    }}
-}})
-
-ScenEdit_SetTrigger({{
-    name = "End_Scenario_Timelimit",
-    mode = 'add',
-    type = 'Time',
-    Time = endTime
-}})
-
-ScenEdit_SetEvent('Scenario_Reached_Timelimit', {{mode = 'add'}})
-ScenEdit_SetEvent('Target_Ammo_Destroyed_GivePoints', {{mode = 'add'}})
-ScenEdit_SetEvent('Target_Ammo_Destroyed_EndScenario', {{mode = 'add'}})
-
-ScenEdit_SetEventTrigger('Scenario_Reached_Timelimit', {{
-    mode = 'add',
-    description = 'End_Scenario_Timelimit'
-}})
-
-ScenEdit_SetEventTrigger('Target_Ammo_Destroyed_GivePoints', {{
-    mode = 'add',
-    description = 'Trigger_Target_Ammo_Destroyed_Points'
-}})
-ScenEdit_SetEventTrigger('Target_Ammo_Destroyed_EndScenario', {{
-    mode = 'add',
-    description = 'Trigger_Target_Ammo_Destroyed_End'
-}})
-
-ScenEdit_SetAction({{
-    mode = 'add',
-    description = 'give_points',
-    type = 'Points',
-    SideID = 'attacker_side',
-    PointChange = 1
-}})
-
-ScenEdit_SetAction({{
-    mode = 'add',
-    description = 'end_with_script',
-    type = 'LuaScript',
-    ScriptText = 'ScenEdit_EndScenario()'
-}})
-
-ScenEdit_SetEventAction('Scenario_Reached_Timelimit', {{
-    mode = 'add',
-    description = 'end_with_script'
-}})
--- Give points and end the scenario (if we destroy the target)
-ScenEdit_SetEventAction('Target_Ammo_Destroyed_GivePoints', {{
-    mode = 'add',
-    description = 'give_points'
-}})
-
-ScenEdit_SetEventAction('Target_Ammo_Destroyed_EndScenario', {{
-    mode = 'add',
-    description = 'end_with_script'
-}})
-
-Command_SaveScen("C:/Users/Brayden/Desktop/pycmo_recent/afrl_pycmo/scen/example_0.save")
--- this function works and runs everytime because of the trigger on line 55
-function mark_scenario_ended()
-    local file = io.open(file_path, "w")
-    if file then
-        file:write("True")
-        file:close()
-    else
-        error("Failed to open file: " .. file_path)
-    end
-end
-
-ScenEdit_SetTrigger({{name = 'Game_Ended_trigger', mode = 'add', type="ScenEnded"}})
-ScenEdit_SetEvent('Game_ended_event',{{mode = 'add'}})
-ScenEdit_SetEventTrigger('Game_ended_event',{{mode = 'add', description = 'Game_Ended_trigger'}})
-ScenEdit_SetAction({{mode='add', name="end_game_act", type="LuaScript", ScriptText = "mark_scenario_ended()"}})
-ScenEdit_SetEventAction('Game_ended_event', {{mode = 'add', description = 'end_game_act'}})""")
-
-
-    def gen_csv_file(self):
-        """
-        Generate a csv file for any generator type that contains the latitutde and longitude of the sam, jet, and target along with other data such as dbids, seed, split, zone, scenario type
-        """
-
-        # scenario 0 is the only one with an int instead of a list for the sam locations
-        # check if we are within scenario_0 and if we are cast the ints to a list so we can use the same zip method
-
-
-        # test to see if this will work when we have more than 1 sam_site (seems to work now, our seperate is a ;)
-        #for i in range(10):
-           # sam_lat_list.append(self.sam_lat)
-           # sam_long_list.append(self.sam_long)
-
-        sam_coords = list(zip(self.sam_lat_list, self.sam_long_list))
-        sam_coords_str = ", ".join([f"({lat}, {long})" for lat, long in sam_coords])
-
-        # placing the meta data within its own directory & check if we need to create the directory (saves new users a headache from file not found errors)
-        csv_file=Path(f"scenario_data\\metadata\\{self.type_of_scenario}.csv")
-       
-        directory = os.path.dirname(csv_file)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
-        headers = ["scen_type", "seed", "split", "zone", "target_location", "target_dbid", "jet_location", "jet_dbid", "sam_locations", "sam_dbid"]
-
-        row = [self.type_of_scenario, self.seed, self.split, self.zone_name, f"({self.target_lat}, {self.target_long})", f"{self.target_dbid}", f"({self.jet_lat}, {self.jet_long})", f"{self.jet_dbid}",  sam_coords_str, f"{self.sam_dbid}"]
-        if not self.csv_file_initialized:
-            with open(csv_file, "w", newline="") as csvfile:
-                csvwriter = csv.writer(csvfile)
-                csvwriter.writerow(headers)
-            self.csv_file_initialized = True
-
-        with open(csv_file, "a", newline="") as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(row)
+        if telemetry is not None:
+            start = time.perf_counter()
+        script = self.lua_renderer.render_bytes(batch, row)
+        if telemetry is not None:
+            telemetry.record_stage("render_lua", time.perf_counter() - start)
+
+        if write:
+            split = self.splits[batch.split_idx[row]]
+            file_name = self.lua_file_name(batch, row)
+            if telemetry is not None:
+                start = time.perf_counter()
+            self.lua_renderer.write(file_name, script)
+            if telemetry is not None:
+                telemetry.record_stage("write_lua", time.perf_counter() - start)
+                telemetry.record_file(split, len(script))
+                telemetry.count("opens")
+
+        return script
+
+
+    def lua_file_name(self, batch, row):
+        """
+        Path the lua script of a scenario of a batch is written to
+        """
+        return self.output_dir / self.splits[batch.split_idx[row]] / self.type_of_scenario / f"{self.type_of_scenario}_{int(batch.seeds[row])}.lua"
+
+
+    def gen_csv_file(self, batch):
+        """
+        Add the scenarios of a batch to the metadata csv file of the generator type, with the latitude and longitude of the sam, jet, and target in their own columns along with other data such as dbids, seed, split, zone, scenario type
+        The rows go through the MetadataWriter that generate_scenario keeps open for the whole run
+        """
+
+        if self.telemetry is not None:
+            start = time.perf_counter()
+        self.metadata_writer.write_batch(batch, self)
+        if self.telemetry is not None:
+            self.telemetry.record_stage("gen_csv_file", time.perf_counter() - start)
 
 
     def clear_files_in_directories(self):
         """
         Cleans all scenarios previously generated within the scenario_data folder
+        Nothing is deleted while we wait, the next generate_scenario starts a fresh version instead of building on the current one,
+        versions that are not current and scenarios left over from before output was versioned are moved to the trash and deleted in the background
+        The current version stays readable until the next run replaces it
         """
 
-        dirs_to_clean = [
-            'scenario_data\\train',
-            'scenario_data\\test',
-            'scenario_data\\validate'
-        ]
+        versions = OutputVersions(SCENARIO_DATA_DIR / self.type_of_scenario)
+        self.start_fresh = True
+        versions.collect_garbage()
+
+        # scenario_data/<split>/<type> and scenario_data/metadata are where unversioned runs wrote to
+        dirs_to_clean = [SCENARIO_DATA_DIR / split for split in SPLITS]
 
         for parent_dir in dirs_to_clean:
             if not os.path.isdir(parent_dir):
@@ -290,59 +541,402 @@ ScenEdit_SetEventAction('Game_ended_event', {{mode = 'add', description = 'end_g
 
             for item in os.listdir(parent_dir):
                 item_path = os.path.join(parent_dir, item)
-                if os.path.isdir(item_path):
-                    try:
-                        shutil.rmtree(item_path)
-                    except Exception as e:
-                        print(f"Error removing '{item_path}': {e}")
+                try:
+                    if os.path.isdir(item_path) or item.endswith((".pack", ".idx", ".idx.npy")): #packed archives sit next to the scenario folders
+                        versions.discard(item_path)
+                except Exception as e:
+                    print(f"Error removing '{item_path}': {e}")
             print(f"Cleaned subdirectories in: {parent_dir}")
 
+        # the scenarios the manifests point at are gone, so the manifests have to go too
+        metadata_dir = SCENARIO_DATA_DIR / "metadata"
+        if os.path.isdir(metadata_dir):
+            for item in os.listdir(metadata_dir):
+                if item.endswith("_manifest.json"):
+                    os.remove(os.path.join(metadata_dir, item))
+
+        # the renderer would otherwise skip remaking the directories we just removed
+        self.lua_renderer.made_dirs.clear()
+
 
-    def generate_scenario(self):
+    def generate_scenario(self, batch_size=10000, sam_layout="flat", flush_every=10000, output_mode="files", resume=True, telemetry=None,
+                          writer_threads=0, max_pending_batches=4, script_layout="inline", shard=None, statistics_every=STATISTICS_EVERY):
         """
         Generate a given scenario using the functions of the given generator class
+        The seeds are cut into ranges of at most batch_size scenarios, with workers > 1 the ranges are handed to a process pool
+        Every worker writes the lua scripts of its range and sends the batch back, the metadata is then written here in seed order
+        so the output is the same no matter how many workers are used. sam_layout and flush_every are passed to the MetadataWriter
+        With output_mode="archive" the scripts of each split are packed into scenario_data/<split>/<type>.pack instead of one file per scenario
+        Every mode writes the binary store (see scenario_store.py) next to the metadata, output_mode="store" writes nothing else
+        Every run writes into a new version, scenario_data/<type>/versions/<run>, and scenario_data/<type>/current is only switched to it
+        once the run has finished, versions that are no longer current are then deleted in the background (see output_versions.py)
+        With resume=True the run manifest is checked first and only the seeds that are not on disk yet are generated,
+        a run of the same generator with a bigger num_scens extends the dataset (as a new version that starts as a copy of the current one)
+        and a crashed run picks up after its last finished range in the version it left unfinished
+        With a Telemetry sink (see instrumentation.py) every stage is timed, the files, bytes and opens are counted per split and
+        the summary is written to scenario_data/metadata/<type>_telemetry.json, its profiler (if any) runs around the generation loop
+        With writer_threads > 0 the run is pipelined (see write_pipeline.py): batches are only rendered while being generated, a pool of
+        writer_threads threads writes the lua files and one more thread appends the metadata and checkpoints each batch in seed order,
+        so generating the next batch overlaps with the disk. At most max_pending_batches batches wait to be written before generation blocks
+        With script_layout="runtime" the boilerplate of the lua scripts is written once to scenario_runtime.lua next to the splits and every
+        scenario script is only a build_scenario call with its units (see lua_renderer.py)
+        With shard="k/n" only the k-th of n contiguous blocks of the seeds is generated, into its own versioned folder
+        scenario_data/<type>/shard-<k>-of-<n>, so shards run on different machines never collide. merge_shards.py combines them
+        While it runs, running statistics of every scenario in the version (see run_statistics.py) are written next to the metadata
+        every statistics_every seconds and once more at the end, so the run can be watched live. statistics_every=None turns them off
         """
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"output_mode must be one of {OUTPUT_MODES}, got '{output_mode}'")
+
+        config = self.config()
+        config.update(sam_layout=sam_layout, output_mode=output_mode, script_layout=script_layout)
+
+        # a shard's seeds depend on num_scens, so shards of different sizes never share a version
+        shard = parse_shard(shard)
+        type_dir = SCENARIO_DATA_DIR / self.type_of_scenario
+        seed_start, seed_stop = 0, self.num_scens
+        if shard is not None:
+            config.update(shard=list(shard), num_scens=self.num_scens)
+            type_dir = type_dir / SHARD_DIR.format(*shard)
+            seed_start, seed_stop = shard_range(self.num_scens, *shard)
+
+        versions = OutputVersions(type_dir)
+        resume = resume and not self.start_fresh
+        self.start_fresh = False
+
+        # earlier output can only be extended if it was made with exactly the same settings
+        version_dir = None
+        if resume:
+            # a crashed run left its version unfinished, carry on writing to it
+            for unfinished in reversed(versions.unfinished()):
+                if self.run_manifest(unfinished).matches(config):
+                    version_dir = unfinished
+                    break
+
+            current = versions.current()
+            if version_dir is None and current is not None and self.run_manifest(current).matches(config):
+                if not self.run_manifest(current).missing_ranges(seed_start, seed_stop):
+                    print(f"All {seed_stop - seed_start} scenarios are already generated!")
+                    return
+                version_dir = versions.create(extend=current)
+
+        if version_dir is None:
+            version_dir = versions.create()
+
+        self.output_dir = version_dir
+        metadata_dir = version_dir / "metadata"
+
+        self.lua_renderer = LuaRenderer(self.sam_dbid, self.jet_dbid, self.target_dbid, layout=script_layout)
+        if script_layout == "runtime":
+            self.lua_renderer.write_runtime(version_dir)
+        manifest = self.run_manifest(version_dir)
+        append = resume and manifest.matches(config)
+        if append:
+            manifest.restore_file_sizes()
+        else:
+            manifest.start(config)
+
+        self.telemetry = telemetry
+        if telemetry is not None:
+            telemetry.start()
+
+        # placing the meta data within its own directory, in store mode the csv is left to be rendered from the store
+        self.metadata_writer = None if output_mode == "store" else MetadataWriter(metadata_dir, self.type_of_scenario, sam_layout, flush_every, append=append)
+        self.store_writer = StoreWriter(metadata_dir, self.type_of_scenario, self.scenario_types(), self.zone_names, self.splits, append=append)
+        self.csv_file_initialized = True
+
+        # resumed and extended runs count the scenarios already in the store first, so the statistics always cover the whole version
+        self.statistics = None if statistics_every is None else RunStatistics(self.zone_names, self.splits, self.split_weights)
+        self.statistics_every = statistics_every
+        if self.statistics is not None:
+            if append:
+                self.statistics.update_store(ScenarioStore(metadata_dir, self.type_of_scenario))
+            print(f"Writing run statistics to {statistics_paths(metadata_dir, self.type_of_scenario)[0]}")
+
+        if output_mode == "archive":
+            self.archive_writers = [ArchiveWriter(version_dir / split, self.type_of_scenario, append=append) for split in self.splits]
+
+        # make sure every worker gets at least one range to work on
+        range_size = max(1, min(batch_size, -(-(seed_stop - seed_start) // self.workers)))
+        starts = []
+        stops = []
+        for missing_start, missing_stop in manifest.missing_ranges(seed_start, seed_stop): #determine how many scenarios are produced by changing num_scens
+            starts += list(range(missing_start, missing_stop, range_size))
+            stops += [min(start + range_size, missing_stop) for start in range(missing_start, missing_stop, range_size)]
+
+        num_missing = sum(stops) - sum(starts)
+        if num_missing == 0:
+            print(f"All {seed_stop - seed_start} scenarios are already generated!")
+            self.close_outputs()
+            self.finish_statistics(metadata_dir)
+            self.finish_telemetry(metadata_dir)
+            self.publish(versions, version_dir)
+            return
+
+        print(f"Generating {num_missing} scenarios!")
+        manifest.begin_run(seed_start, seed_stop)
+        pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            # map hands the batches back in the order the ranges were submitted
+            # when pipelined the ranges only render their scripts, the writer threads write them
+            ranges = (pool.map if pool is not None else map)(_write_scenario_range, repeat(self), starts, stops, repeat(output_mode), repeat(not writer_threads))
+            if writer_threads:
+                with WritePipeline(writer_threads, max_pending_batches=max_pending_batches) as pipeline:
+                    for batch, scripts, range_telemetry in ranges:
+                        self.queue_batch(pipeline, manifest, batch, scripts, range_telemetry, output_mode)
+            else:
+                for batch, scripts, range_telemetry in ranges:
+                    self.gen_output(batch, scripts, range_telemetry)
+                    self.checkpoint(manifest, batch)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            self.close_outputs()
+            self.finish_statistics(metadata_dir)
+            self.finish_telemetry(metadata_dir)
+
+        manifest.finish_run()
+        self.publish(versions, version_dir)
+        print("Completed Generating Scenarios!")
 
-        print(f"Generating {self.num_scens} scenarios!")
-        for i in range(self.num_scens): #determine how many scenarios are produced by changing range
-            np.random.seed(i)
-            self.seed=i
-           
-            if self.type_of_scenario=="Scenario_3":
+        if self.constraints:
+            for zone, rate in self.acceptance_rates().items():
+                scenarios, attempts, rejected = self.placement_stats[zone]
+                print(f"{zone}: {rate:.1%} of draws accepted, {rejected} of {scenarios} scenarios rejected")
 
-                #generate target
-                self.gen_target()
-               
-                #generate sam
-                self.gen_sam()
 
-                #generate jet
-                self.gen_jet()
+    def queue_batch(self, pipeline, manifest, batch, scripts, range_telemetry, output_mode):
+        """
+        Hands the lua files of a batch to the writer threads of a WritePipeline in chunks of WRITE_CHUNK, then queues its commit
+        In archive mode the scripts go to the commit instead, the archives have to be appended to in seed order
+        """
+        writes = []
+        if output_mode == "files":
+            rows = np.flatnonzero(batch.accepted)
+            file_names = [self.lua_file_name(batch, row) for row in rows]
+            splits = [self.splits[split] for split in batch.split_idx[rows]]
+            for i in range(0, len(rows), WRITE_CHUNK):
+                write_telemetry = None if self.telemetry is None else self.telemetry.empty_copy()
+                writes.append(pipeline.submit_write(_write_lua_files, self.lua_renderer, file_names[i:i+WRITE_CHUNK],
+                                                    scripts[i:i+WRITE_CHUNK], splits[i:i+WRITE_CHUNK], write_telemetry))
+            scripts = None
 
-                #generate the lua script
-                self.gen_lua_script()
-               
-                #generate csv file
-                self.gen_csv_file()
+        pipeline.submit_commit(writes, self.commit_batch, manifest, batch, scripts, range_telemetry)
 
-            else:
 
-                #generate sam
-                self.gen_sam()
+    def commit_batch(self, write_telemetry, manifest, batch, scripts=None, range_telemetry=None):
+        """
+        Writes the metadata (and archived scripts) of a batch whose lua files are on disk and checkpoints it, run by the pipeline's committer thread
+        write_telemetry is what the writer threads recorded for the batch
+        """
+        self.gen_output(batch, scripts, range_telemetry)
+        for telemetry in write_telemetry:
+            if telemetry is not None:
+                self.telemetry.merge(telemetry)
+        self.checkpoint(manifest, batch)
+
 
-                #generate jet
-                self.gen_jet()
+    def run_manifest(self, version_dir):
+        """
+        Returns the RunManifest of the generator type in a version
+        """
+        return RunManifest(Path(version_dir) / "metadata" / f"{self.type_of_scenario}_manifest.json")
 
-                #generate target
-                self.gen_target()
 
-                #generate the lua script
-                self.gen_lua_script()
-               
-                #generate csv file
-                self.gen_csv_file()
+    def publish(self, versions, version_dir):
+        """
+        Switches the current version of the generator type to version_dir and deletes the versions it replaced in the background
+        """
+        versions.publish(version_dir)
+        versions.collect_garbage()
+        print(f"Published {version_dir}")
 
-        print("Completed Generating Scenarios!")
+
+    def close_outputs(self):
+        """
+        Closes the metadata, store and archive writers opened by generate_scenario and counts the files they opened
+        """
+        writers = [self.store_writer] + ([] if self.metadata_writer is None else [self.metadata_writer]) + getattr(self, "archive_writers", [])
+        for writer in writers:
+            writer.close()
+            if self.telemetry is not None:
+                self.telemetry.count("opens", writer.opens)
+        self.archive_writers = []
+
+
+    def finish_statistics(self, metadata_dir):
+        """
+        Writes the last snapshot of the run statistics, if they are kept
+        """
+        if self.statistics is not None:
+            self.write_statistics(metadata_dir)
+
+
+    def write_statistics(self, metadata_dir):
+        """
+        Writes a snapshot of the run statistics
+        """
+        self.statistics.write(metadata_dir, self.type_of_scenario)
+        if self.telemetry is not None:
+            # the json and the npz of the snapshot
+            self.telemetry.count("opens", 2)
+
+
+    def finish_telemetry(self, metadata_dir):
+        """
+        Stops the telemetry sink of the run, if there is one, and writes its summary next to the metadata
+        """
+        if self.telemetry is None:
+            return
+        self.telemetry.stop()
+        self.telemetry.write(metadata_dir / f"{self.type_of_scenario}_telemetry.json")
+        print(f"Wrote telemetry to {metadata_dir / f'{self.type_of_scenario}_telemetry.json'}")
+
+
+    def checkpoint(self, manifest, batch):
+        """
+        Flushes everything written for a batch and records its seed range in the manifest, so a crash after this point never has to redo it
+        """
+        if self.telemetry is not None:
+            start = time.perf_counter()
+
+        self.store_writer.flush()
+        file_sizes = self.store_writer.file_sizes()
+        if self.metadata_writer is not None:
+            self.metadata_writer.flush()
+            file_sizes.update(self.metadata_writer.file_sizes())
+        for archive_writer in getattr(self, "archive_writers", []):
+            archive_writer.flush()
+            file_sizes.update(archive_writer.file_sizes())
+
+        manifest.record_range(int(batch.seeds[0]), int(batch.seeds[-1]) + 1, batch.digest(), file_sizes)
+        if self.telemetry is not None:
+            # the manifest is saved through a fresh temp file
+            self.telemetry.count("opens")
+
+        if self.statistics is not None and self.statistics.snapshot_due(self.statistics_every):
+            self.write_statistics(self.output_dir / "metadata")
+
+        if self.telemetry is not None:
+            self.telemetry.record_stage("checkpoint", time.perf_counter() - start)
+
+
+    def gen_output(self, batch, scripts=None, range_telemetry=None):
+        """
+        Writes what is left of a batch after the worker is done with it, the packed scripts if there are any and the metadata
+        range_telemetry is what the worker recorded for the batch, it is merged into the telemetry sink of the run
+        """
+        self.record_acceptance(batch)
+        if range_telemetry is not None:
+            self.telemetry.merge(range_telemetry)
+
+        # scenarios that never passed the constraints are not written
+        if not batch.accepted.all():
+            batch = batch.select(np.flatnonzero(batch.accepted))
+
+        if scripts is not None:
+            if self.telemetry is not None:
+                start = time.perf_counter()
+            for seed, split, script in zip(batch.seeds.tolist(), batch.split_idx.tolist(), scripts):
+                self.archive_writers[split].append(seed, script)
+            if self.telemetry is not None:
+                self.telemetry.record_stage("write_archive", time.perf_counter() - start)
+                for split, script in zip(batch.split_idx.tolist(), scripts):
+                    self.telemetry.record_file(self.splits[split], len(script))
+
+        self.store_writer.write_batch(batch, self)
+
+        if self.statistics is not None:
+            if self.telemetry is not None:
+                start = time.perf_counter()
+            self.statistics.update_batch(batch)
+            if self.telemetry is not None:
+                self.telemetry.record_stage("statistics", time.perf_counter() - start)
+
+        #generate csv file
+        if self.metadata_writer is not None:
+            self.gen_csv_file(batch)
+
+
+    def __getstate__(self):
+        """
+        Leaves the open metadata, store and archive writers behind when the generator is sent to a worker process
+        """
+        state = self.__dict__.copy()
+        state.pop("metadata_writer", None)
+        state.pop("store_writer", None)
+        state.pop("statistics", None)
+        state.pop("archive_writers", None)
+        # workers only need to know the run is instrumented, not what it has recorded so far
+        if self.telemetry is not None:
+            state["telemetry"] = self.telemetry.empty_copy()
+        return state
+
+
+def parse_shard(shard):
+    """
+    Turns a shard given as "k/n" or (k, n) into (k, n), None stays None
+    """
+    if shard is None:
+        return None
+    try:
+        k, n = (int(part) for part in (shard.split("/") if isinstance(shard, str) else shard))
+    except ValueError:
+        raise ValueError(f"shard must look like k/n, got '{shard}'") from None
+    if not 0 <= k < n:
+        raise ValueError(f"shard k/n needs 0 <= k < n, got {k}/{n}")
+    return k, n
+
+
+def shard_range(num_scens, k, n):
+    """
+    Returns the (start, stop) block of seeds in [0, num_scens) that belongs to shard k of n
+    """
+    return num_scens * k // n, num_scens * (k + 1) // n
+
+
+def _write_scenario_range(generator, start, stop, output_mode="files", write=True):
+    """
+    Generates seeds [start, stop) with generator and writes their lua scripts, returns the batch so the caller can write the metadata
+    In archive mode, or with write=False, the scripts are only rendered and returned with the batch for the caller to write
+    In store mode there are no scripts, they are rendered from the store when they are needed
+    The third value returned is the range's Telemetry, None unless the generator has a telemetry sink
+    """
+    # the range records into its own telemetry, sent back with the batch and merged by the caller
+    telemetry = None if generator.telemetry is None else generator.telemetry.empty_copy()
+
+    batch = generator.gen_batch(np.arange(start, stop), telemetry)
+    rows = np.flatnonzero(batch.accepted)
+    if telemetry is not None:
+        telemetry.scenarios += len(rows)
+
+    #generate the lua scripts
+    if output_mode == "store":
+        return batch, None, telemetry
+    if output_mode == "archive" or not write:
+        return batch, [generator.gen_lua_script(batch, row, write=False, telemetry=telemetry) for row in rows], telemetry
+
+    for row in rows:
+        generator.gen_lua_script(batch, row, telemetry=telemetry)
+
+    return batch, None, telemetry
+
+
+def _write_lua_files(renderer, file_names, scripts, splits, telemetry=None):
+    """
+    Writes rendered lua scripts to their files, run on a writer thread of a WritePipeline
+    Returns the telemetry the writes were recorded into, if any, so the committer thread can merge it
+    """
+    for file_name, script, split in zip(file_names, scripts, splits):
+        if telemetry is None:
+            renderer.write(file_name, script)
+            continue
+        start = time.perf_counter()
+        renderer.write(file_name, script)
+        telemetry.record_stage("write_lua", time.perf_counter() - start)
+        telemetry.record_file(split, len(script))
+        telemetry.count("opens")
+    return telemetry
 
 
 class LineGen(DefaultGen):
@@ -352,233 +946,156 @@ class LineGen(DefaultGen):
     This class defines a relationship between the SAM sites, the jet and the target such that the jet and target spawn based on the location and direction of the SAM sites.
     The jet remains to the left of the line of SAMs while the target remains to the right, whether they are above or below depends on the SAM sites.
     Attributes:
-        target_lat (float): Latitude of the target.
-        target_long (float): Longitude of the target.
+        num_sams (int): Number of SAM sites in the line.
+        sam1_spacing (float): Distance in degrees between the first and second SAM.
         target_dbid (int): Database ID of the target.
-        jet_lat (float): Latitude of the jet.
-        jet_long (float): Longitude of the jet.
         jet_dbid (int): Database ID of the jet.
-        sam_lat (float): Latitude of the SAM site.
-        sam_long (float): Longitude of the SAM site.
         sam_dbid (int): Database ID of the SAM site.
         csv_file_initiailized (Boolean): Flag for tracking metadata file.
         type_of_scenario (String): Scenario type.
-        self.split (String): Allocation, Train, Test or Validate
+        workers (int): Number of processes generate_scenario spreads the seeds over.
     """
-    def __init__(self, num_sams, sam_dbid, jet_dbid, target_dbid, num_scens, zones: list, csv_file_initialized=False, split=None, seed: int=0):
+
+    sam1_spacing = 2
+
+    def __init__(self, num_sams, sam_dbid, jet_dbid, target_dbid, num_scens, zones: list, csv_file_initialized=False, split=None, seed: int=0, workers: int=1, constraints=None, max_attempts: int=100, zone_weights="uniform"):
         """
         Initialize attributes for Scenario Generator 1
         """
-        super().__init__(sam_dbid, jet_dbid, target_dbid, num_scens, zones, csv_file_initialized, split, seed)
+        super().__init__(sam_dbid, jet_dbid, target_dbid, num_scens, zones, csv_file_initialized, split, seed, workers, constraints, max_attempts, zone_weights)
         self.num_sams=num_sams
         self.type_of_scenario = "Scenario_1"
 
 
-    def gen_sam(self):
+    def config(self):
+        """
+        Returns the parameters that decide what this generator produces, used to check if earlier output can be reused
+        """
+        config = super().config()
+        config["num_sams"] = self.num_sams
+        return config
+
+
+    def gen_sam(self, batch):
         """
         Generates the location of the line of SAMs for generator 1
         The initial SAM is generated within the zone with a uniform probability within defined latitude and longitude coordinates
         The adjacent sams are generated based on the position of the last, the direction is controlled by a randomly generated angle
         """
-        self.sam_lats=[]
-        self.sam_longs=[]
-
         #initial sam
-        self.zone_name, self.sam_zone=random.choice(list(self.zones.items()))
-
-        self.sam0_lat=np.random.uniform(self.sam_zone[0],self.sam_zone[1])
-        self.sam0_long=np.random.uniform(self.sam_zone[2],self.sam_zone[3])
-
-        self.sam_lats.append(self.sam0_lat)
-        self.sam_longs.append(self.sam0_long)
-
-        #second sam (controls direction of the line of sams)
-        self.sam1_angle_degrees=np.random.randint(0,360)
-        sam1_angle=np.radians(self.sam1_angle_degrees)
-        sam1_lat_dis=(2*np.sin(sam1_angle))
-        sam1_lat=self.sam0_lat+sam1_lat_dis
-        self.sam_lats.append(sam1_lat)
-        sam1_long_dis=(2*np.cos(sam1_angle))
-        sam1_long=self.sam0_long+sam1_long_dis
-        self.sam_longs.append(sam1_long)
-
-        #generate the adjacent sams
-        for i in range(self.num_sams-2):
-            sam2_angle=np.random.randint(10,60)
-            sam2_angle=np.radians(sam2_angle)
-            sam2_lat_dis=(2*np.sin(sam2_angle))
-            if sam1_lat_dis>0:
-                sam2_lat=self.sam_lats[-1]+sam2_lat_dis
-                self.sam_lats.append(sam2_lat)
-            else:
-                sam2_lat=self.sam_lats[-1]-sam2_lat_dis
-                self.sam_lats.append(sam2_lat)
-
-            sam2_long_dis=(2*np.cos(sam2_angle))
-            if sam1_long_dis>0:
-                sam2_long=self.sam_longs[-1]+sam2_long_dis
-                self.sam_longs.append(sam2_long)
-            else:
-                sam2_long=self.sam_longs[-1]-sam2_long_dis
-                self.sam_longs.append(sam2_long)
-
-        #sorts lat and long into a new list to use for jet and target locations
-        self.sorted_sam_latitudes=sorted(self.sam_lats)
-        self.sorted_sam_longitudes=sorted(self.sam_longs)
-       
-        self.sam_cords=zip(self.sam_lats, self.sam_longs)
-
-
-    def gen_target(self):
+        sam0_lat, sam0_long = self.zone_index.sample_points(batch.stream, batch.zone_idx, SLOT_SAM_LAT, SLOT_SAM_LONG)
+
+        #second sam (controls direction of the line of sams), the angle is counter clockwise from east
+        batch.sam1_angle_degrees = batch.stream.integers(SLOT_LINE_ANGLE, 0, 360)
+        sam1_angle = np.radians(batch.sam1_angle_degrees)
+        sam1_north = np.sin(sam1_angle)
+        sam1_east = np.cos(sam1_angle)
+
+        #generate the adjacent sams, each one steps 2 degrees further from the last in the direction the second sam went
+        sam2_angle = np.radians(batch.stream.integers(SLOT_ADJACENT_ANGLES, 10, 60, count=max(self.num_sams-2, 0)))
+        sam2_north = 2*KM_PER_DEGREE*np.sin(sam2_angle)*np.where(sam1_north > 0, 1, -1)[:, None]
+        sam2_east = 2*KM_PER_DEGREE*np.cos(sam2_angle)*np.where(sam1_east > 0, 1, -1)[:, None]
+
+        batch.sam_lats = np.empty((len(batch), max(self.num_sams, 2)))
+        batch.sam_longs = np.empty((len(batch), max(self.num_sams, 2)))
+        batch.sam_lats[:, 0] = sam0_lat
+        batch.sam_longs[:, 0] = sam0_long
+        batch.sam_lats[:, 1], batch.sam_longs[:, 1] = offset_point(sam0_lat, sam0_long, self.sam1_spacing*KM_PER_DEGREE*sam1_north,
+                                                                   self.sam1_spacing*KM_PER_DEGREE*sam1_east)
+        for i in range(2, batch.sam_lats.shape[1]):
+            batch.sam_lats[:, i], batch.sam_longs[:, i] = offset_point(batch.sam_lats[:, i-1], batch.sam_longs[:, i-1], sam2_north[:, i-2], sam2_east[:, i-2])
+
+
+    def gen_target(self, batch):
         """
         Generates the location of the target for generator 1
         The target accounts for the direction of the line of SAMs and will always spawn to the right of the line.
         """
-        #the sams will generate in a certain direction based on the second sam's angle, if we think of it like quadrants we can create spawn areas for the target
-        if self.sam1_angle_degrees in range(0,90) or range(180,270): #quad 1 and 3
-            self.target_long=np.random.uniform(self.sorted_sam_longitudes[-2]+2.5, self.sorted_sam_longitudes[-1]+2.5)
-            self.target_lat=np.random.uniform(self.sorted_sam_latitudes[0]-2.5,self.sorted_sam_latitudes[-1]-2.5)
+        #the old quadrant check (`angle in range(0,90) or range(180,270)`) was always true, so every scenario uses the quad 1 and 3 spawn area
+        #a point is picked among the sams and then moved 2.5 degrees south and 2.5 degrees east of it
+        #the longitudes are unwrapped around the first sam so a line across the antimeridian still sorts west to east
+        sorted_sam_latitudes = np.sort(batch.sam_lats, axis=1)
+        sorted_sam_longitudes = np.sort(unwrap_longitude(batch.sam_longs, batch.sam_longs[:, :1]), axis=1)
 
-        elif self.sam1_angle_degrees in range(90,180) or range(270,360): #quad 2 and 4
-            self.target_long=np.random.uniform(self.sorted_sam_longitudes[-2]+2.5, self.sorted_sam_longitudes[-1]+2.5)
-            self.target_lat=np.random.uniform(self.sorted_sam_latitudes[0]+2.5,self.sorted_sam_latitudes[-1]+2.5)
+        anchor_long = batch.stream.uniform(SLOT_TARGET_LONG, sorted_sam_longitudes[:, -2], sorted_sam_longitudes[:, -1])
+        anchor_lat = batch.stream.uniform(SLOT_TARGET_LAT, sorted_sam_latitudes[:, 0], sorted_sam_latitudes[:, -1])
+        batch.target_lat, batch.target_long = offset_point(anchor_lat, anchor_long, -2.5*KM_PER_DEGREE, 2.5*KM_PER_DEGREE)
 
 
-    def gen_jet(self):
+    def gen_jet(self, batch):
         """
         Generates the location of the fighter jet for generator 1
         The jet accounts for the direction of the line of SAMs and will always spawn to the left of the line.
         """
-        #the sams will generate in a certain direction based on the second sam's angle, if we think of it like quadrants we can create spawn areas for the jet
-        if self.sam1_angle_degrees in range(0,90) or range(270,360): #quad 1 and 3
-            self.jet_long=np.random.uniform(self.sorted_sam_longitudes[0]-4, self.sorted_sam_longitudes[0]-2.5)
-            self.jet_lat=np.random.uniform(self.sorted_sam_latitudes[-1]+2.5,self.sorted_sam_latitudes[0]-2.5)
+        #same as the target, the quadrant check always took its first branch
+        #the jet is 2.5 to 4 degrees west of the westmost sam, and anywhere from 2.5 degrees north of the northmost sam to 2.5 degrees south of the southmost
+        sorted_sam_latitudes = np.sort(batch.sam_lats, axis=1)
+        sorted_sam_longitudes = np.sort(unwrap_longitude(batch.sam_longs, batch.sam_longs[:, :1]), axis=1)
+
+        east = batch.stream.uniform(SLOT_JET_LONG, -4, -2.5)*KM_PER_DEGREE
+        u = batch.stream.random(SLOT_JET_LAT)
+        anchor_lat = sorted_sam_latitudes[:, -1] + u*(sorted_sam_latitudes[:, 0] - sorted_sam_latitudes[:, -1])
+        north = (2.5 - 5*u)*KM_PER_DEGREE
+        batch.jet_lat, batch.jet_long = offset_point(anchor_lat, sorted_sam_longitudes[:, 0], north, east)
 
-        elif self.sam1_angle_degrees in range(90,180) or range(270,360): #quad 2 and 4
-            self.jet_long=np.random.uniform(self.sorted_sam_longitudes[0]-4,self.sorted_sam_longitudes[0]-2.5)
-            self.jet_lat=np.random.uniform(self.sorted_sam_latitudes[0]-2.5, self.sorted_sam_latitudes[-1]+2.5)
+
+    def gen_features(self, batch):
+        """
+        Works out the difficulty features of a placed batch for generator 1
+        The line bearing is the direction of the second SAM from the first, clockwise from north like every other bearing
+        """
+        batch.features = scenario_features(batch, line_bearing=(90 - batch.sam1_angle_degrees) % 360)
 
 
-class GapLineGen(DefaultGen):
+class GapLineGen(LineGen):
     """
     Generates Scenario 2 type maps for Command Modern Operations: PE. Scenario 2 includes only 1 target, 1 jet and a mutable number of SAM site. There is a gap (missing SAM) in the line of SAMs.
     This class defines a relationship between the SAM sites, the jet and the target such that the jet and target spawn based on the location and direction of the SAM sites.
     The jet remains to the left of the line of SAMs while the target remains to the right, whether they are above or below depends on the SAM sites.
+    The jet and target are placed the same way as in generator 1.
     Attributes:
-        target_lat (float): Latitude of the target.
-        target_long (float): Longitude of the target.
+        num_sams (int): Number of SAM sites in the line before the gap is made.
+        sam1_spacing (float): Distance in degrees between the first and second SAM.
         target_dbid (int): Database ID of the target.
-        jet_lat (float): Latitude of the jet.
-        jet_long (float): Longitude of the jet.
         jet_dbid (int): Database ID of the jet.
-        sam_lat (float): Latitude of the SAM site.
-        sam_long (float): Longitude of the SAM site.
         sam_dbid (int): Database ID of the SAM site.
         csv_file_initiailized (Boolean): Flag for tracking metadata file.
         type_of_scenario (String): Scenario type.
-        self.split (String): Allocation, Train, Test or Validate
+        workers (int): Number of processes generate_scenario spreads the seeds over.
     """
-    def __init__(self, num_sams, sam_dbid, jet_dbid, target_dbid, num_scens, zones: list, csv_file_initialized=False, split=None, seed: int=0):
+
+    sam1_spacing = 1.5
+
+    def __init__(self, num_sams, sam_dbid, jet_dbid, target_dbid, num_scens, zones: list, csv_file_initialized=False, split=None, seed: int=0, workers: int=1, constraints=None, max_attempts: int=100, zone_weights="uniform"):
         """
         Initialize attributes for Scenario Generator 2
         """
-        super().__init__(sam_dbid, jet_dbid, target_dbid, num_scens, zones, csv_file_initialized, split, seed)
+        super().__init__(num_sams, sam_dbid, jet_dbid, target_dbid, num_scens, zones, csv_file_initialized, split, seed, workers, constraints, max_attempts, zone_weights)
 
-        self.num_sams=num_sams
         self.type_of_scenario = "Scenario_2"
 
 
-    def gen_sam(self):
+    def gen_sam(self, batch):
         """
-        Generates the location of the line of SAMs for generator 1
-        The initial SAM is generated within the zone with a uniform probability within defined latitude and longitude coordinates
-        The adjacent sams are generated based on the position of the last, the direction is controlled by a randomly generated angle
+        Generates the location of the line of SAMs for generator 2
+        The line is generated the same way as generator 1.
         A random SAM is then chosen, and removed from the line in order to create a gap.
         """
- 
-        self.sam_lats=[]
-        self.sam_longs=[]
-
-        #initial sam
-        self.zone_name, self.sam_zone=random.choice(list(self.zones.items()))
-
-        self.sam0_lat=np.random.uniform(self.sam_zone[0],self.sam_zone[1])
-        self.sam0_long=np.random.uniform(self.sam_zone[2],self.sam_zone[3])
-
-        self.sam_lats.append(self.sam0_lat)
-        self.sam_longs.append(self.sam0_long)
-
-        #second sam (controls direction of the line of sams)
-        self.sam1_angle_degrees=np.random.randint(0,360)
-        sam1_angle=np.radians(self.sam1_angle_degrees)
-        sam1_lat_dis=(1.5*np.sin(sam1_angle))
-        sam1_lat=self.sam0_lat+sam1_lat_dis
-        self.sam_lats.append(sam1_lat)
-        sam1_long_dis=(1.5*np.cos(sam1_angle))
-        sam1_long=self.sam0_long+sam1_long_dis
-        self.sam_longs.append(sam1_long)
-
-        #generate the adjacent sams
-        for i in range(self.num_sams-2):
-            sam2_angle=np.random.randint(10,60)
-            sam2_angle=np.radians(sam2_angle)
-            sam2_lat_dis=(2*np.sin(sam2_angle))
-            if sam1_lat_dis>0:
-                sam2_lat=self.sam_lats[-1]+sam2_lat_dis
-                self.sam_lats.append(sam2_lat)
-            else:
-                sam2_lat=self.sam_lats[-1]-sam2_lat_dis
-                self.sam_lats.append(sam2_lat)
-
-            sam2_long_dis=(2*np.cos(sam2_angle))
-            if sam1_long_dis>0:
-                sam2_long=self.sam_longs[-1]+sam2_long_dis
-                self.sam_longs.append(sam2_long)
-            else:
-                sam2_long=self.sam_longs[-1]-sam2_long_dis
-                self.sam_longs.append(sam2_long)
+        super().gen_sam(batch)
 
         #pop a random sam (thats not on the end) in order to create a gap
-        removed_sam=np.random.randint(1, self.num_sams-1)
-
-        self.sam_lats.pop(removed_sam)
-        self.sam_longs.pop(removed_sam)
-
-        #sorts lat and long into a new list to use for jet and target locations
-        self.sorted_sam_latitudes=sorted(self.sam_lats)
-        self.sorted_sam_longitudes=sorted(self.sam_longs)
-       
-        self.sam_cords=zip(self.sam_lats, self.sam_longs)
+        batch.removed_sam = batch.stream.integers(SLOT_REMOVED_SAM, 1, self.num_sams-1)
+        keep = np.arange(self.num_sams)[None, :] != batch.removed_sam[:, None]
 
+        batch.sam_lats = batch.sam_lats[keep].reshape(len(batch), self.num_sams-1)
+        batch.sam_longs = batch.sam_longs[keep].reshape(len(batch), self.num_sams-1)
 
-    def gen_target(self):
-        """
-        Generates the location of the target for generator 1
-        The target accounts for the direction of the line of SAMs and will always spawn to the right of the line.
-        """
-        #the sams will generate in a certain direction based on the second sam's angle, if we think of it like quadrants we can create spawn areas for the target
-        if self.sam1_angle_degrees in range(0,90) or range(180,270): #quad 1 and 3
-            self.target_long=np.random.uniform(self.sorted_sam_longitudes[-2]+2.5, self.sorted_sam_longitudes[-1]+2.5)
-            self.target_lat=np.random.uniform(self.sorted_sam_latitudes[0]-2.5,self.sorted_sam_latitudes[-1]-2.5)
 
-        elif self.sam1_angle_degrees in range(90,180) or range(270,360): #quad 2 and 4
-            self.target_long=np.random.uniform(self.sorted_sam_longitudes[-2]+2.5, self.sorted_sam_longitudes[-1]+2.5)
-            self.target_lat=np.random.uniform(self.sorted_sam_latitudes[0]+2.5,self.sorted_sam_latitudes[-1]+2.5)
-
-
-    def gen_jet(self):
+    def gen_features(self, batch):
         """
-        Generates the location of the fighter jet for generator 1
-        The jet accounts for the direction of the line of SAMs and will always spawn to the left of the line. the location of the jet for generator 2
+        Works out the difficulty features of a placed batch for generator 2, the gap is the distance between the SAMs either side of it
         """
-        #the sams will generate in a certain direction based on the second sam's angle, if we think of it like quadrants we can create spawn areas for the jet
-        if self.sam1_angle_degrees in range(0,90) or range(270,360): #quad 1 and 3
-            self.jet_long=np.random.uniform(self.sorted_sam_longitudes[0]-4, self.sorted_sam_longitudes[0]-2.5)
-            self.jet_lat=np.random.uniform(self.sorted_sam_latitudes[-1]+2.5,self.sorted_sam_latitudes[0]-2.5)
-
-        elif self.sam1_angle_degrees in range(90,180) or range(270,360): #quad 2 and 4
-            self.jet_long=np.random.uniform(self.sorted_sam_longitudes[0]-4,self.sorted_sam_longitudes[0]-2.5)
-            self.jet_lat=np.random.uniform(self.sorted_sam_latitudes[0]-2.5, self.sorted_sam_latitudes[-1]+2.5)
+        batch.features = scenario_features(batch, gap_km=opening_width(batch), line_bearing=(90 - batch.sam1_angle_degrees) % 360)
 
 
 class CircleGen(DefaultGen):
@@ -586,69 +1103,79 @@ class CircleGen(DefaultGen):
     Generates Scenario 3 type maps for Command Modern Operations: PE. Scenario 3 includes only 1 target, 1 jet and a mutable number of SAM sites. This Scenario creates a circle of SAMs around the target.
     This class defines a relationship between the target, the SAM sites, and the jet, such that the SAMs spawn in a circle around the target and the jet spawns outside of the circle of SAMs.
     Attributes:
-        target_lat (float): Latitude of the target.
-        target_long (float): Longitude of the target.
+        num_sams (int): Number of SAM sites in the circle before the opening is made.
+        radius (float): Radius of the circle of SAMs in degrees of arc.
         target_dbid (int): Database ID of the target.
-        jet_lat (float): Latitude of the jet.
-        jet_long (float): Longitude of the jet.
         jet_dbid (int): Database ID of the jet.
-        sam_lat (float): Latitude of the SAM site.
-        sam_long (float): Longitude of the SAM site.
         sam_dbid (int): Database ID of the SAM site.
         csv_file_initiailized (Boolean): Flag for tracking metadata file.
         type_of_scenario (String): Scenario type.
-        self.split (String): Allocation, Train, Test or Validate
+        workers (int): Number of processes generate_scenario spreads the seeds over.
     """
-    def __init__(self, num_sams, desired_radius, sam_dbid, jet_dbid, target_dbid, num_scens, zones, csv_file_initialized=False, split=None, seed=0 ):
+
+    # the circle is built around the target, so the target has to be placed first
+    placement_order = ("gen_target", "gen_sam", "gen_jet")
+
+    def __init__(self, num_sams, desired_radius, sam_dbid, jet_dbid, target_dbid, num_scens, zones, csv_file_initialized=False, split=None, seed=0, workers=1, constraints=None, max_attempts=100, zone_weights="uniform"):
         """
         Initialize attributes for Scenrio Genrator 3
         """
-        super().__init__(sam_dbid, jet_dbid, target_dbid, num_scens, zones, csv_file_initialized, split, seed)
-       
+        super().__init__(sam_dbid, jet_dbid, target_dbid, num_scens, zones, csv_file_initialized, split, seed, workers, constraints, max_attempts, zone_weights)
+
         self.type_of_scenario = "Scenario_3"
         self.num_sams=num_sams
         self.radius=desired_radius
 
 
-    def gen_target(self):
+    def config(self):
+        """
+        Returns the parameters that decide what this generator produces, used to check if earlier output can be reused
+        """
+        config = super().config()
+        config["num_sams"] = self.num_sams
+        config["radius"] = self.radius
+        return config
+
+
+    def gen_target(self, batch):
         """
         Generate the target for generator 3
         The target is generated within the zone with a uniform probability within defined latitude and longitude coordinates.
         """
-        self.zone_name, self.sam_zone=random.choice(list(self.zones.items()))
-
-        self.target_lat=np.random.uniform(self.sam_zone[0],self.sam_zone[1])
-        self.target_long=np.random.uniform(self.sam_zone[2],self.sam_zone[3])
+        batch.target_lat, batch.target_long = self.zone_index.sample_points(batch.stream, batch.zone_idx, SLOT_TARGET_LAT, SLOT_TARGET_LONG)
 
 
-    def gen_sam(self):
+    def gen_sam(self, batch):
         """
         Generate the circle of SAMs surrounding the target for generator 3
         The SAMs generate around the target based on the given radius and amount of SAMs desired.
         """
         theta=np.linspace(0,2*np.pi, self.num_sams, endpoint=False)
 
-        sam_longs=self.target_long+self.radius*np.cos(theta) #longitudes of SAMs generated
-        sam_lats=self.target_lat+self.radius*np.sin(theta) #latitudes of SAMs generated
+        #theta goes counter clockwise from east, bearings go clockwise from north
+        bearings=90-np.degrees(theta)
+        sam_lats, sam_longs = destination_point(batch.target_lat[:, None], batch.target_long[:, None], bearings[None, :], self.radius*KM_PER_DEGREE)
 
-        removed_sam=np.random.randint(0,self.num_sams-1) #randomly removed SAM in order to create an opening
-        self.sam_lats=np.delete(sam_lats, removed_sam)
-        self.sam_longs=np.delete(sam_longs, removed_sam)
+        batch.removed_sam = batch.stream.integers(SLOT_REMOVED_SAM, 0, self.num_sams-1) #randomly removed SAM in order to create an opening
+        keep = np.arange(self.num_sams)[None, :] != batch.removed_sam[:, None]
 
-        self.sam_lats=[float(x) for x in self.sam_lats]
-        self.sam_longs=[float(x) for x  in self.sam_longs]
-       
-        self.sam_coordinates=zip(self.sam_lats, self.sam_longs)
+        batch.sam_lats = sam_lats[keep].reshape(len(batch), self.num_sams-1)
+        batch.sam_longs = sam_longs[keep].reshape(len(batch), self.num_sams-1)
 
 
-    def gen_jet(self):
+    def gen_jet(self, batch):
         """
         Generates the location of the jet outside of the circle of SAMs
         The jet uses the radius of the circle of SAMs and a randomly generated angle to determine where to generate.
         """
-        jet_angle=np.random.randint(0,360)
-        jet_radius=np.random.uniform(self.radius+3,self.radius+4)
-        jet_lat_dis=jet_radius*np.sin(jet_angle)
-        self.jet_lat=self.target_lat+jet_lat_dis
-        jet_long_dis=jet_radius*np.cos(jet_angle)
-        self.jet_long=self.target_long+jet_long_dis
+        jet_angle = batch.stream.integers(SLOT_JET_ANGLE, 0, 360)
+        jet_radius = batch.stream.uniform(SLOT_JET_RADIUS, self.radius+3, self.radius+4)
+        #the angle is in degrees, it used to go into np.sin as if it were radians
+        batch.jet_lat, batch.jet_long = destination_point(batch.target_lat, batch.target_long, 90-jet_angle, jet_radius*KM_PER_DEGREE)
+
+
+    def gen_features(self, batch):
+        """
+        Works out the difficulty features of a placed batch for generator 3, the gap is the width of the opening in the circle
+        """
+        batch.features = scenario_features(batch, gap_km=opening_width(batch))
@@ -0,0 +1,221 @@
+#generates a mixed curriculum of scenario types in one run, from a json or toml spec such as 40% LineGen with 4 to 8 SAMs and 30% CircleGen at radius 6
+#every seed is handed to one generator of the mix, all of them share one versioned output, one metadata file, one manifest and one worker pool
+#run from the repository root: python scenario_mix.py mix.json [--workers 4] [--num-scens 100000] [--clear] [--shard k/n]
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from scenario_generator import DefaultGen, LineGen, GapLineGen, CircleGen, ScenarioBatch, SLOT_MIX
+from zone_index import build_alias_table, sample_alias
+
+GENERATORS = {"DefaultGen": DefaultGen, "LineGen": LineGen, "GapLineGen": GapLineGen, "CircleGen": CircleGen}
+
+# generators that take a number of sams, and those that also take a radius, as their first arguments
+SAM_GENERATORS = ("LineGen", "GapLineGen", "CircleGen")
+RADIUS_GENERATORS = ("CircleGen",)
+
+# per scenario arrays copied from the batch of each generator into the batch of the mix
+MIX_COLUMNS = ("zone_idx", "split_idx", "target_lat", "target_long", "jet_lat", "jet_long", "attempts", "accepted", "features")
+
+# settings of a spec that are passed on to generate_scenario
+RUN_SETTINGS = ("batch_size", "sam_layout", "flush_every", "output_mode", "writer_threads", "max_pending_batches", "script_layout")
+
+
+class ScenarioMix(DefaultGen):
+    """
+    Generates a mix of scenario types as if it was one generator, so the mix goes through the usual generate_scenario.
+    Each seed is assigned to one of the generators with an alias table drawn from its own stream slot and is then placed
+    by that generator, so a scenario of the mix is exactly the scenario its generator makes for the same seed on its own.
+    The generators can make different numbers of SAMs, the SAM arrays of a batch are padded with NaN to max_sams and
+    the batch carries num_sams and scen_type for every row (the metadata and lua scripts only use the real SAMs).
+    Attributes:
+        type_of_scenario (String): Name of the mix, its output goes to scenario_data/<name>.
+        generators (list): The generator of every entry of the mix, all sharing the zones, dbids and constraints of the mix.
+        weights (ndarray): Share of the scenarios going to each generator, sums to 1.
+        max_sams (int): Most SAM sites any generator of the mix places, the width of the SAM arrays of a batch.
+    """
+
+    def __init__(self, generators, weights, sam_dbid, jet_dbid, target_dbid, num_scens, zones, name="Mix", seed: int=0, workers: int=1, constraints=None, max_attempts: int=100, zone_weights="uniform"):
+        """
+        Initializes the mix from generators already made with the same zones and dbids, weights does not have to sum to 1
+        """
+        super().__init__(sam_dbid, jet_dbid, target_dbid, num_scens, zones, seed=seed, workers=workers, constraints=constraints, max_attempts=max_attempts, zone_weights=zone_weights)
+
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(generators) == 0 or len(weights) != len(generators):
+            raise ValueError(f"a mix needs at least one generator and one weight per generator, got {len(generators)} generators and {len(weights)} weights")
+        if np.any(weights < 0) or weights.sum() <= 0:
+            raise ValueError(f"mix weights must be non-negative and not all 0, got {weights.tolist()}")
+
+        self.type_of_scenario = name
+        self.generators = list(generators)
+        self.weights = weights / weights.sum()
+        self.prob, self.alias = build_alias_table(self.weights)
+
+        # the number of sams depends on the generator (a gap line has one less than it is given), so ask each one for a scenario
+        self.max_sams = max(generator.gen_batch(np.array([0], dtype=np.uint64)).sam_lats.shape[1] for generator in self.generators)
+
+
+    def config(self):
+        """
+        Returns the parameters that decide what this mix produces, used to check if earlier output can be reused
+        """
+        config = super().config()
+        config["mix"] = [{"weight": float(weight), "generator": generator.config()} for weight, generator in zip(self.weights, self.generators)]
+        return config
+
+
+    def scenario_types(self):
+        """
+        Returns the scenario types this mix makes, in the order its generators were given
+        """
+        return list(dict.fromkeys(generator.type_of_scenario for generator in self.generators))
+
+
+    def gen_batch(self, seeds, telemetry=None):
+        """
+        Assigns every seed in seeds to a generator of the mix and returns the scenarios of all of them as one ScenarioBatch
+        """
+        batch = ScenarioBatch(seeds)
+        batch.generator_idx = sample_alias(batch.stream.random(SLOT_MIX), self.prob, self.alias)
+
+        n = len(batch)
+        batch.sam_lats = np.full((n, self.max_sams), np.nan)
+        batch.sam_longs = np.full((n, self.max_sams), np.nan)
+        batch.num_sams = np.zeros(n, dtype=np.int64)
+        batch.scen_type = np.empty(n, dtype=object)
+
+        for index, generator in enumerate(self.generators):
+            rows = np.flatnonzero(batch.generator_idx == index)
+            if len(rows) == 0:
+                continue
+            part = generator.gen_batch(batch.seeds[rows], telemetry)
+
+            for name in MIX_COLUMNS:
+                value = getattr(part, name)
+                if name not in vars(batch):
+                    setattr(batch, name, np.zeros(n, dtype=value.dtype))
+                getattr(batch, name)[rows] = value
+
+            num_sams = part.sam_lats.shape[1]
+            batch.sam_lats[rows, :num_sams] = part.sam_lats
+            batch.sam_longs[rows, :num_sams] = part.sam_longs
+            batch.num_sams[rows] = num_sams
+            batch.scen_type[rows] = generator.type_of_scenario
+
+        return batch
+
+
+    def lua_file_name(self, batch, row):
+        """
+        Path the lua script of a scenario of a batch is written to, the scripts of each scenario type keep their own folder
+        """
+        type_of_scenario = batch.scen_type[row]
+        return self.output_dir / self.splits[batch.split_idx[row]] / type_of_scenario / f"{type_of_scenario}_{int(batch.seeds[row])}.lua"
+
+
+def load_spec(path):
+    """
+    Reads a mix spec from a .json or .toml file
+    """
+    if str(path).endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError: # python < 3.11
+            import tomli as tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def expand_entry(entry):
+    """
+    Turns one entry of a spec's mix into (generator name, generator arguments, weight) variants
+    num_sams is a number or an inclusive [low, high] range, a range is split into one variant per number of sams sharing the entry's weight evenly
+    """
+    name = entry.get("generator")
+    if name not in GENERATORS:
+        raise ValueError(f"generator must be one of {list(GENERATORS)}, got '{name}'")
+    weight = float(entry.get("weight", 1))
+
+    if name not in SAM_GENERATORS:
+        return [(name, [], weight)]
+    if "num_sams" not in entry:
+        raise ValueError(f"{name} needs num_sams")
+    if name in RADIUS_GENERATORS and "radius" not in entry:
+        raise ValueError(f"{name} needs a radius")
+
+    num_sams = entry["num_sams"]
+    counts = list(range(num_sams[0], num_sams[1] + 1)) if isinstance(num_sams, list) else [num_sams]
+    if not counts:
+        raise ValueError(f"num_sams range of {name} is empty, got {num_sams}")
+    radius = [entry["radius"]] if name in RADIUS_GENERATORS else []
+    return [(name, [count] + radius, weight / len(counts)) for count in counts]
+
+
+def generator_arguments(spec, num_scens=None):
+    """
+    Returns the keyword arguments every generator of a spec shares: dbids, num_scens, zones, seed, max_attempts and zone_weights
+    """
+    num_scens = spec.get("num_scens", 0) if num_scens is None else num_scens
+    return dict(sam_dbid=spec["sam_dbid"], jet_dbid=spec["jet_dbid"], target_dbid=spec["target_dbid"], num_scens=num_scens, zones=spec["zones"],
+                seed=spec.get("seed", 0), max_attempts=spec.get("max_attempts", 100), zone_weights=spec.get("zone_weights", "uniform"))
+
+
+def build_generator(entry, arguments):
+    """
+    Makes the generator one entry of a spec describes, the entry must not use a range of num_sams
+    """
+    variants = expand_entry(entry)
+    if len(variants) != 1:
+        raise ValueError(f"a single generator needs a single num_sams, got {entry.get('num_sams')}")
+    name, args, weight = variants[0]
+    return GENERATORS[name](*args, **arguments)
+
+
+def build_mix(spec, workers=None, num_scens=None):
+    """
+    Makes the ScenarioMix a spec describes, workers and num_scens override the spec
+    """
+    workers = spec.get("workers", 1) if workers is None else workers
+    arguments = generator_arguments(spec, spec["num_scens"] if num_scens is None else num_scens)
+
+    generators = []
+    weights = []
+    for entry in spec["mix"]:
+        for name, args, weight in expand_entry(entry):
+            generators.append(GENERATORS[name](*args, **arguments))
+            weights.append(weight)
+
+    return ScenarioMix(generators, weights, name=spec.get("name", "Mix"), workers=workers, **arguments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a mixed curriculum of scenario types described by a json or toml spec")
+    parser.add_argument("spec", help="json or toml file describing the mix")
+    parser.add_argument("--workers", type=int, default=None, help="processes to generate with, overrides the spec")
+    parser.add_argument("--num-scens", type=int, default=None, help="scenarios to generate, overrides the spec")
+    parser.add_argument("--clear", action="store_true", help="start again instead of extending or resuming earlier output")
+    parser.add_argument("--shard", default=None, help="only generate shard k of n (k/n), merge the shards with merge_shards.py")
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    mix = build_mix(spec, args.workers, args.num_scens)
+    for weight, generator in zip(mix.weights, mix.generators):
+        print(f"{generator.type_of_scenario} ({type(generator).__name__}, num_sams={getattr(generator, 'num_sams', 1)}): {weight:.1%}")
+
+    if args.clear:
+        mix.clear_files_in_directories()
+    # the sam count changes from scenario to scenario, so the sams get their own rows unless the spec asks otherwise
+    settings = {"sam_layout": "long"}
+    settings.update({name: spec[name] for name in RUN_SETTINGS if name in spec})
+    mix.generate_scenario(shard=args.shard, **settings)
+    print(f"Mix written to {os.path.join('scenario_data', mix.type_of_scenario)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#counter-based random draws for the scenario generators
+#every draw is a hash of (scenario seed, slot, column), so a scenario comes out the same no matter which batch, chunk or process generated it
+
+import numpy as np
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix(x):
+    """
+    SplitMix64 finalizer applied element-wise to a uint64 array (wrapping arithmetic is intended)
+    """
+    x = x + _GOLDEN
+    x = (x ^ (x >> np.uint64(30))) * _MIX_1
+    x = (x ^ (x >> np.uint64(27))) * _MIX_2
+    return x ^ (x >> np.uint64(31))
+
+
+class ScenarioStream():
+    """
+    Vectorized random draws for a batch of scenarios, one independent stream per scenario seed.
+    Each draw is addressed by a slot number (what the draw is for) and, for multi-valued draws, a column,
+    instead of by the order the draws are made in.
+    A non-zero attempt gives every seed a fresh stream, used to redraw scenarios that were rejected.
+    Attributes:
+        seeds (ndarray): Seeds of the scenarios in the batch as uint64, the dtype of the seed column of the store, shape (N,).
+        attempt (int): Which redraw of the seeds this stream is for, 0 is the first draw.
+    """
+
+    def __init__(self, seeds, attempt=0):
+        """
+        Initializes the per-scenario keys for the given seeds
+        """
+        self.seeds = np.atleast_1d(np.asarray(seeds, dtype=np.uint64))
+        self.attempt = attempt
+        self._keys = _mix(self.seeds)
+        if attempt:
+            self._keys = _mix(self._keys ^ _mix(np.atleast_1d(np.uint64(attempt))))
+
+
+    def random(self, slot, count=None):
+        """
+        Uniform floats in [0, 1), shape (N,) or (N, count) if count is given
+        """
+        keys = _mix(self._keys ^ np.uint64(slot))
+        if count is not None:
+            keys = _mix(keys[:, None] + np.arange(count, dtype=np.uint64)[None, :])
+        else:
+            keys = _mix(keys)
+        return (keys >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+
+    def uniform(self, slot, low, high, count=None):
+        """
+        Uniform floats between low and high, where low and high may be per-scenario arrays
+        """
+        return low + self.random(slot, count) * (np.subtract(high, low))
+
+
+    def integers(self, slot, low, high, count=None):
+        """
+        Uniform integers in [low, high)
+        """
+        return low + np.floor(self.random(slot, count) * (high - low)).astype(np.int64)
+
+
+    def choice(self, slot, weights):
+        """
+        Index into weights for each scenario, picked with probability proportional to its weight
+        """
+        cumulative = np.cumsum(weights, dtype=np.float64)
+        picks = np.searchsorted(cumulative / cumulative[-1], self.random(slot), side="right")
+        return np.minimum(picks, len(cumulative) - 1)
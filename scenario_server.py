@@ -0,0 +1,322 @@
+#long-lived local scenario service, keeps warm generators in memory and answers "scenario type T, seed S" over a tcp port or a unix socket
+#so a training environment can generate the scenario it needs at reset time instead of reading it from millions of pre-generated files
+#run from the repository root: python scenario_server.py server.json [--port 7878 | --socket scenarios.sock] [--cache-size 4096]
+#
+#the protocol is one json object per line each way, requests look like
+#  {"type": "Scenario_1", "seed": 17, "format": "record"}    format is "record" (the default) or "lua"
+#  {"op": "types"}                                          the scenario types being served
+#  {"op": "stats"}                                          requests, cache hits and misses
+#and every answer has "ok", with the scenario, the lua script, the types or the stats when true and an "error" message when false
+#a seed is a json integer in [0, 2**64), anything else is answered with "ok": false
+
+import argparse
+import json
+import numbers
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from scenario_mix import load_spec, generator_arguments, build_generator, build_mix
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7878
+
+# scenarios kept for replays, a record is a few hundred bytes so the default costs around a megabyte
+DEFAULT_CACHE_SIZE = 4096
+
+RESPONSE_FORMATS = ("record", "lua")
+
+# seeds are stored as unsigned 64 bit integers
+MAX_SEED = 2**64 - 1
+
+
+class ScenarioCache():
+    """
+    Bounded least recently used cache of ScenarioRecords, safe to share between the threads of the server.
+    Attributes:
+        max_size (int): Records kept before the least recently used one is dropped, 0 turns the cache off.
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups that had to generate the scenario.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, key):
+        """
+        Returns the record cached under key and marks it as recently used, None if it is not cached
+        """
+        with self._lock:
+            record = self._records.get(key)
+            if record is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._records.move_to_end(key)
+            return record
+
+
+    def put(self, key, record):
+        """
+        Caches a record, dropping the least recently used ones beyond max_size
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._records[key] = record
+            self._records.move_to_end(key)
+            while len(self._records) > self.max_size:
+                self._records.popitem(last=False)
+
+
+    def __len__(self):
+        return len(self._records)
+
+
+class ScenarioService():
+    """
+    Answers scenario requests from warm generators, independent of any transport so it can also be used in process.
+    Scenarios are generated one seed at a time with generator.get, which gives exactly the scenario a batch run writes for that seed.
+    Attributes:
+        generators (dict): {scenario type: generator} being served.
+        cache (ScenarioCache): Recently served scenarios.
+        requests (int): Scenario requests answered.
+    """
+
+    def __init__(self, generators, cache_size=DEFAULT_CACHE_SIZE):
+        self.generators = dict(generators)
+        self.cache = ScenarioCache(cache_size)
+        self.requests = 0
+        self._started = time.time()
+        self._lock = threading.Lock()
+
+
+    def record(self, type_of_scenario, seed):
+        """
+        Returns the ScenarioRecord of a seed, from the cache or freshly generated
+        Raises ValueError for a type that is not served, a seed that is not an integer in [0, MAX_SEED] or a seed whose scenario never passed the constraints
+        """
+        if type_of_scenario not in self.generators:
+            raise ValueError(f"scenario type '{type_of_scenario}' is not served, the served types are {list(self.generators)}")
+        # json booleans decode to bool, which python counts as an integer
+        if not isinstance(seed, numbers.Integral) or isinstance(seed, bool):
+            raise ValueError(f"seed must be an integer, got {seed!r}")
+        seed = int(seed)
+        if not 0 <= seed <= MAX_SEED:
+            raise ValueError(f"seed must be between 0 and {MAX_SEED}, got {seed}")
+
+        key = (type_of_scenario, seed)
+        record = self.cache.get(key)
+        if record is None:
+            generator = self.generators[type_of_scenario]
+            record = generator.get(seed)
+            if record is None:
+                raise ValueError(f"seed {seed} of '{type_of_scenario}' broke the constraints on every one of its {generator.max_attempts} draws")
+            self.cache.put(key, record)
+        return record
+
+
+    def handle(self, request):
+        """
+        Answers one decoded request with a dict, errors are reported in the answer rather than raised
+        """
+        try:
+            op = request.get("op", "scenario")
+            if op == "types":
+                return {"ok": True, "types": {name: generator.config() for name, generator in self.generators.items()}}
+            if op == "stats":
+                return {"ok": True, "stats": self.stats()}
+            if op != "scenario":
+                raise ValueError(f"unknown op '{op}'")
+
+            response_format = request.get("format", "record")
+            if response_format not in RESPONSE_FORMATS:
+                raise ValueError(f"format must be one of {RESPONSE_FORMATS}, got '{response_format}'")
+            if "type" not in request or "seed" not in request:
+                raise ValueError("a scenario request needs a type and a seed")
+            record = self.record(request["type"], request["seed"])
+            with self._lock:
+                self.requests += 1
+            if response_format == "lua":
+                return {"ok": True, "lua": record.to_lua().decode("utf-8")}
+            return {"ok": True, "scenario": record.to_dict()}
+        except (ValueError, TypeError, OverflowError) as e:
+            return {"ok": False, "error": str(e)}
+
+
+    def stats(self):
+        """
+        Returns the number of requests, the cache hits, misses and size and how long the service has been up
+        """
+        return {"requests": self.requests, "cache_hits": self.cache.hits, "cache_misses": self.cache.misses,
+                "cache_size": len(self.cache), "cache_max_size": self.cache.max_size, "uptime_seconds": time.time() - self._started}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads json requests line by line from one connection and writes one json answer line for each
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                response = self.server.service.handle(request) if isinstance(request, dict) else {"ok": False, "error": "a request must be a json object"}
+            except json.JSONDecodeError as e:
+                response = {"ok": False, "error": f"invalid json: {e}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    """
+    Returns a threaded socketserver answering requests with service, listening on socket_path if given and on host:port otherwise
+    Call serve_forever() on it to start answering
+    """
+    if socket_path is not None:
+        if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+            raise ValueError("unix sockets are not available on this platform, use a port instead")
+        if os.path.exists(socket_path):
+            # left behind by a server that was killed, nothing can be listening on it if connecting fails
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(socket_path)
+                raise ValueError(f"a server is already listening on {socket_path}")
+            except ConnectionRefusedError:
+                os.remove(socket_path)
+        server = _UnixServer(socket_path, _RequestHandler)
+    else:
+        server = _TCPServer((host, port), _RequestHandler)
+    server.service = service
+    return server
+
+
+class ScenarioClient():
+    """
+    Keeps one connection to a scenario server open and sends it requests, used as a context manager.
+    Attributes:
+        address (tuple or String): (host, port) of a tcp server or the path of a unix socket.
+    """
+
+    def __init__(self, address=(DEFAULT_HOST, DEFAULT_PORT), timeout=None):
+        self.address = address
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        if family == socket.AF_INET:
+            # requests are small and answered one at a time, so do not let them wait for more data
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._socket.makefile("rwb")
+
+
+    def request(self, request):
+        """
+        Sends a request dict and returns the answer, raises RuntimeError with the server's message when it is not ok
+        """
+        self._file.write(json.dumps(request).encode("utf-8") + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("the scenario server closed the connection")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response
+
+
+    def scenario(self, type_of_scenario, seed):
+        """
+        Returns a scenario as a dict, the same fields as a ScenarioRecord
+        """
+        return self.request({"type": type_of_scenario, "seed": seed})["scenario"]
+
+
+    def lua(self, type_of_scenario, seed):
+        """
+        Returns the lua script of a scenario
+        """
+        return self.request({"type": type_of_scenario, "seed": seed, "format": "lua"})["lua"]
+
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def build_generators(spec):
+    """
+    Makes the generators a server spec describes, {scenario type: generator}
+    The spec has the shared settings of a mix spec (dbids, zones, seed, ...) and "generators": {type: entry}, an entry being like one of a
+    mix (see scenario_mix.py) with a single num_sams. A spec with a "mix" also serves the whole mix under its name
+    """
+    arguments = generator_arguments(spec)
+    generators = {name: build_generator(entry, arguments) for name, entry in spec.get("generators", {}).items()}
+    if "mix" in spec:
+        mix = build_mix(spec, workers=1, num_scens=arguments["num_scens"])
+        generators[mix.type_of_scenario] = mix
+    if not generators:
+        raise ValueError("the spec does not describe any generators, give it \"generators\" or a \"mix\"")
+    return generators
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve scenarios generated on demand from warm generators")
+    parser.add_argument("spec", help="json or toml file describing the generators to serve")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", default=None, help="listen on this unix socket instead of a port")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="recently served scenarios kept for replays")
+    args = parser.parse_args()
+
+    service = ScenarioService(build_generators(load_spec(args.spec)), args.cache_size)
+    # the first scenario of every type warms up numpy and the generator before a client is waiting on it
+    for type_of_scenario, generator in service.generators.items():
+        generator.gen_batch(np.array([0], dtype=np.uint64))
+
+    server = make_server(service, args.host, args.port, args.socket)
+    print(f"Serving {list(service.generators)} on {args.socket or f'{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+        print("Scenario server stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+#memory-mapped binary store of a generation run, written next to the metadata by every generator
+#one fixed dtype row per scenario goes into <type>.scen, the SAM coordinates of every scenario back to back into <type>.sams and where the
+#SAMs of each row start into <type>.offsets, so a store of any size opens as three NumPy arrays without parsing anything
+#the difficulty features of every row go into <type>.features in row order (see difficulty_features.py)
+#the csv metadata and the lua scripts are views of the store that can be rendered from it on demand (see ScenarioStore)
+
+import bisect
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from lua_renderer import LuaRenderer
+
+# 2 added the sam spacing, gap, line bearing and difficulty features, stores are only read and appended to with the dtypes they were written with
+STORE_VERSION = 2
+
+# one row per scenario, type, zone and split are indices into the tables in the header
+SCENARIO_DTYPE = np.dtype([("seed", "<u8"), ("target_lat", "<f8"), ("target_long", "<f8"), ("jet_lat", "<f8"), ("jet_long", "<f8"),
+                           ("target_dbid", "<i4"), ("jet_dbid", "<i4"), ("sam_dbid", "<i4"), ("num_sams", "<u2"),
+                           ("zone", "<u2"), ("type", "u1"), ("split", "u1")])
+
+SAM_DTYPE = np.dtype([("lat", "<f8"), ("long", "<f8")])
+
+OFFSET_DTYPE = np.dtype("<i8")
+
+# one row per scenario, distances in km, NaN where a feature does not apply to the scenario type
+FEATURE_DTYPE = np.dtype([("jet_target_km", "<f8"), ("closest_approach_km", "<f8"), ("jet_nearest_sam_km", "<f8"), ("target_nearest_sam_km", "<f8"),
+                          ("sam_spacing_km", "<f8"), ("gap_km", "<f8"), ("line_bearing", "<f8"), ("difficulty", "<f8")])
+
+
+def store_paths(directory, type_of_scenario):
+    """
+    Returns the header, scenario, sam, offset and feature file names of the store for a scenario type in directory
+    """
+    return tuple(os.path.join(directory, f"{type_of_scenario}{suffix}") for suffix in (".store.json", ".scen", ".sams", ".offsets", ".features"))
+
+
+def check_header(header, header_file, features=True):
+    """
+    Raises ValueError if the store of a header was written by a newer version or with other dtypes than this module's
+    A header without feature_dtype is from before features were kept, that only passes with features=False
+    """
+    if header["version"] > STORE_VERSION:
+        raise ValueError(f"{header_file} is store version {header['version']}, this reader only reads up to version {STORE_VERSION}")
+    for name, dtype in (("scenario_dtype", SCENARIO_DTYPE), ("sam_dtype", SAM_DTYPE), ("feature_dtype", FEATURE_DTYPE)):
+        if name == "feature_dtype" and name not in header and not features:
+            continue
+        if name not in header:
+            raise ValueError(f"{header_file} has no {name}, this version writes {dtype.descr}")
+        # go through json so the tuples of the descr compare the same way they are stored
+        if header[name] != json.loads(json.dumps(dtype.descr)):
+            raise ValueError(f"{header_file} was written with a {name} of {header.get(name)}, this version uses {dtype.descr}")
+
+
+def store_exists(directory, type_of_scenario):
+    """
+    Checks if directory holds a store for the scenario type
+    """
+    return os.path.exists(store_paths(directory, type_of_scenario)[0])
+
+
+class StoreWriter():
+    """
+    Appends the accepted scenarios of each batch to the store of a generation run, the files are flushed on checkpoints like the metadata.
+    Attributes:
+        header_file (String): Json with the dtypes and the type, zone and split names the indices in the rows refer to.
+        scenario_file (String): Scenario rows, SCENARIO_DTYPE back to back.
+        sam_file (String): SAM coordinates of every scenario in row order, SAM_DTYPE back to back.
+        offset_file (String): Index into the SAM coordinates of the first SAM of every row plus one past the last SAM, so it is one longer than the rows.
+        feature_file (String): Difficulty features of every row, FEATURE_DTYPE back to back.
+        types (list): Scenario types the rows can have, a mix of generators has several.
+        seed_ordered (Boolean): True while every row has a bigger seed than the one before it, kept in the header so readers can binary search.
+        opens (int): Files the writer has opened, for the run telemetry.
+    """
+
+    def __init__(self, directory, type_of_scenario, types, zone_names, splits, append=False):
+        """
+        Opens the store, with append=True new scenarios go after the ones already in it
+        Appending to a store written with other dtypes raises ValueError, its rows would no longer line up
+        """
+        self.header_file, self.scenario_file, self.sam_file, self.offset_file, self.feature_file = store_paths(directory, type_of_scenario)
+        self.types = list(types)
+        self._type_index = {name: i for i, name in enumerate(self.types)}
+        self.opens = 0
+        os.makedirs(directory, exist_ok=True)
+
+        stored_header = None
+        if append and os.path.exists(self.header_file):
+            with open(self.header_file) as f:
+                stored_header = json.load(f)
+            check_header(stored_header, self.header_file)
+            self.opens += 1
+        append = append and all(os.path.exists(path) for path in (self.scenario_file, self.sam_file, self.offset_file, self.feature_file))
+        self._header = {"version": STORE_VERSION, "scenario_dtype": SCENARIO_DTYPE.descr, "sam_dtype": SAM_DTYPE.descr, "feature_dtype": FEATURE_DTYPE.descr,
+                        "types": self.types, "zones": list(zone_names), "splits": list(splits), "seed_ordered": True}
+
+        # extending a store carries on from its last seed, filling in seeds before it (a gap left by a shard) breaks the seed order
+        self._last_seed = -1
+        if append and stored_header is not None:
+            self._header["seed_ordered"] = stored_header.get("seed_ordered", False)
+            scenarios = _map(self.scenario_file, SCENARIO_DTYPE)
+            self.opens += 1
+            if len(scenarios):
+                self._last_seed = int(scenarios["seed"][-1])
+        self.seed_ordered = self._header["seed_ordered"]
+        self._write_header()
+
+        mode = "ab" if append else "wb"
+        self._scenario_file = open(self.scenario_file, mode)
+        self._sam_file = open(self.sam_file, mode)
+        self._offset_file = open(self.offset_file, mode)
+        self._feature_file = open(self.feature_file, mode)
+        self.opens += 4
+        # the offsets file starts with the 0 the first row's sams start at
+        if self._offset_file.tell() == 0:
+            self._offset_file.write(np.zeros(1, dtype=OFFSET_DTYPE).tobytes())
+        self._num_sam_coords = self._sam_file.tell() // SAM_DTYPE.itemsize
+
+
+    def write_batch(self, batch, generator):
+        """
+        Appends the scenarios of a ScenarioBatch made by generator, batches of a mix carry their own scen_type and num_sams per row
+        The batch has to carry its features (see gen_features in scenario_generator.py)
+        """
+        n = len(batch)
+        rows = np.zeros(n, dtype=SCENARIO_DTYPE)
+        for name, column in (("seed", "seeds"), ("target_lat", "target_lat"), ("target_long", "target_long"),
+                             ("jet_lat", "jet_lat"), ("jet_long", "jet_long"), ("zone", "zone_idx"), ("split", "split_idx")):
+            rows[name] = getattr(batch, column)
+        rows["target_dbid"] = generator.target_dbid
+        rows["jet_dbid"] = generator.jet_dbid
+        rows["sam_dbid"] = generator.sam_dbid
+
+        scen_types = getattr(batch, "scen_type", None)
+        rows["type"] = 0 if scen_types is None else [self._type_index[name] for name in scen_types.tolist()]
+
+        num_sams = getattr(batch, "num_sams", None)
+        sams = np.empty(batch.sam_lats.shape, dtype=SAM_DTYPE)
+        sams["lat"] = batch.sam_lats
+        sams["long"] = batch.sam_longs
+        if num_sams is None:
+            num_sams = np.full(n, batch.sam_lats.shape[1])
+            sams = sams.ravel()
+        else:
+            # the mix pads its sam arrays, only the real sams are stored
+            sams = sams[np.arange(batch.sam_lats.shape[1])[None, :] < num_sams[:, None]]
+        rows["num_sams"] = num_sams
+
+        offsets = self._num_sam_coords + np.cumsum(num_sams, dtype=OFFSET_DTYPE)
+        self._num_sam_coords += len(sams)
+
+        if n and self.seed_ordered and (int(batch.seeds[0]) <= self._last_seed or np.any(np.diff(batch.seeds.astype(np.int64)) <= 0)):
+            self.seed_ordered = False
+        if n:
+            self._last_seed = max(self._last_seed, int(batch.seeds.max()))
+
+        self._scenario_file.write(rows.tobytes())
+        self._sam_file.write(sams.tobytes())
+        self._offset_file.write(offsets.astype(OFFSET_DTYPE).tobytes())
+        self._feature_file.write(np.ascontiguousarray(batch.features, dtype=FEATURE_DTYPE).tobytes())
+
+
+    def flush(self):
+        """
+        Writes everything appended so far to disk
+        """
+        for f in (self._scenario_file, self._sam_file, self._offset_file, self._feature_file):
+            f.flush()
+        if self._header["seed_ordered"] != self.seed_ordered:
+            self._header["seed_ordered"] = self.seed_ordered
+            self._write_header()
+
+
+    def _write_header(self):
+        with open(self.header_file, "w") as f:
+            json.dump(self._header, f, indent=1)
+        self.opens += 1
+
+
+    def file_sizes(self):
+        """
+        Returns the size in bytes of every file of the store, call flush first so it is all on disk
+        """
+        return {self.scenario_file: self._scenario_file.tell(), self.sam_file: self._sam_file.tell(), self.offset_file: self._offset_file.tell(),
+                self.feature_file: self._feature_file.tell()}
+
+
+    def close(self):
+        """
+        Flushes and closes the files of the store
+        """
+        if self._scenario_file.closed:
+            return
+        self.flush()
+        for f in (self._scenario_file, self._sam_file, self._offset_file, self._feature_file):
+            f.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _map(path, dtype, count=None):
+    """
+    Maps a file read only as an array of dtype, np.memmap can not map an empty file so that comes back as an empty array
+    """
+    count = os.path.getsize(path) // dtype.itemsize if count is None else count
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+
+class ScenarioStore():
+    """
+    Memory-maps the store of a scenario type, nothing is read from disk until it is sliced.
+    store[i] is the ScenarioRecord of row i, the csv metadata comes from to_dataframe and the lua of a row from lua(i).
+    Attributes:
+        scenarios (ndarray): One SCENARIO_DTYPE row per scenario, a read only memory map.
+        sam_coords (ndarray): SAM coordinates of every scenario in row order, a read only memory map.
+        offsets (ndarray): The SAMs of row i are sam_coords[offsets[i]:offsets[i + 1]].
+        features (ndarray): One FEATURE_DTYPE row per scenario, None for a store written before features were kept.
+        header (dict): The header json of the store.
+        types, zones, splits (list): Names the type, zone and split indices of the rows refer to.
+    """
+
+    def __init__(self, directory, type_of_scenario):
+        """
+        Maps the store of a scenario type in directory, a store written with other dtypes raises ValueError
+        """
+        header_file, scenario_file, sam_file, offset_file, feature_file = store_paths(directory, type_of_scenario)
+        with open(header_file) as f:
+            header = json.load(f)
+        check_header(header, header_file, features=False)
+
+        self.type_of_scenario = type_of_scenario
+        self.header = header
+        self.types = header["types"]
+        self.zones = header["zones"]
+        self.splits = header["splits"]
+        self.seed_ordered = header.get("seed_ordered", False)
+
+        # a run that stopped between its files can leave one longer than the others, only complete rows are used
+        offsets = _map(offset_file, OFFSET_DTYPE)
+        count = min(os.path.getsize(scenario_file) // SCENARIO_DTYPE.itemsize, max(len(offsets) - 1, 0))
+        has_features = "feature_dtype" in header and os.path.exists(feature_file)
+        if has_features:
+            count = min(count, os.path.getsize(feature_file) // FEATURE_DTYPE.itemsize)
+        self.scenarios = _map(scenario_file, SCENARIO_DTYPE, count)
+        self.features = _map(feature_file, FEATURE_DTYPE, count) if has_features else None
+        self.offsets = offsets[:count + 1]
+        self.sam_coords = _map(sam_file, SAM_DTYPE)
+        self._renderers = {}
+        self._seed_order = None
+
+
+    def __len__(self):
+        return len(self.scenarios)
+
+
+    def sams(self, i):
+        """
+        Returns the SAM latitudes and longitudes of row i as views into the store
+        """
+        sams = self.sam_coords[self.offsets[i]:self.offsets[i + 1]]
+        return sams["lat"], sams["long"]
+
+
+    def seed_rows(self, start, stop):
+        """
+        Returns the rows holding seeds [start, stop), a slice when the store is in seed order
+        That is a binary search with bisect, which only touches the rows it compares where np.searchsorted would first copy the whole
+        seed column out of the map. A store whose gaps were filled in later is out of order, it is sorted once and an index array is returned
+        """
+        seeds = self.scenarios["seed"]
+        if self.seed_ordered:
+            return slice(bisect.bisect_left(seeds, start), bisect.bisect_left(seeds, stop))
+        if self._seed_order is None:
+            self._seed_order = np.argsort(seeds, kind="stable")
+            self._sorted_seeds = np.asarray(seeds)[self._seed_order]
+        return np.sort(self._seed_order[np.searchsorted(self._sorted_seeds, start):np.searchsorted(self._sorted_seeds, stop)])
+
+
+    def get_seed(self, seed):
+        """
+        Returns the row of the scenario with the given seed
+        """
+        rows = self.seed_rows(seed, seed + 1)
+        rows = range(len(self))[rows] if isinstance(rows, slice) else rows
+        if len(rows) == 0:
+            raise KeyError(f"seed {seed} is not in the store")
+        return int(rows[0])
+
+
+    def rows(self, split=None, type_of_scenario=None, zone=None, seeds=None):
+        """
+        Returns the rows matching every filter given, split, type_of_scenario and zone are names and seeds is a (start, stop) range
+        With only seeds (or nothing) given on a store in seed order this is a slice, so indexing the store's arrays with it stays a view
+        """
+        selected = slice(0, len(self)) if seeds is None else self.seed_rows(*seeds)
+        filters = [(name, table.index(value)) for name, table, value in
+                   (("split", self.splits, split), ("type", self.types, type_of_scenario), ("zone", self.zones, zone)) if value is not None]
+        if not filters:
+            return selected
+
+        scenarios = self.scenarios[selected]
+        mask = np.ones(len(scenarios), dtype=bool)
+        for name, index in filters:
+            mask &= scenarios[name] == index
+        if isinstance(selected, slice):
+            return np.flatnonzero(mask) + selected.start
+        return selected[mask]
+
+
+    def sam_arrays(self, rows=slice(None)):
+        """
+        Returns the SAM latitudes and longitudes of rows as two (N, most SAMs) arrays, padded with NaN like sam_arrays in metadata_reader.py
+        """
+        starts = self.offsets[:-1][rows]
+        num_sams = self.scenarios["num_sams"][rows].astype(np.int64)
+        width = int(num_sams.max()) if len(num_sams) else 0
+        lats = np.full((len(num_sams), width), np.nan)
+        longs = np.full((len(num_sams), width), np.nan)
+
+        valid = np.arange(width)[None, :] < num_sams[:, None]
+        coords = self.sam_coords[(starts[:, None] + np.arange(width)[None, :])[valid]]
+        lats[valid] = coords["lat"]
+        longs[valid] = coords["long"]
+        return lats, longs
+
+
+    def to_dataframe(self, rows=slice(None)):
+        """
+        Returns rows as a DataFrame with the columns of the flat metadata csv, what load_metadata in metadata_reader.py returns
+        """
+        scenarios = self.scenarios[rows]
+        df = pd.DataFrame({"scen_type": np.asarray(self.types, dtype=object)[scenarios["type"]], "seed": scenarios["seed"].astype(np.int64),
+                           "split": np.asarray(self.splits, dtype=object)[scenarios["split"]],
+                           "zone": np.asarray(self.zones, dtype=object)[scenarios["zone"]],
+                           "target_lat": scenarios["target_lat"], "target_lon": scenarios["target_long"], "target_dbid": scenarios["target_dbid"],
+                           "jet_lat": scenarios["jet_lat"], "jet_lon": scenarios["jet_long"], "jet_dbid": scenarios["jet_dbid"],
+                           "sam_dbid": scenarios["sam_dbid"], "num_sams": scenarios["num_sams"].astype(np.int64)})
+        lats, longs = self.sam_arrays(rows)
+        for i in range(lats.shape[1]):
+            df[f"sam_{i}_lat"] = lats[:, i]
+            df[f"sam_{i}_lon"] = longs[:, i]
+        return df
+
+
+    def write_csv(self, path, rows=slice(None)):
+        """
+        Writes rows as a flat metadata csv
+        """
+        self.to_dataframe(rows).to_csv(path, index=False)
+
+
+    def write_rows(self, directory, type_of_scenario, rows):
+        """
+        Writes rows, an increasing array of row indices, as a new store for type_of_scenario in directory, returns {file: size}
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        header_file, scenario_file, sam_file, offset_file, feature_file = store_paths(directory, type_of_scenario)
+        with open(header_file, "w") as f:
+            json.dump(self.header, f, indent=1)
+
+        starts, stops = self.offsets[:-1][rows], self.offsets[1:][rows]
+        counts = stops - starts
+        # index of every sam of the kept rows, the position of each sam in its row added to where that row starts
+        sam_rows = np.repeat(starts, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        with open(scenario_file, "wb") as f:
+            f.write(np.ascontiguousarray(self.scenarios[rows]).tobytes())
+        with open(sam_file, "wb") as f:
+            f.write(np.ascontiguousarray(self.sam_coords[sam_rows]).tobytes())
+        with open(offset_file, "wb") as f:
+            f.write(np.concatenate([[0], np.cumsum(counts)]).astype(OFFSET_DTYPE).tobytes())
+        if self.features is not None:
+            with open(feature_file, "wb") as f:
+                f.write(np.ascontiguousarray(self.features[rows]).tobytes())
+        return {path: os.path.getsize(path) for path in (scenario_file, sam_file, offset_file, feature_file) if os.path.exists(path)}
+
+
+    def record(self, i):
+        """
+        Returns row i as a ScenarioRecord
+        """
+        # scenario_generator imports this module to write the store, so the record class is only imported once it is needed
+        from scenario_generator import ScenarioRecord
+
+        row = self.scenarios[i]
+        dbids = (int(row["sam_dbid"]), int(row["jet_dbid"]), int(row["target_dbid"]))
+        if dbids not in self._renderers:
+            self._renderers[dbids] = LuaRenderer(*dbids)
+        lats, longs = self.sams(i)
+        return ScenarioRecord(self.types[row["type"]], int(row["seed"]), self.zones[row["zone"]], self.splits[row["split"]],
+                              float(row["target_lat"]), float(row["target_long"]), float(row["jet_lat"]), float(row["jet_long"]),
+                              tuple(lats.tolist()), tuple(longs.tolist()), self._renderers[dbids])
+
+
+    def lua(self, i):
+        """
+        Renders the lua script of row i as bytes, the same script generate_scenario writes for it with the inline layout
+        """
+        return self.record(i).to_lua()
+
+
+    def __getitem__(self, i):
+        return self.record(i)
@@ -0,0 +1,127 @@
+#producer/consumer pipeline for generate_scenario, the generator keeps making batches while a pool of writer threads writes the lua files
+#one committer thread then appends each batch's metadata and checkpoints it, strictly in the order the batches were handed in
+#both stages are bounded, so a producer that runs ahead of the disk blocks instead of piling batches up in memory
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WritePipeline():
+    """
+    Bounded writer thread pool plus an ordered commit stage, used as a context manager.
+    The first exception raised in any thread stops the pipeline, commits after it are skipped and the error is raised
+    again to the producer from its next submit, or from close() at the latest.
+    Attributes:
+        writer_threads (int): Number of threads writing files.
+        max_pending_writes (int): Write tasks that can be queued or running before submit_write blocks.
+        max_pending_batches (int): Batches that can be waiting for their commit before submit_commit blocks.
+    """
+
+    def __init__(self, writer_threads=4, max_pending_writes=64, max_pending_batches=4):
+        if writer_threads < 1:
+            raise ValueError(f"writer_threads must be at least 1, got {writer_threads}")
+        self.writer_threads = writer_threads
+        self.max_pending_writes = max_pending_writes
+        self.max_pending_batches = max_pending_batches
+
+        self._writers = ThreadPoolExecutor(writer_threads, thread_name_prefix="scenario-writer")
+        # a single thread runs the commits one at a time in the order they were submitted
+        self._committer = ThreadPoolExecutor(1, thread_name_prefix="scenario-committer")
+        self._write_slots = threading.BoundedSemaphore(max_pending_writes)
+        self._batch_slots = threading.BoundedSemaphore(max_pending_batches)
+        self._commits = deque()
+        self._error = None
+        self._error_lock = threading.Lock()
+
+
+    def submit_write(self, function, *args):
+        """
+        Runs function(*args) on a writer thread, blocking while max_pending_writes tasks are already waiting
+        Returns the future of the task
+        """
+        self._acquire(self._write_slots)
+        future = self._writers.submit(function, *args)
+        future.add_done_callback(lambda f: self._finished(f, self._write_slots))
+        return future
+
+
+    def submit_commit(self, writes, function, *args):
+        """
+        Queues function(results of writes, *args) to run on the committer thread once every future in writes is done,
+        blocking while max_pending_batches commits are already waiting
+        """
+        self._acquire(self._batch_slots)
+        future = self._committer.submit(self._commit, writes, function, args)
+        future.add_done_callback(lambda f: self._finished(f, self._batch_slots))
+
+        # keep the futures of commits that have not finished, the done ones have nothing left to report
+        self._commits.append(future)
+        while self._commits and self._commits[0].done():
+            self._commits.popleft()
+        self.raise_if_failed()
+
+
+    def raise_if_failed(self):
+        """
+        Raises the first exception any thread of the pipeline ran into
+        """
+        if self._error is not None:
+            raise self._error
+
+
+    def close(self):
+        """
+        Waits for every queued write and commit to finish and stops the threads, raises the first error if there was one
+        """
+        for future in list(self._commits):
+            future.exception() # waits without raising, the error was already recorded
+        self._committer.shutdown(wait=True)
+        self._writers.shutdown(wait=True)
+        self.raise_if_failed()
+
+
+    def _commit(self, writes, function, args):
+        """
+        Waits for the writes of a batch and commits it, a failed write (or an earlier failure) means the batch is not committed
+        """
+        results = [write.result() for write in writes]
+        self.raise_if_failed()
+        return function(results, *args)
+
+
+    def _acquire(self, slots):
+        """
+        Takes a slot, checking for errors while waiting so the producer never blocks on a pipeline that has stopped
+        """
+        while not slots.acquire(timeout=0.1):
+            self.raise_if_failed()
+
+
+    def _finished(self, future, slots):
+        slots.release()
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            with self._error_lock:
+                if self._error is None:
+                    self._error = error
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return False
+
+        # the producer failed, drop whatever has not started yet and let its exception through
+        with self._error_lock:
+            if self._error is None:
+                self._error = exc_value
+        self._writers.shutdown(wait=True, cancel_futures=True)
+        self._committer.shutdown(wait=True, cancel_futures=True)
+        return False
@@ -0,0 +1,299 @@
+#compiled zone table for the scenario generators, built once when a generator is made
+#zones are lat/lon boxes [lat_a, lat_b, long_a, long_b] or polygons [[lat, long], ...], both are checked up front
+#zones are picked with an alias table (one draw per scenario whatever the number of zones) and polygons are cut into triangles once so points sample in O(1)
+
+import numpy as np
+
+from geodesy import EARTH_RADIUS_KM, KM_PER_DEGREE
+
+# ways zones can be weighted besides a {zone: weight} dict or a list of weights
+ZONE_WEIGHTINGS = ("uniform", "area")
+
+
+def build_alias_table(weights):
+    """
+    Builds Vose's alias table for sampling indices in proportion to weights, returns (prob, alias)
+    Index i is kept with probability prob[i], otherwise alias[i] is used instead
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    n = len(weights)
+    scaled = weights * n / weights.sum()
+    prob = np.ones(n)
+    alias = np.arange(n)
+
+    small = [i for i in range(n) if scaled[i] < 1]
+    large = [i for i in range(n) if scaled[i] >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        prob[less] = scaled[less]
+        alias[less] = more
+        scaled[more] -= 1 - scaled[less]
+        (small if scaled[more] < 1 else large).append(more)
+    # whatever is left over is 1 up to rounding
+    return prob, alias
+
+
+def sample_alias(u, prob, alias, offset=0, count=None):
+    """
+    Turns uniform draws u into indices of an alias table, one draw is enough because the fraction left after picking a column is itself uniform
+    offset and count pick out a sub table when several tables are stored back to back, they may be arrays with one entry per draw
+    """
+    count = len(prob) if count is None else count
+    scaled = u * count
+    column = np.minimum(np.floor(scaled).astype(np.int64), np.asarray(count) - 1)
+    index = offset + column
+    return np.where(scaled - column < prob[index], index, alias[index])
+
+
+def triangulate(vertices):
+    """
+    Cuts a simple polygon, given as (V, 2) lat/long vertices in either winding order, into V-2 triangles by ear clipping
+    Returns a (V-2, 3, 2) array
+    """
+    points = [tuple(vertex) for vertex in np.asarray(vertices, dtype=np.float64).tolist()]
+    if _edges_cross(points):
+        raise ValueError("polygon zone is not a simple polygon (its edges cross)")
+    if _signed_area(np.array(points)) < 0:
+        points.reverse()
+
+    triangles = []
+    while len(points) > 3:
+        for i in range(len(points)):
+            a, b, c = points[i - 1], points[i], points[(i + 1) % len(points)]
+            if _cross(a, b, c) <= 0:
+                continue # reflex corner, can not be an ear
+            others = [p for p in points if p not in (a, b, c)]
+            if any(_in_triangle(p, a, b, c) for p in others):
+                continue
+            triangles.append((a, b, c))
+            del points[i]
+            break
+        else:
+            raise ValueError("polygon zone is not a simple polygon (its edges cross)")
+    triangles.append(tuple(points))
+    return np.array(triangles)
+
+
+def _edges_cross(points):
+    """
+    Checks if any two edges of a polygon that do not share a corner cross each other
+    """
+    edges = [(points[i], points[(i + 1) % len(points)]) for i in range(len(points))]
+    for i in range(len(edges)):
+        for j in range(i + 2, len(edges)):
+            if i == 0 and j == len(edges) - 1:
+                continue # the first and last edge share the first corner
+            (a, b), (c, d) = edges[i], edges[j]
+            if _cross(a, b, c) * _cross(a, b, d) < 0 and _cross(c, d, a) * _cross(c, d, b) < 0:
+                return True
+    return False
+
+
+def _signed_area(points):
+    """
+    Shoelace area in square degrees, positive for counter-clockwise vertices (taking latitude as x)
+    """
+    x, y = points[:, 0], points[:, 1]
+    return 0.5 * (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+def _cross(a, b, c):
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+
+def _in_triangle(p, a, b, c):
+    return _cross(a, b, p) >= 0 and _cross(b, c, p) >= 0 and _cross(c, a, p) >= 0
+
+
+def box_area_km2(lat_low, lat_high, long_low, long_high):
+    """
+    Area of a lat/lon box on the sphere
+    """
+    return EARTH_RADIUS_KM**2 * np.radians(long_high - long_low) * (np.sin(np.radians(lat_high)) - np.sin(np.radians(lat_low)))
+
+
+def triangle_areas_km2(triangles):
+    """
+    Approximate area on the sphere of (T, 3, 2) lat/long triangles, the flat area scaled by the cosine of the centre latitude
+    """
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    flat = 0.5 * np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0]))
+    return flat * KM_PER_DEGREE**2 * np.cos(np.radians(triangles[:, :, 0].mean(axis=1)))
+
+
+class ZoneIndex():
+    """
+    The zones of a generator checked and compiled into arrays, for picking zones and points inside them a whole batch at a time.
+    Attributes:
+        names (list): Zone names, in the order zone indices refer to.
+        is_polygon (ndarray): True for polygon zones, shape (Z,).
+        bounds (ndarray): Bounding box of each zone as lat_low, lat_high, long_low, long_high, shape (Z, 4).
+        areas (ndarray): Area of each zone in square km, shape (Z,).
+        weighting: "uniform", "area" or the user's weights, as given.
+        probabilities (ndarray): Probability of each zone being picked, shape (Z,).
+        triangles (ndarray): Triangles of every polygon zone back to back, shape (T, 3, 2).
+        triangle_offset (ndarray): Index of the first triangle of each zone (0 for boxes), shape (Z,).
+        triangle_count (ndarray): Number of triangles of each zone (0 for boxes), shape (Z,).
+    """
+
+    def __init__(self, zones, weighting="uniform"):
+        """
+        Checks every zone and builds the alias tables, zones is the {name: box or polygon} dict the generators take
+        """
+        if not zones:
+            raise ValueError("at least one zone is needed")
+
+        self.names = list(zones.keys())
+        self.weighting = weighting
+        self.is_polygon = np.zeros(len(self.names), dtype=bool)
+        self.bounds = np.zeros((len(self.names), 4))
+        self.areas = np.zeros(len(self.names))
+        self.triangle_offset = np.zeros(len(self.names), dtype=np.int64)
+        self.triangle_count = np.zeros(len(self.names), dtype=np.int64)
+
+        triangles = []
+        for z, (name, zone) in enumerate(zones.items()):
+            zone = np.asarray(zone, dtype=np.float64)
+            if zone.shape == (4,):
+                self.bounds[z] = self._check_box(name, zone)
+                self.areas[z] = box_area_km2(*self.bounds[z])
+            elif zone.ndim == 2 and zone.shape[1] == 2 and len(zone) >= 3:
+                self._check_coordinates(name, zone[:, 0], zone[:, 1])
+                try:
+                    zone_triangles = triangulate(zone)
+                except ValueError as e:
+                    raise ValueError(f"zone '{name}': {e}") from e
+                zone_areas = triangle_areas_km2(zone_triangles)
+                if zone_areas.sum() <= 0:
+                    raise ValueError(f"zone '{name}' has no area")
+                self.is_polygon[z] = True
+                self.bounds[z] = [zone[:, 0].min(), zone[:, 0].max(), zone[:, 1].min(), zone[:, 1].max()]
+                self.areas[z] = zone_areas.sum()
+                self.triangle_offset[z] = sum(len(t) for t in triangles)
+                self.triangle_count[z] = len(zone_triangles)
+                triangles.append(zone_triangles)
+            else:
+                raise ValueError(f"zone '{name}' must be [lat_a, lat_b, long_a, long_b] or a list of at least 3 [lat, long] vertices, got {zone.tolist()}")
+
+        self.triangles = np.concatenate(triangles) if triangles else np.zeros((0, 3, 2))
+
+        # every polygon gets its own alias table over its triangles, weighted by their area, stored back to back
+        self.triangle_prob = np.ones(len(self.triangles))
+        self.triangle_alias = np.arange(len(self.triangles))
+        for z in np.flatnonzero(self.is_polygon):
+            start, stop = self.triangle_offset[z], self.triangle_offset[z] + self.triangle_count[z]
+            prob, alias = build_alias_table(triangle_areas_km2(self.triangles[start:stop]))
+            self.triangle_prob[start:stop] = prob
+            self.triangle_alias[start:stop] = start + alias
+
+        self.probabilities = self._zone_weights(weighting)
+        self.prob, self.alias = build_alias_table(self.probabilities)
+
+
+    def _check_box(self, name, box):
+        """
+        Checks a box zone and returns it with each pair of bounds low to high
+        """
+        self._check_coordinates(name, box[:2], box[2:])
+        lat_low, lat_high = sorted(box[:2].tolist())
+        long_low, long_high = sorted(box[2:].tolist())
+        if lat_low == lat_high or long_low == long_high:
+            raise ValueError(f"zone '{name}' {box.tolist()} has no area")
+        if box[0] > box[1] or box[2] > box[3]:
+            print(f"Warning: zone '{name}' {box.tolist()} has its bounds high to low, using {[lat_low, lat_high, long_low, long_high]}")
+        return lat_low, lat_high, long_low, long_high
+
+
+    def _check_coordinates(self, name, lats, longs):
+        if np.any(np.abs(lats) > 90) or np.any(np.abs(longs) > 180) or not np.all(np.isfinite(np.concatenate([lats, longs]))):
+            raise ValueError(f"zone '{name}' has coordinates outside of -90 to 90 latitude and -180 to 180 longitude")
+
+
+    def _zone_weights(self, weighting):
+        """
+        Turns the weighting into the probability of each zone
+        """
+        if isinstance(weighting, str):
+            if weighting not in ZONE_WEIGHTINGS:
+                raise ValueError(f"zone weighting must be one of {ZONE_WEIGHTINGS}, a dict or a list, got '{weighting}'")
+            weights = np.ones(len(self.names)) if weighting == "uniform" else self.areas
+        elif isinstance(weighting, dict):
+            unknown = set(weighting) - set(self.names)
+            if unknown:
+                raise ValueError(f"zone weights given for unknown zones {sorted(unknown)}")
+            # zones left out of the dict are never picked
+            weights = np.array([weighting.get(name, 0) for name in self.names], dtype=np.float64)
+        else:
+            weights = np.asarray(weighting, dtype=np.float64)
+            if weights.shape != (len(self.names),):
+                raise ValueError(f"expected {len(self.names)} zone weights, got {len(weights)}")
+
+        if np.any(weights < 0) or weights.sum() <= 0:
+            raise ValueError("zone weights must not be negative and at least one must be above 0")
+        return weights / weights.sum()
+
+
+    def sample_zones(self, stream, slot):
+        """
+        Picks a zone for every scenario of a ScenarioStream, with one draw from slot each
+        """
+        return sample_alias(stream.random(slot), self.prob, self.alias)
+
+
+    def sample_points(self, stream, zone_idx, lat_slot, long_slot):
+        """
+        Picks a point inside the zone of every scenario, returns (lats, longs)
+        Boxes are sampled uniformly in latitude and longitude, polygons pick a triangle by area and then a uniform point in it
+        """
+        bounds = self.bounds[zone_idx]
+        lats = stream.uniform(lat_slot, bounds[:, 0], bounds[:, 1])
+        longs = stream.uniform(long_slot, bounds[:, 2], bounds[:, 3])
+
+        rows = np.flatnonzero(self.is_polygon[zone_idx])
+        if len(rows):
+            zones = zone_idx[rows]
+            u = stream.random(lat_slot, count=3)[rows]
+            triangle = self.triangles[sample_alias(u[:, 0], self.triangle_prob, self.triangle_alias,
+                                                   self.triangle_offset[zones], self.triangle_count[zones])]
+            # the square root keeps the points uniform over the triangle instead of bunching at the first corner
+            r1, r2 = np.sqrt(u[:, 1])[:, None], u[:, 2][:, None]
+            points = (1 - r1) * triangle[:, 0] + r1 * (1 - r2) * triangle[:, 1] + r1 * r2 * triangle[:, 2]
+            lats[rows], longs[rows] = points[:, 0], points[:, 1]
+
+        return lats, longs
+
+
+    def contains(self, zone_idx, lats, longs):
+        """
+        Checks which points are inside their scenario's zone, lats and longs are (N,) or (N, units) with one zone index per row
+        """
+        bounds = self.bounds[zone_idx]
+        if np.ndim(lats) == 2:
+            bounds = bounds[:, None, :]
+        inside = (lats >= bounds[..., 0]) & (lats <= bounds[..., 1]) & (longs >= bounds[..., 2]) & (longs <= bounds[..., 3])
+
+        for z in np.flatnonzero(self.is_polygon):
+            rows = zone_idx == z
+            if not rows.any():
+                continue
+            triangles = self.triangles[self.triangle_offset[z]:self.triangle_offset[z] + self.triangle_count[z]]
+            points = np.stack([lats[rows], longs[rows]], axis=-1)[..., None, :]
+            a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+            # every triangle is counter-clockwise, so a point is inside one if it is left of all three edges
+            in_triangle = ((_edge(a, b, points) >= 0) & (_edge(b, c, points) >= 0) & (_edge(c, a, points) >= 0)).any(axis=-1)
+            inside[rows] &= in_triangle
+        return inside
+
+
+    def describe(self):
+        """
+        Returns the weighting in a form that can go into a generator config
+        """
+        return self.weighting if isinstance(self.weighting, str) else dict(zip(self.names, self.probabilities.tolist()))
+
+
+def _edge(a, b, p):
+    """
+    Vectorized cross product of b - a and p - a, broadcasting the triangles in a and b against the points in p
+    """
+    return (b[..., 0] - a[..., 0]) * (p[..., 1] - a[..., 1]) - (b[..., 1] - a[..., 1]) * (p[..., 0] - a[..., 0])